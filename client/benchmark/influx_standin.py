@@ -0,0 +1,103 @@
+# @file: influx_standin.py
+# @brief: Local stand-in for the InfluxDB write API used by the benchmarks
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class InfluxStandIn(object):
+
+    def __init__(self, latency=0, error_rate=0, seed=0):
+
+        # The number of seconds every request is delayed by
+        self.latency = latency
+
+        # The fraction of writes answered with a server error
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        # While set, every write is answered with 503 Service Unavailable
+        self.outage = False
+
+        self.lock = threading.Lock()
+        self.reset()
+
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                if body:
+                    self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if standin.latency:
+                    time.sleep(standin.latency)
+                self._reply(standin.receive(self.path, body, self.headers.get('Content-Encoding')))
+
+            def do_GET(self):
+                # Health checks and the OpenWeather current conditions
+                if self.path.startswith('/data/2.5/weather'):
+                    body = json.dumps({'main': {'temp': 12.5, 'humidity': 55, 'pressure': 1012},
+                                       'name': 'Benchmark'}).encode()
+                    self._reply(200, body)
+                else:
+                    self._reply(204)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def reset(self):
+        with self.lock:
+            # Writes accepted and rejected, and the points and bytes accepted
+            self.requests = 0
+            self.errors = 0
+            self.points = 0
+            self.bytes = 0
+
+    def receive(self, path, body, encoding):
+        with self.lock:
+            if not path.startswith('/api/v2/write'):
+                return 404
+            if self.outage or (self.error_rate and self.random.random() < self.error_rate):
+                self.errors += 1
+                return 503 if self.outage else 500
+            self.requests += 1
+            self.bytes += len(body)
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        points = body.count(b'\n') + (1 if body and not body.endswith(b'\n') else 0)
+        with self.lock:
+            self.points += points
+        return 204
+
+    def server_config(self, path):
+        # Write a server configuration file pointing the monitor at the stand-in
+        with open(path, 'w') as f:
+            f.write(f"SERVER_IP=127.0.0.1\nINFLUXDB_PORT={self.port}\n"
+                    "INFLUXDB_ADMIN_TOKEN=benchmark\nINFLUXDB_ORG=benchmark\nINFLUXDB_BUCKET=benchmark\n")
+        return path
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='influx-standin', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @file: run_benchmark.py
+# @brief: Throughput and latency benchmarks for the monitor pipeline
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import wait
+from datetime import datetime, timezone
+
+# Run from anywhere, importing the monitor from the client directory
+CLIENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CLIENT_DIR)
+
+from influx_standin import InfluxStandIn
+from env_monitor.datacache import DataCache
+from env_monitor.influx import InfluxDB
+from env_monitor.monitor import Monitor
+from env_monitor.rolling import percentile
+from env_monitor.sensors.bme680 import BME680
+from env_monitor.sensors.sds011 import SDS011
+from env_monitor.sensors.simulated import SYNTHETIC, Synthetic, SimulatedBME680, SimulatedSerial
+
+SCENARIOS = ('pipeline', 'outage', 'cache')
+
+def peak_rss_mib():
+    # Peak resident set size of the benchmark process so far, ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def io_write_bytes():
+    # Bytes this process has caused to be written to storage, None where /proc is not available
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def timed(func, latencies):
+    # Wrap func so the duration of every call is appended to latencies
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+def latency_fields(prefix, latencies):
+    ordered = sorted(latencies)
+    fields = {f'{prefix}_count': len(ordered)}
+    for p in (50, 95, 99):
+        value = percentile(ordered, p)
+        fields[f'{prefix}_p{p}_ms'] = value * 1000 if value is not None else None
+    fields[f'{prefix}_max_ms'] = ordered[-1] * 1000 if ordered else None
+    return fields
+
+def io_delta(start):
+    end = io_write_bytes()
+    return end - start if start is not None and end is not None else None
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=CLIENT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_pipeline(standin, args, workdir, outage=False):
+    # Drive Monitor.run_loop with synthetic sensors as fast as it will go. Each
+    # loop is one sample interval later, so every source is due on every loop
+    name = 'outage' if outage else 'pipeline'
+    standin.reset()
+    key_file = os.path.join(workdir, 'openweather-key')
+    with open(key_file, 'w') as f:
+        f.write('benchmark')
+
+    monitor = Monitor(loglevel=args.loglevel,
+                      openweather_api_key=key_file,
+                      openweather_location_key='Benchmark',
+                      server_config=standin.server_config(os.path.join(workdir, 'server.env')),
+                      cache_file=os.path.join(workdir, name, 'cache.json'),
+                      cache_flush_limit=args.cache_flush_limit,
+                      influx_batch_size=args.batch_size,
+                      influx_flush_interval=args.flush_interval,
+                      concurrent=args.concurrent,
+                      influx_breaker_reset=args.breaker_reset,
+                      wifi_sample_interval=args.sample_interval,
+                      health_interval=args.sample_interval,
+                      sample_interval=args.sample_interval,
+                      bme680_backend=SYNTHETIC,
+                      sds011_backend=SYNTHETIC,
+                      pir_backend=SYNTHETIC,
+                      simulation_seed=args.seed)
+    monitor.openweather.url_base = f"http://127.0.0.1:{standin.port}/data/2.5/weather"
+    monitor.influx.connect()
+    latencies = []
+    monitor.influx.write_api.write = timed(monitor.influx.write_api.write, latencies)
+
+    # The middle third of the loops run while the server is down
+    outage_loops = range(args.loops // 3, 2 * args.loops // 3) if outage else range(0)
+
+    io_start = io_write_bytes()
+    monitor.scheduler.start(now=0)
+    start = time.perf_counter()
+    for loop in range(args.loops):
+        standin.outage = loop in outage_loops
+        monitor.run_loop(loop + 1, now=loop * args.sample_interval)
+        # Sample intervals are far longer than any read, so no read is still in
+        # flight when the next loop starts
+        if args.concurrent:
+            wait(list(monitor.pending.values()))
+    if args.concurrent:
+        while not monitor.results.empty():
+            time.sleep(0.01)
+    standin.outage = False
+    monitor.influx.flush()
+    seconds = time.perf_counter() - start
+
+    # Write back whatever was cached during the outage, or because the network
+    # status had not yet noticed the server was back
+    cached = len(monitor.data_cache)
+    cache_bytes = directory_bytes(os.path.join(workdir, name))
+    start = time.perf_counter()
+    # The circuit breaker may still be holding writes back after the outage
+    while not monitor.influx.available():
+        time.sleep(0.01)
+    if cached:
+        monitor.data_cache.flush(0, monitor.influx.write_batch)
+    replay_seconds = time.perf_counter() - start
+    monitor.cleanup()
+
+    return {
+        'loops': args.loops,
+        'seconds': seconds,
+        'loops_per_sec': args.loops / seconds,
+        'points': standin.points,
+        'points_per_sec': standin.points / (seconds + replay_seconds),
+        'requests': standin.requests,
+        'rejected_requests': standin.errors,
+        'retried_writes': monitor.influx.retried,
+        'circuit_trips': monitor.influx.breaker.trips,
+        'cached_points': cached,
+        'unsent_points': len(monitor.data_cache),
+        'cache_replay_seconds': replay_seconds,
+        'cache_bytes': cache_bytes,
+        'write_bytes': io_delta(io_start),
+        **latency_fields('write', latencies),
+        'peak_rss_mib': peak_rss_mib()
+    }
+
+def synthetic_points(count, seed):
+    # Realistic climate and particle points, rolling statistics included
+    source = Synthetic(seed)
+    bme680 = BME680(device=SimulatedBME680(source))
+    sds011 = SDS011(device=SimulatedSerial(source))
+    points = []
+    for index in range(count):
+        sensor = bme680 if index % 2 else sds011
+        points.append(sensor.get_data(index))
+    return points
+
+def run_cache(standin, args, workdir):
+    # Append points to the cache one at a time, as happens while offline, then
+    # write them all back to the server
+    standin.reset()
+    points = synthetic_points(args.cache_points, args.seed)
+    cache_dir = os.path.join(workdir, 'cache')
+    cache = DataCache(os.path.join(cache_dir, 'cache.json'))
+
+    append_latencies = []
+    append = timed(cache.append, append_latencies)
+    io_start = io_write_bytes()
+    start = time.perf_counter()
+    for point in points:
+        append(point)
+    append_seconds = time.perf_counter() - start
+    cache._sync()
+    write_bytes = io_delta(io_start)
+    cache_bytes = directory_bytes(cache_dir)
+
+    influx = InfluxDB(standin.server_config(os.path.join(workdir, 'server.env')))
+    influx.connect()
+    latencies = []
+    influx.write_api.write = timed(influx.write_api.write, latencies)
+    start = time.perf_counter()
+    cache.flush(0, influx.write_batch)
+    replay_seconds = time.perf_counter() - start
+    unsent = len(cache)
+    cache.close()
+    influx.close()
+
+    return {
+        'points': len(points),
+        'append_seconds': append_seconds,
+        'appends_per_sec': len(points) / append_seconds,
+        **latency_fields('append', append_latencies),
+        'cache_bytes': cache_bytes,
+        'bytes_per_point': cache_bytes / len(points),
+        'write_bytes': write_bytes,
+        'cache_replay_seconds': replay_seconds,
+        'replayed_points': standin.points,
+        'replay_points_per_sec': standin.points / replay_seconds if replay_seconds else None,
+        'unsent_points': unsent,
+        **latency_fields('write', latencies),
+        'peak_rss_mib': peak_rss_mib()
+    }
+
+def compare(results, baseline):
+    # Print the change in every metric found in both runs
+    print(f"\nCompared with {baseline.get('version')} ({baseline.get('timestamp')}):")
+    for scenario, metrics in results['scenarios'].items():
+        for metric, value in metrics.items():
+            before = baseline.get('scenarios', {}).get(scenario, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)):
+                continue
+            change = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+            print(f"  {scenario}.{metric}: {before:.6g} -> {value:.6g} ({change})")
+
+def main():
+    all_args = argparse.ArgumentParser(description='Benchmark the monitor pipeline against a local stand-in for InfluxDB')
+    all_args.add_argument('--scenarios', type=str, default=','.join(SCENARIOS),
+                          help=f'Comma separated scenarios to run (default is {",".join(SCENARIOS)})')
+    all_args.add_argument('--loops', type=int, default=1000,
+                          help='Number of sample loops run by the pipeline and outage scenarios (default is 1000)')
+    all_args.add_argument('--sample-interval', type=int, default=60,
+                          help='Simulated seconds between samples (default is 60)')
+    all_args.add_argument('--batch-size', type=int, default=50,
+                          help='Number of points written to InfluxDB in one request (default is 50)')
+    all_args.add_argument('--flush-interval', type=float, default=10,
+                          help='Seconds after which queued points are written to InfluxDB (default is 10)')
+    all_args.add_argument('--cache-flush-limit', type=int, default=10,
+                          help='Number of cached points that triggers writing them back (default is 10)')
+    all_args.add_argument('--cache-points', type=int, default=10000,
+                          help='Number of points appended by the cache scenario (default is 10000)')
+    all_args.add_argument('--latency', type=float, default=0,
+                          help='Milliseconds the stand-in server takes to answer each request (default is 0)')
+    all_args.add_argument('--error-rate', type=float, default=0,
+                          help='Fraction of writes the stand-in server fails with a 500 error (default is 0)')
+    all_args.add_argument('--breaker-reset', type=float, default=0.5,
+                          help='Seconds the circuit breaker holds writes back after failures (default is 0.5)')
+    all_args.add_argument('--concurrent', action='store_true',
+                          help='Read sensors with the worker pool rather than in the loop')
+    all_args.add_argument('--seed', type=int, default=0,
+                          help='Seed for the synthetic sensors and injected errors (default is 0)')
+    all_args.add_argument('--output', type=str, default='benchmark-results.json',
+                          help='Path of the JSON results file (default is benchmark-results.json)')
+    all_args.add_argument('--baseline', type=str,
+                          help='Path of an earlier results file to compare with')
+    all_args.add_argument('--loglevel', default='WARNING',
+                          choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                          help='Set the logging level of the monitor (default is WARNING)')
+    args = all_args.parse_args()
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(',')]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            all_args.error(f"Unknown scenario: {scenario}")
+
+    standin = InfluxStandIn(latency=args.latency / 1000, error_rate=args.error_rate, seed=args.seed).start()
+    results = {
+        'version': git_version(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'options': vars(args),
+        'scenarios': {}
+    }
+    try:
+        with tempfile.TemporaryDirectory(prefix='env-monitor-benchmark-') as workdir:
+            for scenario in scenarios:
+                if scenario == 'cache':
+                    metrics = run_cache(standin, args, workdir)
+                else:
+                    metrics = run_pipeline(standin, args, workdir, outage=scenario == 'outage')
+                results['scenarios'][scenario] = metrics
+    finally:
+        standin.stop()
+        logging.getLogger().handlers = []
+
+    for scenario, metrics in results['scenarios'].items():
+        print(f"\n{scenario}")
+        for metric, value in metrics.items():
+            print(f"  {metric}: {value:.6g}" if isinstance(value, float) else f"  {metric}: {value}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
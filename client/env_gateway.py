@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @file: env_gateway.py
+# @brief: Gateway forwarding readings from many monitor nodes to InfluxDB
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import argparse
+import logging
+import os
+import signal
+import sys
+
+from dotenv import load_dotenv
+
+if __name__ == '__main__':
+
+    # Load environment variables from .env file in the current directory
+    load_dotenv()
+
+    # Set up argument parser
+    all_args = argparse.ArgumentParser(
+        description='Collect readings from monitor nodes and forward them to InfluxDB'
+    )
+    all_args.add_argument(
+        '--server-config',
+        type=str,
+        default=os.getenv('SERVER_CONFIG'),
+        help='Path to the server configuration file (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--cache-file',
+        type=str,
+        default=os.getenv('GATEWAY_CACHE_FILE', os.getenv('CACHE_FILE')),
+        help='Path to the cache file used while InfluxDB is unreachable (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--cache-max-items',
+        type=int,
+        default=int(os.getenv('CACHE_MAX_ITEMS', 0)),
+        help='Number of cached items above which the oldest are retired, 0 for no limit (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--cache-max-mb',
+        type=float,
+        default=float(os.getenv('CACHE_MAX_MB', 0)),
+        help='Megabytes of cache on disk above which the oldest items are retired, 0 for no limit (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--cache-max-age-hours',
+        type=float,
+        default=float(os.getenv('CACHE_MAX_AGE_HOURS', 0)),
+        help='Hours after which cached items are retired, 0 for no limit (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--cache-retention',
+        choices=['drop', 'downsample'],
+        default=os.getenv('CACHE_RETENTION', 'drop'),
+        help='Drop the oldest cached items over a limit, or replace them with hourly summaries (optional, defined in .env file, default is drop)'
+    )
+    all_args.add_argument(
+        '--influx-batch-size',
+        type=int,
+        default=int(os.getenv('GATEWAY_BATCH_SIZE', 500)),
+        help='Number of points from all nodes written to InfluxDB in one request (optional, defined in .env file, default is 500)'
+    )
+    all_args.add_argument(
+        '--influx-flush-interval',
+        type=float,
+        default=float(os.getenv('INFLUX_FLUSH_INTERVAL', 10)),
+        help='Seconds after which queued points are written to InfluxDB (optional, defined in .env file, default is 10)'
+    )
+    all_args.add_argument(
+        '--influx-retries',
+        type=int,
+        default=int(os.getenv('INFLUX_RETRIES', 2)),
+        help='Number of times a write failing with a timeout, 429 or 5xx error is retried (optional, defined in .env file, default is 2)'
+    )
+    all_args.add_argument(
+        '--influx-breaker-threshold',
+        type=int,
+        default=int(os.getenv('INFLUX_BREAKER_THRESHOLD', 3)),
+        help='Number of failed writes after which readings are cached without trying InfluxDB (optional, defined in .env file, default is 3)'
+    )
+    all_args.add_argument(
+        '--influx-breaker-reset',
+        type=float,
+        default=float(os.getenv('INFLUX_BREAKER_RESET', 30)),
+        help='Seconds before InfluxDB is tried again after failed writes, doubling while it stays down (optional, defined in .env file, default is 30)'
+    )
+    all_args.add_argument(
+        '--openweather-api-key',
+        type=str,
+        default=os.getenv('OPENWEATHER_API_KEY'),
+        help='Path to the OpenWeather API key file (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--openweather-location-key',
+        type=str,
+        default=os.getenv('OPENWEATHER_LOCATION_KEY'),
+        help='OpenWeather location key for fetching current conditions (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--openweather-cache-file',
+        type=str,
+        default=os.getenv('OPENWEATHER_CACHE_FILE'),
+        help='Path to the file caching the most recent OpenWeather response (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--openweather-ttl',
+        type=int,
+        default=int(os.getenv('OPENWEATHER_TTL', 600)),
+        help='Seconds an OpenWeather response is used before fetching again (optional, defined in .env file, default is 600)'
+    )
+    all_args.add_argument(
+        '--sample-interval',
+        type=int,
+        default=int(os.getenv('SAMPLE_INTERVAL', 60)),
+        help='Seconds between weather samples (optional, defined in .env file, default is 60)'
+    )
+    all_args.add_argument(
+        '--gateway-host',
+        type=str,
+        default=os.getenv('GATEWAY_HOST', '0.0.0.0'),
+        help='Address the gateway listens on (optional, defined in .env file, default is 0.0.0.0)'
+    )
+    all_args.add_argument(
+        '--gateway-port',
+        type=int,
+        default=int(os.getenv('GATEWAY_PORT', 8087)),
+        help='Port the gateway listens on (optional, defined in .env file, default is 8087)'
+    )
+    all_args.add_argument(
+        '--loglevel',
+        default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Set the logging level'
+    )
+    all_args.add_argument(
+        '-d', '--duration',
+        type=int,
+        help='Duration in minutes to run the gateway (optional, default is to run indefinitely)',
+    )
+    args = vars(all_args.parse_args())
+
+    logging.basicConfig(stream=sys.stdout, level=args['loglevel'],
+                        format="%(asctime)s %(levelname)s: %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S")
+
+    # Imported after parsing so --help does not wait for the gateway's dependencies
+    from env_monitor.gateway import Gateway
+
+    gateway = Gateway(server_config=args['server_config'],
+                      cache_file=args['cache_file'],
+                      cache_max_items=args['cache_max_items'],
+                      cache_max_bytes=int(args['cache_max_mb'] * 1024 * 1024),
+                      cache_max_age=args['cache_max_age_hours'] * 3600,
+                      cache_retention=args['cache_retention'],
+                      influx_batch_size=args['influx_batch_size'],
+                      influx_flush_interval=args['influx_flush_interval'],
+                      influx_retries=args['influx_retries'],
+                      influx_breaker_threshold=args['influx_breaker_threshold'],
+                      influx_breaker_reset=args['influx_breaker_reset'],
+                      openweather_api_key=args['openweather_api_key'],
+                      openweather_location_key=args['openweather_location_key'],
+                      openweather_cache_file=args['openweather_cache_file'],
+                      openweather_ttl=args['openweather_ttl'],
+                      sample_interval=args['sample_interval'],
+                      host=args['gateway_host'],
+                      port=args['gateway_port'])
+    signal.signal(signal.SIGINT, gateway.stop)
+    signal.signal(signal.SIGTERM, gateway.stop)
+    gateway.start(duration_minutes=args['duration'])
@@ -8,7 +8,6 @@ import argparse
 import os
 
 from dotenv import load_dotenv
-from env_monitor.monitor import Monitor
 
 if __name__ == '__main__':
 
@@ -31,6 +30,24 @@ if __name__ == '__main__':
         default=os.getenv('LOG_FILE'),
         help='Path to the log file (optional, defined in .env file)'
     )
+    all_args.add_argument(
+        '--log-max-mb',
+        type=float,
+        default=float(os.getenv('LOG_MAX_MB', 10)),
+        help='Megabytes after which the log file is rotated (optional, defined in .env file, default is 10)'
+    )
+    all_args.add_argument(
+        '--log-backups',
+        type=int,
+        default=int(os.getenv('LOG_BACKUPS', 3)),
+        help='Number of rotated log files kept (optional, defined in .env file, default is 3)'
+    )
+    all_args.add_argument(
+        '--log-rate-limit',
+        type=float,
+        default=float(os.getenv('LOG_RATE_LIMIT', 0)),
+        help='Seconds before the same info or debug message is repeated, 0 logs every message (optional, defined in .env file, default is 0)'
+    )
     all_args.add_argument(
         '--cache-file',
         type=str,
@@ -43,6 +60,60 @@ if __name__ == '__main__':
         default=int(os.getenv('CACHE_FLUSH_LIMIT', 10)),
         help='Number of items to keep in memory before flushing to disk (optional, defined in .env file, default is 10)'
     )
+    all_args.add_argument(
+        '--cache-max-items',
+        type=int,
+        default=int(os.getenv('CACHE_MAX_ITEMS', 0)),
+        help='Number of cached items above which the oldest are retired, 0 for no limit (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--cache-max-mb',
+        type=float,
+        default=float(os.getenv('CACHE_MAX_MB', 0)),
+        help='Megabytes of cache on disk above which the oldest items are retired, 0 for no limit (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--cache-max-age-hours',
+        type=float,
+        default=float(os.getenv('CACHE_MAX_AGE_HOURS', 0)),
+        help='Hours after which cached items are retired, 0 for no limit (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--cache-retention',
+        choices=['drop', 'downsample'],
+        default=os.getenv('CACHE_RETENTION', 'drop'),
+        help='Drop the oldest cached items over a limit, or replace them with hourly summaries (optional, defined in .env file, default is drop)'
+    )
+    all_args.add_argument(
+        '--influx-batch-size',
+        type=int,
+        default=int(os.getenv('INFLUX_BATCH_SIZE', 50)),
+        help='Number of points to queue before writing them to InfluxDB in one request, 0 writes each point immediately (optional, defined in .env file, default is 50)'
+    )
+    all_args.add_argument(
+        '--influx-flush-interval',
+        type=float,
+        default=float(os.getenv('INFLUX_FLUSH_INTERVAL', 10)),
+        help='Seconds after which queued points are written to InfluxDB (optional, defined in .env file, default is 10)'
+    )
+    all_args.add_argument(
+        '--influx-retries',
+        type=int,
+        default=int(os.getenv('INFLUX_RETRIES', 2)),
+        help='Number of times a write failing with a timeout, 429 or 5xx error is retried (optional, defined in .env file, default is 2)'
+    )
+    all_args.add_argument(
+        '--influx-breaker-threshold',
+        type=int,
+        default=int(os.getenv('INFLUX_BREAKER_THRESHOLD', 3)),
+        help='Number of failed writes after which readings are cached without trying InfluxDB (optional, defined in .env file, default is 3)'
+    )
+    all_args.add_argument(
+        '--influx-breaker-reset',
+        type=float,
+        default=float(os.getenv('INFLUX_BREAKER_RESET', 30)),
+        help='Seconds before InfluxDB is tried again after failed writes, doubling while it stays down (optional, defined in .env file, default is 30)'
+    )
     all_args.add_argument(
         '--openweather-api-key',
         type=str,
@@ -55,12 +126,174 @@ if __name__ == '__main__':
         default=os.getenv('OPENWEATHER_LOCATION_KEY'),
         help='OpenWeather location key for fetching current conditions (optional, defined in .env file)'
     )
+    all_args.add_argument(
+        '--openweather-cache-file',
+        type=str,
+        default=os.getenv('OPENWEATHER_CACHE_FILE'),
+        help='Path to the file caching the most recent OpenWeather response (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--openweather-ttl',
+        type=int,
+        default=int(os.getenv('OPENWEATHER_TTL', 600)),
+        help='Seconds an OpenWeather response is used before fetching again (optional, defined in .env file, default is 600)'
+    )
+    all_args.add_argument(
+        '--openweather-suppress-stale',
+        action='store_true',
+        default=os.getenv('OPENWEATHER_SUPPRESS_STALE', 'false').lower() == 'true',
+        help='Do not write weather conditions older than the TTL (optional, defined in .env file)'
+    )
     all_args.add_argument(
         '--pir-sensor-gpio-pin',
         type=str,
         default=os.getenv('PIR_SENSOR_GPIO_PIN'),
         help='GPIO pin number for the PIR sensor (optional, defined in .env file)'
     )
+    all_args.add_argument(
+        '--sensors-file',
+        type=str,
+        default=os.getenv('SENSORS_FILE'),
+        help='JSON file listing the sensors of this node, replacing one BME680, SDS011 and PIR sensor each (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--sample-interval',
+        type=int,
+        default=int(os.getenv('SAMPLE_INTERVAL', 60)),
+        help='Seconds between sensor and OpenWeather samples (optional, defined in .env file, default is 60)'
+    )
+    all_args.add_argument(
+        '--wifi-sample-interval',
+        type=int,
+        default=int(os.getenv('WIFI_SAMPLE_INTERVAL', 60)),
+        help='Seconds between WiFi signal and quality samples (optional, defined in .env file, default is 60)'
+    )
+    all_args.add_argument(
+        '--health-interval',
+        type=int,
+        default=int(os.getenv('HEALTH_INTERVAL', 60)),
+        help='Seconds between monitor health measurements (optional, defined in .env file, default is 60)'
+    )
+    all_args.add_argument(
+        '--metrics-port',
+        type=int,
+        default=int(os.getenv('METRICS_PORT', 0)),
+        help='Local port serving the latest monitor health metrics, 0 disables it (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--sds011-query-mode',
+        action='store_true',
+        default=os.getenv('SDS011_QUERY_MODE', 'false').lower() == 'true',
+        help='Put the SDS011 sensor to sleep between samples (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--rolling-windows',
+        type=str,
+        default=os.getenv('ROLLING_WINDOWS', '15m,1h,24h'),
+        help='Comma separated windows to calculate rolling sensor statistics over (optional, defined in .env file, default is 15m,1h,24h)'
+    )
+    all_args.add_argument(
+        '--iaq-baseline-file',
+        type=str,
+        default=os.getenv('IAQ_BASELINE_FILE'),
+        help='File the BME680 gas baseline used for IAQ is kept in across restarts (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--rollup-tiers',
+        type=str,
+        default=os.getenv('ROLLUP_TIERS', '1m,1h,1d'),
+        help='Comma separated tiers to roll up climate, particles and weather readings into, none disables them (optional, defined in .env file, default is 1m,1h,1d)'
+    )
+    all_args.add_argument(
+        '--rollup-state-file',
+        type=str,
+        default=os.getenv('ROLLUP_STATE_FILE'),
+        help='File partial rollups are kept in across restarts (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--store-dir',
+        type=str,
+        default=os.getenv('STORE_DIR'),
+        help='Directory readings are kept in on the node for local queries (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--store-retention-hours',
+        type=float,
+        default=float(os.getenv('STORE_RETENTION_HOURS', 48)),
+        help='Hours readings are kept in the local store (optional, defined in .env file, default is 48)'
+    )
+    all_args.add_argument(
+        '--store-port',
+        type=int,
+        default=int(os.getenv('STORE_PORT', 0)),
+        help='Port answering queries about readings in the local store, 0 disables it (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--store-bind',
+        type=str,
+        default=os.getenv('STORE_BIND', '127.0.0.1'),
+        help='Address the local store queries are answered on, e.g. 0.0.0.0 for a display on another device (optional, defined in .env file, default is 127.0.0.1)'
+    )
+    all_args.add_argument(
+        '--store-backfill-hours',
+        type=float,
+        default=float(os.getenv('STORE_BACKFILL_HOURS', 0)),
+        help='Write the readings in the local store from this many hours ago to InfluxDB again at start up, e.g. after the server lost data (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--burst-interval',
+        type=float,
+        default=float(os.getenv('BURST_INTERVAL', 0)),
+        help='Seconds between BME680 and SDS011 samples, summarised once per sample interval, 0 disables burst sampling (optional, defined in .env file, default is 0)'
+    )
+    for sensor in ('bme680', 'sds011', 'pir'):
+        all_args.add_argument(
+            f'--{sensor}-backend',
+            choices=['hardware', 'synthetic', 'replay'],
+            default=os.getenv(f'{sensor.upper()}_BACKEND', 'hardware'),
+            help=f'Read the {sensor.upper()} sensor from the hardware, a synthetic generator or a replay file (optional, defined in .env file, default is hardware)'
+        )
+    all_args.add_argument(
+        '--replay-file',
+        type=str,
+        default=os.getenv('REPLAY_FILE'),
+        help='Path to a file of recorded points replayed by sensors using the replay backend (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--record-file',
+        type=str,
+        default=os.getenv('RECORD_FILE'),
+        help='Path to a file every point written is appended to, for replaying later (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--simulation-seed',
+        type=int,
+        default=int(os.getenv('SIMULATION_SEED', 0)),
+        help='Seed for sensors using the synthetic backend (optional, defined in .env file, default is 0)'
+    )
+    all_args.add_argument(
+        '--simulation-speed',
+        type=float,
+        default=float(os.getenv('SIMULATION_SPEED', 1)),
+        help='How many times faster than real time to run with synthetic or replayed sensors, e.g. 1000 (optional, defined in .env file, default is 1)'
+    )
+    all_args.add_argument(
+        '--gateway-url',
+        type=str,
+        default=os.getenv('GATEWAY_URL'),
+        help='URL of a gateway to send readings to instead of InfluxDB, e.g. http://192.168.1.10:8087 (optional, defined in .env file)'
+    )
+    all_args.add_argument(
+        '--node-name',
+        type=str,
+        default=os.getenv('NODE_NAME'),
+        help='Name the gateway tags this node\'s readings with (optional, defined in .env file, default is the host name)'
+    )
+    all_args.add_argument(
+        '--serial',
+        action='store_true',
+        help='Read sensors one after another in the sample loop instead of concurrently'
+    )
     all_args.add_argument(
         '--loglevel',
         default='INFO',
@@ -74,6 +307,9 @@ if __name__ == '__main__':
     )
     args = vars(all_args.parse_args())
 
+    # Imported after parsing so --help does not wait for the monitor's dependencies
+    from env_monitor.monitor import Monitor
+
     monitor = Monitor(loglevel=args['loglevel'],
                       openweather_api_key=args['openweather_api_key'],
                       openweather_location_key=args['openweather_location_key'],
@@ -81,5 +317,46 @@ if __name__ == '__main__':
                       server_config=args['server_config'],
                       cache_file=args['cache_file'],
                       cache_flush_limit=args['cache_flush_limit'],
-                      log_file=args['log_file'])
+                      cache_max_items=args['cache_max_items'],
+                      cache_max_bytes=int(args['cache_max_mb'] * 1024 * 1024),
+                      cache_max_age=args['cache_max_age_hours'] * 3600,
+                      cache_retention=args['cache_retention'],
+                      influx_batch_size=args['influx_batch_size'],
+                      influx_flush_interval=args['influx_flush_interval'],
+                      influx_retries=args['influx_retries'],
+                      influx_breaker_threshold=args['influx_breaker_threshold'],
+                      influx_breaker_reset=args['influx_breaker_reset'],
+                      concurrent=not args['serial'],
+                      wifi_sample_interval=args['wifi_sample_interval'],
+                      health_interval=args['health_interval'],
+                      metrics_port=args['metrics_port'],
+                      sds011_query_mode=args['sds011_query_mode'],
+                      rolling_windows=args['rolling_windows'],
+                      burst_interval=args['burst_interval'],
+                      iaq_baseline_file=args['iaq_baseline_file'],
+                      rollup_tiers=args['rollup_tiers'],
+                      rollup_state_file=args['rollup_state_file'],
+                      store_dir=args['store_dir'],
+                      store_retention=args['store_retention_hours'] * 3600,
+                      store_port=args['store_port'],
+                      store_bind=args['store_bind'],
+                      store_backfill=args['store_backfill_hours'] * 3600,
+                      sample_interval=args['sample_interval'],
+                      openweather_cache_file=args['openweather_cache_file'],
+                      openweather_ttl=args['openweather_ttl'],
+                      openweather_emit_stale=not args['openweather_suppress_stale'],
+                      bme680_backend=args['bme680_backend'],
+                      sds011_backend=args['sds011_backend'],
+                      pir_backend=args['pir_backend'],
+                      sensors_file=args['sensors_file'],
+                      replay_file=args['replay_file'],
+                      simulation_seed=args['simulation_seed'],
+                      simulation_speed=args['simulation_speed'],
+                      record_file=args['record_file'],
+                      gateway_url=args['gateway_url'],
+                      node_name=args['node_name'],
+                      log_file=args['log_file'],
+                      log_max_mb=args['log_max_mb'],
+                      log_backups=args['log_backups'],
+                      log_rate_limit=args['log_rate_limit'])
     monitor.start(duration_minutes=args['duration'])
\ No newline at end of file
@@ -4,8 +4,21 @@
 # @brief: Environment monitoring module for sensors
 # @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
 
-from .monitor import Monitor
-from .openweather import OpenWeather
-from .sensors.sds011 import SDS011
-from .sensors.bme680 import BME680
-from .sensors.pir import PIR
\ No newline at end of file
+import importlib
+
+# Classes are imported when first used, so importing the package for one of
+# them does not import the others and their dependencies
+_exports = {
+    'Monitor': '.monitor',
+    'OpenWeather': '.openweather',
+    'SDS011': '.sensors.sds011',
+    'BME680': '.sensors.bme680',
+    'PIR': '.sensors.pir'
+}
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_exports[name], __name__), name)
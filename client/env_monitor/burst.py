@@ -0,0 +1,108 @@
+# @file: burst.py
+# @brief: High rate sensor sampling reduced to a summary per sample interval
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import logging
+import statistics
+import threading
+import time
+
+def median_filter(values, width):
+    # Replace each value with the median of its neighbours so single sample
+    # glitches are rejected while sustained changes are kept
+    half = width // 2
+    return [statistics.median(values[max(0, i - half):i + half + 1]) for i in range(len(values))]
+
+def reduce_samples(values, width=5, spike_threshold=3.0):
+    # Summarise a burst of samples as mean, min, max, median and the number of
+    # times the values rose more than spike_threshold median absolute deviations
+    # above the median. The deviation is at least 10% of the median so a steady
+    # baseline, with a deviation of 0, does not count every blip.
+    #
+    # Only the mean and median are taken from the median filtered values. The
+    # filter removes anything shorter than half its width, which at a 1 second
+    # interval is the brief dust burst the min, max and spikes are there to
+    # catch, so those are taken from the samples as they were read
+    filtered = median_filter(values, width)
+    median = statistics.median(filtered)
+    mad = statistics.median([abs(value - median) for value in values])
+    limit = median + spike_threshold * max(mad, abs(median) * 0.1)
+    spikes = 0
+    above = False
+    for value in values:
+        if value > limit and not above:
+            spikes += 1
+        above = value > limit
+    summary = {
+        'mean': statistics.fmean(filtered),
+        'min': min(values),
+        'max': max(values),
+        'median': median
+    }
+    # Keep integer readings as integers so InfluxDB field types do not change
+    if all(isinstance(value, int) for value in values):
+        summary = {stat: round(value) for stat, value in summary.items()}
+    summary['spikes'] = spikes
+    return summary
+
+def summary_fields(summary, count):
+    # Fields for a reduced burst. The mean is reported as the plain reading, so
+    # only the other statistics get suffixed fields, e.g. pm2.5_max
+    fields = {'samples': count}
+    for name, stats in summary.items():
+        for stat in ('min', 'max', 'median', 'spikes'):
+            fields[f'{name}_{stat}'] = stats[stat]
+    return fields
+
+class BurstSampler(object):
+
+    def __init__(self, read, interval=1.0, filter_width=5, spike_threshold=3.0, name='burst'):
+
+        # Function returning a dict of named values, or None if the read failed
+        self.read = read
+
+        # The number of seconds between samples
+        self.interval = interval
+
+        # The number of samples the median filter spans
+        self.filter_width = filter_width
+
+        # The number of median absolute deviations above the median that counts as a spike
+        self.spike_threshold = spike_threshold
+
+        # Samples taken since the last call to reduce()
+        self.samples = []
+        self.lock = threading.Lock()
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, name=name, daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        next_sample = time.monotonic()
+        while not self._closing.is_set():
+            try:
+                values = self.read()
+                if values:
+                    with self.lock:
+                        self.samples.append(values)
+            except Exception as e:
+                logging.debug(f"Burst sample failed: {e}")
+            next_sample += self.interval
+            self._closing.wait(max(0.0, next_sample - time.monotonic()))
+
+    def reduce(self):
+        # Summarise and clear the samples taken since the last call, as {name: summary}
+        with self.lock:
+            samples, self.samples = self.samples, []
+        if not samples:
+            return None, 0
+        summary = {}
+        for name in samples[0]:
+            values = [sample[name] for sample in samples if sample.get(name) is not None]
+            if values:
+                summary[name] = reduce_samples(values, self.filter_width, self.spike_threshold)
+        return summary, len(samples)
+
+    def close(self):
+        self._closing.set()
+        self._thread.join()
@@ -0,0 +1,61 @@
+# @file: clock.py
+# @brief: Clock for timestamping sensor readings at the time they are taken
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import logging
+import threading
+import time
+
+class Clock(object):
+
+    def __init__(self, max_skew=2.0, speed=1.0):
+
+        # The number of seconds the wall clock can drift from the monotonic clock
+        # before it is treated as a step (e.g. an NTP sync after boot) and adopted
+        self.max_skew_ns = int(max_skew * 1e9)
+
+        # How many times faster than real time the clock runs. Only simulated and
+        # replayed sensors are read faster than real time, e.g. to soak test months
+        # of readings in minutes
+        self.speed = speed
+
+        # The last timestamp handed out, so timestamps never go backwards between steps
+        self.last_ns = 0
+
+        self.lock = threading.Lock()
+        self._anchor()
+
+    def _anchor(self):
+        self.anchor_wall_ns = time.time_ns()
+        self.anchor_mono_ns = time.monotonic_ns()
+
+    def now_ns(self):
+        # Wall clock time in nanoseconds since the epoch, advanced by the monotonic
+        # clock so small wall clock adjustments do not reorder readings
+        with self.lock:
+            now = self.anchor_wall_ns + int((time.monotonic_ns() - self.anchor_mono_ns) * self.speed)
+            skew = time.time_ns() - now
+            if self.speed == 1 and abs(skew) > self.max_skew_ns:
+                logging.info(f"Wall clock stepped by {skew / 1e9:.3f}s, re-anchoring timestamps")
+                self._anchor()
+                now = self.anchor_wall_ns
+            else:
+                now = max(now, self.last_ns + 1)
+            self.last_ns = now
+            return now
+
+    def monotonic(self):
+        # Seconds on the monotonic clock, running at the clock speed
+        return time.monotonic() * self.speed
+
+    def set_speed(self, speed):
+        with self.lock:
+            self._anchor()
+            self.anchor_wall_ns = max(self.anchor_wall_ns, self.last_ns + 1)
+            self.speed = speed
+
+# Shared clock used to timestamp all readings
+clock = Clock()
+
+def now_ns():
+    return clock.now_ns()
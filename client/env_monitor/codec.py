@@ -0,0 +1,244 @@
+# @file: codec.py
+# @brief: Compact binary encoding of cached readings
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import json
+import struct
+import zlib
+
+# A segment starts with a magic number followed by frames. Every frame is a
+# 4 byte payload length, a 1 byte kind, the payload and a CRC32 of the kind and
+# payload, so a frame torn by a crash is detected and dropped.
+#
+# The first record of each shape in a segment is preceded by a schema frame
+# giving the measurement, the tags and the names and types of the fields.
+# Records then only hold the schema number, the time and the packed field
+# values, so measurement names, tags and field names are not repeated.
+# Readings that do not fit a schema are stored as JSON. A sealed segment can
+# have all of its frames compressed into a single block frame.
+MAGIC = b'EMC1'
+FRAME = struct.Struct('<IB')
+CRC = struct.Struct('<I')
+SCHEMA_ID = struct.Struct('<H')
+LENGTH = struct.Struct('<I')
+TIME = struct.Struct('<q')
+
+SCHEMA = ord('S')
+RECORD = ord('R')
+JSON = ord('J')
+BLOCK = ord('B')
+
+# Field types, with the struct code of those packed at a fixed size
+FLOAT = 'd'
+INT = 'q'
+BOOL = '?'
+NONE = 'n'
+STRING = 's'
+OTHER = 'j'
+FIXED = {FLOAT: 'd', INT: 'q', BOOL: '?'}
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+def value_type(value):
+    if value is None:
+        return NONE
+    if isinstance(value, bool):
+        return BOOL
+    if isinstance(value, int):
+        return INT if INT_MIN <= value <= INT_MAX else OTHER
+    if isinstance(value, float):
+        return FLOAT
+    if isinstance(value, str):
+        return STRING
+    return OTHER
+
+def frame(kind, payload):
+    body = bytes([kind]) + payload
+    return FRAME.pack(len(payload), kind) + payload + CRC.pack(zlib.crc32(body))
+
+class Schema(object):
+
+    def __init__(self, number, measurement, tags, fields, time_type):
+
+        # The number records refer to the schema by, the measurement and tags
+        # shared by its records, and the names and types of their fields
+        self.number = number
+        self.measurement = measurement
+        self.tags = tags
+        self.fields = fields
+        self.time_type = time_type
+
+        # The struct packing the time and fixed size fields, and the positions
+        # of fields packed separately because of their type
+        self.names = [name for name, _ in fields]
+        types = [time_type] + [kind for _, kind in fields]
+        self.fixed = struct.Struct('<' + ''.join(FIXED.get(kind, '') for kind in types))
+        self.variable = [index for index, kind in enumerate(types) if kind in (STRING, OTHER)]
+        self.types = types
+
+        # Most readings have only numeric fields, which unpack in one call
+        self.packed = all(kind in FIXED for kind in types)
+
+    def definition(self):
+        return json.dumps({'n': self.number, 'm': self.measurement, 't': self.tags,
+                           'f': self.fields, 'ts': self.time_type}, separators=(',', ':')).encode()
+
+    @classmethod
+    def from_definition(cls, payload):
+        d = json.loads(payload)
+        return cls(d['n'], d['m'], d['t'], [tuple(field) for field in d['f']], d['ts'])
+
+    def pack(self, time, values):
+        values = [time] + values
+        payload = SCHEMA_ID.pack(self.number)
+        payload += self.fixed.pack(*[value for value, kind in zip(values, self.types) if kind in FIXED])
+        for index in self.variable:
+            value = values[index]
+            data = value.encode() if self.types[index] == STRING else json.dumps(value).encode()
+            payload += LENGTH.pack(len(data)) + data
+        return payload
+
+    def time(self, payload):
+        # The time of a record, without unpacking its fields
+        return TIME.unpack_from(payload, SCHEMA_ID.size)[0] if self.time_type == INT else None
+
+    def copy_tags(self):
+        # Every record gets its own tags, as it would reading JSON
+        return dict(self.tags) if isinstance(self.tags, dict) else self.tags
+
+    def unpack(self, payload):
+        if self.packed:
+            values = self.fixed.unpack_from(payload, SCHEMA_ID.size)
+            return {
+                'measurement': self.measurement,
+                'fields': dict(zip(self.names, values[1:])),
+                'tags': self.copy_tags(),
+                'time': values[0]
+            }
+        fixed = iter(self.fixed.unpack_from(payload, SCHEMA_ID.size))
+        offset = SCHEMA_ID.size + self.fixed.size
+        values = []
+        for kind in self.types:
+            if kind in FIXED:
+                values.append(next(fixed))
+            elif kind == NONE:
+                values.append(None)
+            else:
+                length, = LENGTH.unpack_from(payload, offset)
+                data = payload[offset + LENGTH.size:offset + LENGTH.size + length]
+                offset += LENGTH.size + length
+                values.append(data.decode() if kind == STRING else json.loads(data))
+        return {
+            'measurement': self.measurement,
+            'fields': dict(zip(self.names, values[1:])),
+            'tags': self.copy_tags(),
+            'time': values[0]
+        }
+
+class Encoder(object):
+
+    # Encodes records for one segment, defining each schema the first time it is used
+
+    def __init__(self):
+        self.schemas = {}
+
+    def encode(self, record):
+        if (not isinstance(record, dict) or set(record) != {'measurement', 'fields', 'tags', 'time'}
+                or not isinstance(record['fields'], dict) or not isinstance(record['measurement'], str)):
+            return frame(JSON, json.dumps(record, separators=(',', ':')).encode())
+
+        fields = [(name, value_type(value)) for name, value in record['fields'].items()]
+        time_type = value_type(record['time'])
+        if time_type not in (INT, NONE):
+            return frame(JSON, json.dumps(record, separators=(',', ':')).encode())
+        key = (record['measurement'], json.dumps(record['tags']), tuple(fields), time_type)
+
+        data = b''
+        schema = self.schemas.get(key)
+        if schema is None:
+            if len(self.schemas) > 0xffff:
+                return frame(JSON, json.dumps(record, separators=(',', ':')).encode())
+            schema = Schema(len(self.schemas), record['measurement'], record['tags'], fields, time_type)
+            self.schemas[key] = schema
+            data += frame(SCHEMA, schema.definition())
+        return data + frame(RECORD, schema.pack(record['time'], list(record['fields'].values())))
+
+class Decoder(object):
+
+    # Decodes the frames of one segment, from bytes or a memory map
+
+    def __init__(self):
+        self.schemas = {}
+
+        # The offset after the last frame decoded, short of the end of the data
+        # once iteration stops if a frame was torn
+        self.offset = 0
+
+    def _frames(self, data, offset):
+        # Yield the kind, payload and end of each frame until one is incomplete
+        while offset + FRAME.size <= len(data):
+            length, kind = FRAME.unpack_from(data, offset)
+            start = offset + FRAME.size
+            end = start + length + CRC.size
+            if end > len(data):
+                return
+            payload = data[start:start + length]
+            crc, = CRC.unpack_from(data, start + length)
+            if zlib.crc32(payload, zlib.crc32(bytes([kind]))) != crc:
+                return
+            yield kind, payload, end
+            offset = end
+
+    def iterate(self, data, offset=0, skip=0, times=False):
+        # Yield records one at a time, passing over the first skip records without
+        # unpacking them, or only the time of each record
+        self.offset = offset
+        for kind, payload, end in self._frames(data, offset):
+            frames = [(kind, payload)]
+            try:
+                if kind == BLOCK:
+                    block = zlib.decompress(payload)
+                    frames = [(inner, body) for inner, body, _ in self._frames(block, 0)]
+                    if sum(FRAME.size + len(body) + CRC.size for _, body in frames) != len(block):
+                        return
+                for kind, payload in frames:
+                    if kind == SCHEMA:
+                        schema = Schema.from_definition(payload)
+                        self.schemas[schema.number] = schema
+                    elif kind not in (RECORD, JSON):
+                        return
+                    elif skip:
+                        skip -= 1
+                    elif kind == RECORD:
+                        number, = SCHEMA_ID.unpack_from(payload)
+                        schema = self.schemas[number]
+                        yield schema.time(payload) if times else schema.unpack(payload)
+                    else:
+                        record = json.loads(payload)
+                        yield record.get('time') if times and isinstance(record, dict) else record
+            except (KeyError, ValueError, struct.error, zlib.error):
+                return
+            self.offset = end
+
+    def decode(self, data, offset=0):
+        # Return the records in data and the offset after the last frame that
+        # could be decoded, which is short of the end if a frame was torn
+        records = list(self.iterate(data, offset))
+        return records, self.offset
+
+def compress(data, level=6):
+    # Compress the frames of a sealed segment, after its magic number, into one block
+    return MAGIC + frame(BLOCK, zlib.compress(data[len(MAGIC):], level))
+
+def inflate(data):
+    # A segment compressed by compress as it was before, so its records can be
+    # read without inflating the block again. Anything else is returned as it is
+    for kind, payload, end in Decoder()._frames(data, len(MAGIC)):
+        if kind == BLOCK and end == len(data):
+            try:
+                return MAGIC + zlib.decompress(payload)
+            except zlib.error:
+                pass
+        break
+    return data
@@ -4,61 +4,603 @@
 
 import json
 import os
-from collections import deque
+import glob
+import itertools
 import logging
+import mmap
 import tempfile
+import threading
+
+from . import codec
+from .clock import now_ns
+
+# Readings are persisted to an append-only log made up of size capped segment
+# files next to the cache file, e.g. cache.json.00000001.seg. Each segment
+# holds records in the compact binary encoding of codec.py and is named after
+# the sequence number of its first record. The sequence number of the last
+# record written to InfluxDB is kept in an acknowledgement file, e.g.
+# cache.json.ack, which is replaced atomically. Segments holding only
+# acknowledged records are removed in the background. Segments written by
+# earlier versions, with one JSON record per line, are still read.
+#
+# Readings stay on disk. Only the number of records, size and newest reading
+# time of each segment are kept in memory, and readings are read back through
+# a memory map a window at a time, so memory use does not grow with the
+# length of an outage.
+SEGMENT = 'seg'
+JSON_SEGMENT = 'wal'
+
+# What happens to the oldest readings when the cache reaches one of its caps
+DROP = 'drop'
+DOWNSAMPLE = 'downsample'
+RETENTION_POLICIES = (DROP, DOWNSAMPLE)
+
+# Tag marking the hourly summaries that replace readings when downsampling
+ROLLUP_TAG = 'rollup'
+ROLLUP_PERIOD = 3600 * 10**9
+
+class Segment(object):
+
+    def __init__(self, first_seq, path, count=0, size=0, last_time=None):
+
+        # Sequence number of the first record and the file holding the records
+        self.first_seq = first_seq
+        self.path = path
+
+        # The number of records, bytes on disk and time of the newest reading in ns
+        self.count = count
+        self.size = size
+        self.last_time = last_time
+
+    @property
+    def last_seq(self):
+        return self.first_seq + self.count - 1
+
+class Rollup(object):
+
+    # The summary of one series over one hour
+
+    def __init__(self, measurement, tags, time):
+        self.measurement = measurement
+        self.tags = dict(tags or {}, **{ROLLUP_TAG: '1h'})
+        self.time = time
+
+        # The number of readings summarised
+        self.samples = 0
+
+        # Totals and counts of numeric fields, the fields seen as floats rather
+        # than integers, and the latest value of other fields
+        self.totals = {}
+        self.counts = {}
+        self.floats = set()
+        self.latest = {}
+
+    def add(self, fields, samples=1):
+        # A summary being summarised again counts for the readings it summarises
+        self.samples += samples
+        for name, value in fields.items():
+            if isinstance(value, bool):
+                # A flag is set for the hour if it was ever set
+                self.latest[name] = self.latest.get(name, False) or value
+            elif isinstance(value, (int, float)):
+                self.totals[name] = self.totals.get(name, 0) + value * samples
+                self.counts[name] = self.counts.get(name, 0) + samples
+                if isinstance(value, float):
+                    self.floats.add(name)
+            elif value is not None:
+                self.latest[name] = value
+
+    def point(self):
+        # Integer fields stay integers so InfluxDB accepts them into the same measurement
+        fields = {}
+        for name, total in self.totals.items():
+            mean = total / self.counts[name]
+            fields[name] = mean if name in self.floats else round(mean)
+        fields.update(self.latest)
+        fields['samples'] = self.samples
+        return {'measurement': self.measurement, 'fields': fields, 'tags': self.tags, 'time': self.time}
+
+def hour_of(record):
+    # The start of the hour a reading falls in, or None if it has no time
+    if isinstance(record, dict) and isinstance(record.get('time'), int):
+        return record['time'] - record['time'] % ROLLUP_PERIOD
+    return None
+
+def summarise(records, rollups):
+    # Add readings to their hourly summaries, merging in summaries made earlier.
+    # Readings with no time to place them in an hour are dropped. Returns the
+    # number of readings, rather than summaries, added
+    readings = 0
+    for record in records:
+        hour = hour_of(record)
+        if hour is None or not isinstance(record.get('fields'), dict):
+            continue
+        tags = dict(record.get('tags') or {})
+        fields = dict(record['fields'])
+        if tags.pop(ROLLUP_TAG, None):
+            samples = fields.pop('samples', 1)
+        else:
+            samples = 1
+            readings += 1
+        key = (record.get('measurement'), json.dumps(tags, sort_keys=True), hour)
+        if key not in rollups:
+            rollups[key] = Rollup(record.get('measurement'), tags, hour)
+        rollups[key].add(fields, samples)
+    return readings
 
 class DataCache:
-    def __init__(self, cache_file=None):
+
+    def __init__(self, cache_file=None, segment_size=1024*1024, fsync_interval=10, compress=True,
+                 max_items=None, max_bytes=None, max_age=None, retention=DROP, window=1000):
         self.cache_file = cache_file
-        self.buffer = self._load_cache()
-        logging.debug(f"Cache initialized with {len(self.buffer)} items.")
-        logging.debug(f"Cache content: {list(self.buffer)}")
+
+        # Caps on the number of readings, bytes on disk and age in seconds of
+        # the readings kept, and what happens to the oldest readings over a cap
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        if retention not in RETENTION_POLICIES:
+            raise ValueError(f"Unknown cache retention policy: {retention}")
+        self.retention = retention
+
+        # The number of readings retired to keep within the caps
+        self.retired = 0
+
+        # The number of bytes after which a new log segment is started, small
+        # enough that the byte cap retires a fraction of the cache at a time
+        self.segment_size = min(segment_size, max_bytes // 4) if max_bytes else segment_size
+
+        # Whether a segment is compressed once it is closed
+        self.compress = compress
+
+        # The number of appends after which the log segment is synced to disk
+        self.fsync_interval = fsync_interval
+
+        # The most readings read into memory at once
+        self.window = window
+
+        self.lock = threading.Lock()
+
+        # Held while the backlog is written, so a flush started while another is
+        # under way, e.g. by a batching flush thread, does not write it twice
+        self.flush_lock = threading.Lock()
+        self.ack_file = f"{self.cache_file}.ack"
+
+        # Sequence number of the last record written to InfluxDB, or retired
+        self.acked_seq = 0
+
+        # Sequence number given to the next record appended
+        self.next_seq = 1
+
+        # The segments on disk, oldest first
+        self.segments = []
+
+        # The open segment currently being appended to
+        self.segment = None
+        self.segment_seq = None
+        self.encoder = None
+        self.unsynced = 0
+
+        # The path and size of the closed segment last read, and its content inflated if it was
+        # compressed, so reading a window at a time does not inflate it every time
+        self.loaded = (None, None)
+
+        # Acknowledged segments are removed by one background worker, woken
+        # after each acknowledgement
+        self.compact_event = threading.Event()
+        self.closing = False
+        self.compactor = None
+
+        self._load_cache()
+        logging.debug(f"Cache initialized with {len(self)} items in {len(self.segments)} segments.")
+
+    def __len__(self):
+        return self.next_seq - 1 - self.acked_seq
+
+    def size(self):
+        # Bytes on disk of the segments holding unacknowledged readings
+        return sum(segment.size for segment in self.segments if segment.last_seq > self.acked_seq)
+
+    def _segment_path(self, first_seq):
+        return f"{self.cache_file}.{first_seq:08d}.{SEGMENT}"
+
+    def _segments(self):
+        segments = []
+        for path in glob.glob(f"{glob.escape(self.cache_file)}.*.*"):
+            seq, suffix = path.rsplit('.', 2)[-2:]
+            if suffix not in (SEGMENT, JSON_SEGMENT):
+                continue
+            try:
+                segments.append((int(seq), path))
+            except ValueError:
+                continue
+        return sorted(segments)
+
+    def _scan_json_segment(self, segment):
+        # Count the records of a segment with one JSON record per line
+        offset = 0
+        with open(segment.path, "r+b") as f:
+            for line in f:
+                # A line without a newline is a record torn by a crash, so drop it
+                if not line.endswith(b"\n"):
+                    logging.warning(f"Discarding incomplete record at end of {segment.path}")
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+                segment.count += 1
+                try:
+                    time = json.loads(line).get('time')
+                except (ValueError, AttributeError) as e:
+                    logging.warning(f"Ignoring corrupt record in {segment.path}: {e}")
+                    continue
+                if isinstance(time, int):
+                    segment.last_time = max(segment.last_time or time, time)
+        segment.size = offset
+
+    def _scan_segment(self, segment):
+        # Count the records of a segment, decoding one at a time
+        with open(segment.path, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            valid = 0
+            if size > len(codec.MAGIC):
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if data[:len(codec.MAGIC)] == codec.MAGIC:
+                        decoder = codec.Decoder()
+                        for time in decoder.iterate(data, len(codec.MAGIC), times=True):
+                            segment.count += 1
+                            if isinstance(time, int):
+                                segment.last_time = max(segment.last_time or time, time)
+                        valid = decoder.offset
+            elif size == len(codec.MAGIC):
+                valid = size
+            if valid < size:
+                # Whatever follows the last whole record was torn by a crash, so drop it
+                logging.warning(f"Discarding {size - valid} bytes of incomplete records at end of {segment.path}")
+                f.truncate(valid)
+        segment.size = valid
+
+    def _read(self, segment, skip, limit):
+        # Up to limit records of a segment after the first skip, decoding only
+        # those. Corrupt records of old JSON segments are read as None
+        if segment.path.endswith(JSON_SEGMENT):
+            records = []
+            with open(segment.path, "rb") as f:
+                for line in itertools.islice(f, skip, skip + limit):
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        records.append(None)
+            return records
+        if self.segment and segment.first_seq == self.segment_seq:
+            # The open segment is still being appended to, so is read through a memory map
+            with open(segment.path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return list(itertools.islice(codec.Decoder().iterate(data, len(codec.MAGIC), skip), limit))
+        key, data = self.loaded
+        if key != (segment.path, segment.size):
+            with open(segment.path, "rb") as f:
+                data = codec.inflate(f.read())
+            self.loaded = ((segment.path, segment.size), data)
+        return list(itertools.islice(codec.Decoder().iterate(data, len(codec.MAGIC), skip), limit))
+
+    def _window(self, limit):
+        # The oldest unacknowledged records, at most limit of them, and the
+        # sequence number of the last one
+        records = []
+        seq = self.acked_seq
+        for segment in self.segments:
+            if segment.last_seq <= seq:
+                continue
+            if seq - self.acked_seq >= limit:
+                break
+            seq = max(seq, segment.first_seq - 1)
+            count = min(limit - (seq - self.acked_seq), segment.last_seq - seq)
+            try:
+                read = self._read(segment, seq + 1 - segment.first_seq, count)
+            except OSError as e:
+                # Stop short of the records not read, so they are not acknowledged
+                # and are read again next time
+                logging.warning(f"Failed to read cache segment {segment.path}: {e}")
+                break
+            except ValueError as e:
+                logging.warning(f"Skipping unreadable cache segment {segment.path}: {e}")
+                read = []
+            if len(read) < count:
+                # Records that fail their checks will never be readable, so they are
+                # passed over rather than holding up the readings after them
+                logging.error(f"Skipping {count - len(read)} corrupt records in cache segment {segment.path}")
+            records.extend(record for record in read if record is not None)
+            seq += count
+        return records, seq
+
+    def _head(self):
+        # The oldest segment holding unacknowledged records
+        for segment in self.segments:
+            if segment.last_seq > self.acked_seq:
+                return segment
+        return None
 
     def _load_cache(self):
-        if not os.path.exists(self.cache_file):
-            logging.info("Cache file not found. Starting with empty buffer.")
-            return deque()
+        os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+
         try:
-            logging.debug(f"Loading cache from {self.cache_file}")
-            with open(self.cache_file, "r") as f:
-                content = f.read().strip()
-                if not content:
-                    raise ValueError("Cache file is empty")
-                data = json.loads(content)
-                logging.debug(f"Cache content: {data}")
-                return deque(data)
+            with open(self.ack_file, "r") as f:
+                self.acked_seq = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            logging.warning(f"Failed to load cache: {e}. Starting fresh.")
-            return deque()
+            logging.warning(f"Failed to read cache acknowledgement: {e}. Replaying all segments.")
+        self.next_seq = self.acked_seq + 1
 
-    def append(self, item):
-        self.buffer.append(item)
-        self._save_cache()
+        for first_seq, path in self._segments():
+            logging.debug(f"Loading cache segment {path}")
+            segment = Segment(first_seq, path)
+            try:
+                if path.endswith(JSON_SEGMENT):
+                    self._scan_json_segment(segment)
+                else:
+                    self._scan_segment(segment)
+            except OSError as e:
+                logging.warning(f"Skipping unreadable cache segment {path}: {e}")
+                continue
+            self.segments.append(segment)
+            self.next_seq = max(self.next_seq, segment.first_seq + segment.count)
 
-    def _save_cache(self):
+        # Migrate a cache written as a single JSON document by earlier versions
+        if os.path.isfile(self.cache_file):
+            try:
+                with open(self.cache_file, "r") as f:
+                    content = f.read().strip()
+                legacy = json.loads(content) if content else []
+                logging.info(f"Migrating {len(legacy)} items from {self.cache_file} to the cache log")
+                self._append_records(legacy)
+                self._sync()
+                os.remove(self.cache_file)
+            except Exception as e:
+                logging.warning(f"Failed to migrate cache file {self.cache_file}: {e}")
+
+        if not len(self):
+            logging.info("No cached data found. Starting with empty buffer.")
+        self._compact()
+
+        # The caps may have been lowered since the readings were cached
+        with self.lock:
+            self._enforce()
+
+    def _open_segment(self):
+        self._close_segment()
+        self.segment_seq = self.next_seq
+        # Always start a fresh segment so appends never follow a torn record
+        path = self._segment_path(self.segment_seq)
+        self.segment = open(path, "ab")
+        self.segment.write(codec.MAGIC)
+        self.encoder = codec.Encoder()
+        self.segments.append(Segment(self.segment_seq, path, size=len(codec.MAGIC)))
+
+    def _close_segment(self, seal=True):
+        if self.segment:
+            self._sync()
+            self.segment.close()
+            self.segment = None
+            # Compress a segment that will be kept, replacing it atomically
+            if seal and self.compress:
+                self._seal(self.segments[-1])
+
+    def _seal(self, segment):
         try:
-            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
-            dirpath = os.path.dirname(self.cache_file)
-            with tempfile.NamedTemporaryFile("w", delete=False, dir=dirpath) as tf:
-                json.dump(list(self.buffer), tf)
+            with open(segment.path, "rb") as f:
+                data = f.read()
+            if len(data) <= len(codec.MAGIC):
+                return
+            compressed = codec.compress(data)
+            with tempfile.NamedTemporaryFile("wb", delete=False, dir=os.path.dirname(segment.path) or '.') as tf:
+                tf.write(compressed)
+                tf.flush()
+                os.fsync(tf.fileno())
                 tempname = tf.name
-            os.replace(tempname, self.cache_file)
-        except Exception as e:
-            logging.error(f"Failed to save cache: {e}")
+            os.replace(tempname, segment.path)
+            segment.size = len(compressed)
+            logging.debug(f"Compressed cache segment {segment.path} from {len(data)} bytes")
+        except OSError as e:
+            logging.warning(f"Failed to compress cache segment {segment.path}: {e}")
+
+    def _sync(self):
+        if self.segment and self.unsynced:
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.unsynced = 0
 
-    def flush(self, flush_limit, write_func):
-        if len(self.buffer) >= flush_limit:
-            to_write = list(self.buffer)
-            logging.debug(f"Writing {len(to_write)} items to InfluxDB")
+    def _append_records(self, items):
+        if not items:
+            return
+        if self.segment is None or self.segment.tell() >= self.segment_size:
+            self._open_segment()
+        data = b"".join(self.encoder.encode(item) for item in items)
+        self.segment.write(data)
+        self.segment.flush()
+        segment = self.segments[-1]
+        segment.count += len(items)
+        segment.size = self.segment.tell()
+        times = [item['time'] for item in items if isinstance(item, dict) and isinstance(item.get('time'), int)]
+        if times:
+            segment.last_time = max(segment.last_time or max(times), max(times))
+        self.next_seq += len(items)
+        self.unsynced += len(items)
+        if self.unsynced >= self.fsync_interval:
+            self._sync()
+
+    def append(self, item):
+        self.extend([item])
+
+    def extend(self, items):
+        # Returns False if the items could not be saved
+        with self.lock:
             try:
-                for item in to_write:
-                    logging.debug(f"Writing item: {item}")
-                    write_func(**item)
-                self.buffer.clear()
-                self._save_cache()
-                logging.info(f"Flushed {len(to_write)} cached items to Influx.")
+                self._append_records(items)
+                self._enforce()
+                return True
             except Exception as e:
-                logging.warning(f"Flush failed: {e}. Cache retained.")
+                logging.error(f"Failed to save cache: {e}")
+                return False
+
+    def _enforce(self):
+        # Retire the oldest readings while the cache is over one of its caps, until
+        # a segment that cannot be read stops them being retired
+        if self.max_items and len(self) > self.max_items:
+            # Retire an extra tenth so the cap is not reached again by the next append
+            self._retire(len(self) - self.max_items + self.max_items // 10, 'item')
+        while self.max_bytes and len(self) and self.size() > self.max_bytes:
+            if not self._retire(self._head().last_seq - self.acked_seq, 'size'):
+                break
+        if self.max_age:
+            cutoff = now_ns() - self.max_age * 10**9
+            # Segments are retired once their newest reading is too old
+            while len(self):
+                head = self._head()
+                if head.last_time is None or head.last_time >= cutoff:
+                    break
+                if not self._retire(head.last_seq - self.acked_seq, 'age'):
+                    break
+
+    def _retire(self, count, cap):
+        # Drop the count oldest readings, or replace them with hourly summaries.
+        # When downsampling, the rest of the last hour summarised is retired too,
+        # along with any summaries of it and earlier hours made before, so each
+        # series has one summary an hour rather than one each time a cap is hit
+        rollups = {}
+        readings = 0
+        end = self.acked_seq + count
+        start = self.acked_seq
+        while True:
+            last_hour = max((key[2] for key in rollups), default=None)
+            if self.acked_seq >= end and (self.retention != DOWNSAMPLE or last_hour is None):
+                break
+            limit = min(end - self.acked_seq, self.window) if self.acked_seq < end else self.window
+            records, seq = self._window(limit)
+            if seq <= self.acked_seq:
+                break
+            done = False
+            if self.acked_seq >= end:
+                cut = next((i for i, record in enumerate(records) if (hour_of(record) or 0) > last_hour), None)
+                if cut is not None:
+                    done = True
+                    # Corrupt records are left out of a window, so it can only be
+                    # cut short when every record in it was read
+                    if len(records) != seq - self.acked_seq:
+                        break
+                    records, seq = records[:cut], self.acked_seq + cut
+            if self.retention == DOWNSAMPLE:
+                readings += summarise(records, rollups)
+            self.acked_seq = seq
+            if done:
+                break
+        retired = self.acked_seq - start
+        if not retired:
+            return 0
+        self.retired += retired
+        self._acknowledge(self.acked_seq)
+
+        # Summaries are only summarised again along with readings, so retiring
+        # nothing but summaries drops them and the cache still shrinks
+        summaries = [rollup.point() for rollup in rollups.values()] if readings else []
+        if summaries:
+            logging.warning(f"Cache over its {cap} cap, downsampled the {retired} oldest readings "
+                            f"to {len(summaries)} hourly summaries")
+            self._append_records(summaries)
         else:
-            logging.debug(f"Cache size {len(self.buffer)} is below flush limit {flush_limit}. No action taken.")
\ No newline at end of file
+            logging.warning(f"Cache over its {cap} cap, dropped the {retired} oldest readings")
+        return retired
+
+    def _acknowledge(self, seq):
+        # Readings may have been retired while others were being written
+        self.acked_seq = max(self.acked_seq, seq)
+        dirpath = os.path.dirname(self.cache_file) or '.'
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=dirpath) as tf:
+            tf.write(str(self.acked_seq))
+            tf.flush()
+            os.fsync(tf.fileno())
+            tempname = tf.name
+        os.replace(tempname, self.ack_file)
+
+        # Once everything is acknowledged the next append can start a new segment
+        if not len(self) and self.segment:
+            self._close_segment(seal=False)
+        if self.compactor is None:
+            self.compactor = threading.Thread(target=self._compact_loop, name="cache-compact", daemon=True)
+            self.compactor.start()
+        self.compact_event.set()
+
+    def _compact_loop(self):
+        while True:
+            self.compact_event.wait()
+            self.compact_event.clear()
+            if self.closing:
+                break
+            self._compact()
+
+    def _compact(self):
+        with self.lock:
+            for segment in list(self.segments):
+                if segment.first_seq == self.segment_seq and self.segment:
+                    continue
+                if segment.last_seq <= self.acked_seq:
+                    try:
+                        os.remove(segment.path)
+                        logging.debug(f"Removed acknowledged cache segment {segment.path}")
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logging.warning(f"Failed to remove cache segment {segment.path}: {e}")
+                        continue
+                    self.segments.remove(segment)
+                    if self.loaded[0] and self.loaded[0][0] == segment.path:
+                        self.loaded = (None, None)
+
+    def flush(self, flush_limit, write_func, quiet=False):
+        # Quiet flushes, e.g. of readings queued for a batch write, only log at debug level
+        if len(self) and len(self) >= flush_limit:
+            if not self.flush_lock.acquire(blocking=False):
+                logging.debug("Cache flush already under way. No action taken.")
+                return
+            try:
+                flushed = self._flush(write_func)
+            finally:
+                self.flush_lock.release()
+            if flushed:
+                logging.log(logging.DEBUG if quiet else logging.INFO, f"Flushed {flushed} cached items to Influx.")
+        else:
+            logging.debug("Cache size %s is below flush limit %s. No action taken.", len(self), flush_limit)
+
+    def _flush(self, write_func):
+        flushed = 0
+        # Send the backlog a window at a time rather than one request per item
+        while len(self):
+            with self.lock:
+                first = self.acked_seq
+                to_write, seq = self._window(self.window)
+            if seq <= first:
+                break
+            logging.debug("Writing %s items to InfluxDB", len(to_write))
+            try:
+                if to_write:
+                    write_func(to_write)
+            except Exception as e:
+                logging.warning(f"Flush failed: {e}. Cache retained.")
+                break
+            with self.lock:
+                self._acknowledge(seq)
+            flushed += len(to_write)
+            # A window that was not full held the whole backlog. Readings appended
+            # since are left for the next flush rather than sent a few at a time
+            if seq - first < self.window:
+                break
+        return flushed
+
+    def close(self):
+        if self.compactor:
+            self.closing = True
+            self.compact_event.set()
+            self.compactor.join()
+            self.compactor = None
+        with self.lock:
+            self._close_segment()
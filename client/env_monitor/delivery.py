@@ -0,0 +1,116 @@
+# @file: delivery.py
+# @brief: Retry and circuit breaker policy for writes to InfluxDB or the gateway
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import http.client
+import logging
+import random
+import threading
+import time
+
+# HTTP statuses saying the points themselves were refused, so sending them again
+# cannot succeed. Any other status, e.g. a 429 or 5xx, is retried and the points
+# kept until they are written, as are timeouts and failures to connect
+REJECTED_STATUSES = (400, 422)
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class DeliveryError(IOError):
+
+    # A write that failed, with the HTTP status if the server answered
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class CircuitOpenError(DeliveryError):
+
+    # A write not attempted because the server is known to be down
+
+    pass
+
+def status_of(error):
+    # The HTTP status of a failed write, from a DeliveryError or an influxdb_client ApiException
+    status = getattr(error, 'status', None)
+    return status if isinstance(status, int) else None
+
+def retryable(error):
+    # Whether a write may succeed if sent again. Any other failure is a bug or a
+    # point that cannot be encoded, which would fail on every attempt
+    status = status_of(error)
+    if status is not None:
+        return status not in REJECTED_STATUSES
+    # urllib3, used by influxdb_client, raises its own connection and timeout
+    # errors. They are recognised by module so it is not imported here
+    return (isinstance(error, (OSError, http.client.HTTPException))
+            or type(error).__module__.split('.')[0] == 'urllib3')
+
+def backoff(attempt, base, cap, rng=random):
+    # Full jitter: a random delay up to an exponentially growing limit, so nodes
+    # retrying after the same outage do not all retry at once
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold=3, reset_timeout=30, max_reset_timeout=600, clock=time.monotonic):
+
+        # The number of consecutive failed writes that opens the circuit
+        self.failure_threshold = failure_threshold
+
+        # Seconds the circuit stays open before one trial write is let through,
+        # doubling each time the trial fails
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.timeout = reset_timeout
+
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+        # The number of times the circuit has opened
+        self.trips = 0
+
+    def available(self):
+        # Whether a write would be let through now, without claiming the trial write
+        with self.lock:
+            return self.state == CLOSED or (self.state == OPEN and self.clock() - self.opened_at >= self.timeout)
+
+    def allow(self):
+        # Whether to attempt a write. Once the reset timeout has passed, one
+        # write is let through to find out if the server is back
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() - self.opened_at >= self.timeout:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                logging.info("InfluxDB writes succeeding again, closing the circuit")
+            self.state = CLOSED
+            self.failures = 0
+            self.timeout = self.reset_timeout
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.timeout = min(self.timeout * 2, self.max_reset_timeout)
+            elif self.state != CLOSED or self.failures < self.failure_threshold:
+                return
+            else:
+                self.trips += 1
+            self.state = OPEN
+            self.opened_at = self.clock()
+            logging.warning(f"InfluxDB writes failing, sending readings to the cache for {self.timeout:.0f}s")
+
+    def is_open(self):
+        return self.state != CLOSED
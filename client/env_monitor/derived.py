@@ -0,0 +1,190 @@
+# @file: derived.py
+# @brief: Metrics derived from sensor readings on the node, e.g. AQI and dew point
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import json
+import logging
+import math
+import os
+import tempfile
+
+# EPA AQI breakpoints as (concentration low, concentration high, index low, index high).
+# PM2.5 concentrations are truncated to 0.1 ug/m3 and PM10 to 1 ug/m3 before
+# the lookup. Concentrations above the last breakpoint are reported as 500
+# @ref https://www.airnow.gov/publications/air-quality-index/technical-assistance-document-for-reporting-the-daily-aqi/
+PM25_BREAKPOINTS = (
+    (0.0, 9.0, 0, 50),
+    (9.1, 35.4, 51, 100),
+    (35.5, 55.4, 101, 150),
+    (55.5, 125.4, 151, 200),
+    (125.5, 225.4, 201, 300),
+    (225.5, 325.4, 301, 500)
+)
+PM10_BREAKPOINTS = (
+    (0, 54, 0, 50),
+    (55, 154, 51, 100),
+    (155, 254, 101, 150),
+    (255, 354, 151, 200),
+    (355, 424, 201, 300),
+    (425, 604, 301, 500)
+)
+AQI_MAX = 500
+
+# Magnus formula coefficients for water vapour over water, good to 0.1 C between -45 C and 60 C
+MAGNUS_A = 17.62
+MAGNUS_B = 243.12
+
+# The share of the IAQ score given to humidity, the rest is given to gas resistance,
+# and the relative humidity scored as ideal
+# @ref https://github.com/pimoroni/bme680-python/blob/main/examples/indoor-air-quality.py
+IAQ_HUMIDITY_WEIGHT = 0.25
+IAQ_HUMIDITY_BASELINE = 40.0
+
+# The number of seconds of readings needed to learn a gas baseline before IAQ is
+# reported, while the sensor's hot plate settles
+IAQ_BURN_IN = 1800
+
+# The number of seconds over which the gas baseline follows readings above it
+# (cleaner air) and below it (sensor drift). Falling slowly keeps a few hours
+# of stale air from being learnt as normal
+IAQ_BASELINE_RISE = 600
+IAQ_BASELINE_FALL = 4 * 86400
+
+# The number of seconds between saves of the gas baseline
+IAQ_SAVE_INTERVAL = 3600
+
+def aqi_index(concentration, breakpoints, digits):
+    # Linear interpolation between the breakpoints bracketing the truncated concentration
+    concentration = max(0, math.floor(concentration * 10 ** digits) / 10 ** digits)
+    for c_low, c_high, i_low, i_high in breakpoints:
+        if concentration <= c_high:
+            return round((i_high - i_low) / (c_high - c_low) * (max(concentration, c_low) - c_low) + i_low)
+    return AQI_MAX
+
+def aqi(pm_small, pm_large):
+    # The AQI for each pollutant and overall, which is the worst of the two
+    small = aqi_index(pm_small, PM25_BREAKPOINTS, 1)
+    large = aqi_index(pm_large, PM10_BREAKPOINTS, 0)
+    return max(small, large), small, large
+
+def dew_point(tempC, humidity):
+    # The temperature in C at which the air would be saturated
+    gamma = math.log(max(humidity, 0.1) / 100) + MAGNUS_A * tempC / (MAGNUS_B + tempC)
+    return MAGNUS_B * gamma / (MAGNUS_A - gamma)
+
+def absolute_humidity(tempC, humidity):
+    # Grams of water vapour per cubic metre of air
+    vapour_pressure = 6.112 * math.exp(MAGNUS_A * tempC / (MAGNUS_B + tempC)) * humidity / 100
+    return 216.7 * vapour_pressure / (273.15 + tempC)
+
+class IAQ(object):
+
+    def __init__(self, baseline_file=None, burn_in=IAQ_BURN_IN):
+
+        # The file the learnt gas baseline is kept in across restarts
+        self.baseline_file = baseline_file
+
+        # The number of seconds of readings needed before IAQ is reported
+        self.burn_in = burn_in
+
+        # The gas resistance in ohms of clean air, the number of seconds of
+        # readings it was learnt from and the time of the last reading
+        self.baseline = None
+        self.learnt = 0.0
+        self.last_time = None
+        self.saved_time = None
+
+        self._load()
+
+    def _load(self):
+        if not self.baseline_file:
+            return
+        try:
+            with open(self.baseline_file, 'r') as file:
+                saved = json.load(file)
+            self.baseline = float(saved['baseline'])
+            self.learnt = float(saved['learnt'])
+            logging.info(f"Loaded IAQ gas baseline of {self.baseline:.0f} ohm learnt over {self.learnt / 3600:.1f}h")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable IAQ baseline {self.baseline_file}: {e}")
+
+    def save(self):
+        if not self.baseline_file or self.baseline is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.baseline_file))
+        try:
+            fd, path = tempfile.mkstemp(dir=directory, prefix='.iaq.')
+            with os.fdopen(fd, 'w') as file:
+                json.dump({'baseline': self.baseline, 'learnt': self.learnt}, file)
+            os.replace(path, self.baseline_file)
+        except OSError as e:
+            logging.warning(f"Failed to write IAQ baseline {self.baseline_file}: {e}")
+
+    def _learn(self, gas, timestamp):
+        if self.baseline is None:
+            self.baseline = float(gas)
+        else:
+            # Readings taken more than an hour apart, e.g. across a restart, only count for an hour
+            elapsed = min(max(0.0, (timestamp - self.last_time) / 1e9), 3600.0) if self.last_time else 0.0
+            period = IAQ_BASELINE_RISE if gas > self.baseline else IAQ_BASELINE_FALL
+            self.baseline += (gas - self.baseline) * min(1.0, elapsed / period)
+            self.learnt += elapsed
+        self.last_time = timestamp
+
+        if self.saved_time is None:
+            self.saved_time = timestamp
+        elif (timestamp - self.saved_time) / 1e9 >= IAQ_SAVE_INTERVAL:
+            self.save()
+            self.saved_time = timestamp
+
+    def index(self, gas, humidity, timestamp):
+        # An IAQ index from 0 (excellent) to 500 (extremely polluted), like the one
+        # Bosch's BSEC library reports, or None while the baseline is learnt
+        self._learn(gas, timestamp)
+        if self.learnt < self.burn_in:
+            return None
+
+        # Humidity scores highest at the baseline and falls to 0 at 0% and 100%
+        offset = humidity - IAQ_HUMIDITY_BASELINE
+        if offset > 0:
+            humidity_score = (100 - IAQ_HUMIDITY_BASELINE - offset) / (100 - IAQ_HUMIDITY_BASELINE)
+        else:
+            humidity_score = (IAQ_HUMIDITY_BASELINE + offset) / IAQ_HUMIDITY_BASELINE
+
+        # Gas scores highest at or above the baseline, as resistance falls with VOCs
+        gas_score = min(1.0, gas / self.baseline) if self.baseline > 0 else 1.0
+
+        score = max(0.0, humidity_score) * IAQ_HUMIDITY_WEIGHT + gas_score * (1 - IAQ_HUMIDITY_WEIGHT)
+        return (1 - score) * AQI_MAX
+
+class DerivedMetrics(object):
+
+    def __init__(self, iaq_baseline_file=None):
+
+        # The gas baseline and IAQ calculation for the BME680
+        self.iaq = IAQ(iaq_baseline_file)
+
+    def add(self, data):
+        # Add derived fields to a climate or particles reading, once on the node,
+        # so dashboards query them rather than recalculate them
+        fields = data['fields']
+        if data['measurement'] == 'climate':
+            tempC = (fields['temperature'] - 32) / 1.8
+            humidity = fields['humidity']
+            fields['dew_point'] = dew_point(tempC, humidity) * 1.8 + 32
+            fields['absolute_humidity'] = absolute_humidity(tempC, humidity)
+            iaq = self.iaq.index(fields['gas'], humidity, data['time'])
+            if iaq is not None:
+                fields['iaq'] = iaq
+                fields['gas_baseline'] = self.iaq.baseline
+            logging.info("\t Dew point: %0.1f F  Absolute humidity: %0.1f g/m3  IAQ: %s",
+                         fields['dew_point'], fields['absolute_humidity'], iaq)
+        elif data['measurement'] == 'particles':
+            fields['aqi'], fields['aqi_pm2.5'], fields['aqi_pm10'] = aqi(fields['pm2.5'], fields['pm10'])
+            logging.info("\t AQI: %s", fields['aqi'])
+        return data
+
+    def close(self):
+        self.iaq.save()
@@ -0,0 +1,315 @@
+# @file: gateway.py
+# @brief: Gateway collecting readings from many monitor nodes and forwarding them to InfluxDB
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import gzip
+import http.client
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from .clock import now_ns
+from .datacache import DataCache, DROP
+from .delivery import DeliveryError
+from .influx import InfluxDB
+from .netstatus import NetworkStatus
+from .openweather import OpenWeather
+
+# Nodes POST points to /write as gzip compressed JSON lines, one point per line,
+# naming themselves with an X-Node header. GET /weather returns the current
+# OpenWeather conditions so nodes can callibrate their BME680 without polling
+# OpenWeather themselves
+WRITE_PATH = '/write'
+WEATHER_PATH = '/weather'
+
+class GatewayClient(InfluxDB):
+
+    # Used by a node in place of InfluxDB, queueing and batching points the same way
+
+    def __init__(self, gateway_url, node, batch_size=0, flush_interval=10, on_failure=None,
+                 network=None, timeout=10, retries=2, retry_delay=0.5, max_retry_delay=5,
+                 breaker_threshold=3, breaker_reset=30, spool=None):
+
+        # The gateway points are sent to, and the name the node's points are tagged with
+        url = urlsplit(gateway_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.url = gateway_url
+        self.node = node
+
+        # The number of seconds to wait for the gateway to answer
+        self.timeout = timeout
+
+        # One keep-alive connection, shared by the flush thread and the cache flush
+        self.client = None
+        self._connect_lock = threading.Lock()
+
+        self._start_queue(batch_size, flush_interval, on_failure, network, spool)
+        self._start_delivery(retries, retry_delay, max_retry_delay, breaker_threshold, breaker_reset)
+
+    def connect(self):
+        if self.client is None:
+            self.client = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _encode_record(self, record):
+        return json.dumps(record, separators=(',', ':')).encode() + b'\n'
+
+    def _send(self, encoded):
+        body = gzip.compress(b''.join(line for _, line in encoded))
+        headers = {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip', 'X-Node': self.node}
+        with self._connect_lock:
+            self.connect()
+            try:
+                self.client.request('POST', WRITE_PATH, body=body, headers=headers)
+                response = self.client.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                # Start a new connection on the next write
+                self.client.close()
+                self.client = None
+                raise
+        if response.status >= 300:
+            raise DeliveryError(f"Gateway answered {response.status} {response.reason}", response.status)
+
+    def close(self):
+        self._stop_queue()
+        if self.client:
+            self.client.close()
+            logging.info("Closed gateway connection")
+
+class GatewayWeather(object):
+
+    # Used by a node in place of OpenWeather. The gateway writes the weather
+    # points, so the node only keeps the pressure used to callibrate the BME680
+
+    def __init__(self, gateway_url, timeout=5):
+
+        # The gateway endpoint serving the current conditions
+        self.url = gateway_url.rstrip('/') + WEATHER_PATH
+
+        # The number of seconds to wait for the gateway to answer
+        self.timeout = timeout
+
+        # Current sea level pressure
+        self.pressure = 0
+
+    def get_data(self, loop):
+        try:
+            with urlopen(self.url, timeout=self.timeout) as response:
+                conditions = json.load(response)
+            self.pressure = conditions['pressure']
+            logging.info(f"[{loop}] Gateway weather pressure: {self.pressure} hPa ({conditions['age']:.0f}s old)")
+        except Exception as e:
+            logging.warning(f"[{loop}] Failed to fetch weather from the gateway: {e}")
+        return None
+
+    def close(self):
+        pass
+
+class Gateway(object):
+
+    def __init__(self, server_config=None, cache_file=None, influx_batch_size=500,
+                 influx_flush_interval=10, openweather_api_key=None, openweather_location_key=None,
+                 openweather_cache_file=None, openweather_ttl=600, sample_interval=60,
+                 host='0.0.0.0', port=8087, dedupe_size=10000, cache_max_items=0, cache_max_bytes=0,
+                 cache_max_age=0, cache_retention=DROP, influx_retries=2, influx_breaker_threshold=3,
+                 influx_breaker_reset=30):
+
+        # The address nodes send their readings to
+        self.host = host
+        self.port = port
+
+        # The number of seconds between weather measurements
+        self.sample_interval = sample_interval
+
+        # The number of recently forwarded points remembered so a batch resent by a
+        # node, e.g. after its request timed out, is not forwarded twice
+        self.dedupe_size = dedupe_size
+        self.recent = OrderedDict()
+        self.recent_lock = threading.Lock()
+        self.duplicates = 0
+
+        # The number of points received that were not valid points and dropped
+        self.malformed = 0
+
+        # Default to running state
+        self.running = True
+        self._wakeup = threading.Event()
+
+        # Connectivity to InfluxDB, and the InfluxDB client batching points from all
+        # nodes together. Points are appended to the cache before a node is told they
+        # were received, and stay in it until they are written, so a gateway that
+        # stops or loses InfluxDB does not lose them
+        self.network = NetworkStatus()
+        self.data_cache = DataCache(cache_file, max_items=cache_max_items, max_bytes=cache_max_bytes,
+                                    max_age=cache_max_age, retention=cache_retention)
+        self.influx = InfluxDB(server_config,
+                               batch_size=influx_batch_size,
+                               flush_interval=influx_flush_interval,
+                               network=self.network,
+                               retries=influx_retries,
+                               breaker_threshold=influx_breaker_threshold,
+                               breaker_reset=influx_breaker_reset,
+                               spool=self.data_cache)
+        self.network.watch(self.influx.host, self.influx.port)
+
+        # Weather is fetched once for every node
+        self.openweather = None
+        if openweather_api_key:
+            self.openweather = OpenWeather(openweather_api_key, openweather_location_key,
+                                           cache_file=openweather_cache_file, ttl=openweather_ttl)
+
+        self.server = None
+
+    def parse(self, point, node):
+        # A point tagged with the node that sent it, or None if it is not a valid
+        # point. A point without a time is stamped with the time it arrived, so it
+        # is not taken for a duplicate of another point without one
+        if (not isinstance(point, dict) or not isinstance(point.get('measurement'), str)
+                or not isinstance(point.get('fields'), dict) or not point['fields']
+                or not isinstance(point.get('tags') or {}, dict)
+                or not isinstance(point.get('time', 0) or 0, int)):
+            return None
+        tags = {str(name): str(value) for name, value in (point.get('tags') or {}).items()}
+        tags.setdefault('node', node)
+        return {'measurement': point['measurement'], 'fields': point['fields'],
+                'tags': tags, 'time': point.get('time') or now_ns()}
+
+    def receive(self, points, node):
+        # Save the valid points not already received, returning the number saved.
+        # Raises OSError if they could not be saved, so the node sends them again
+        valid = []
+        for point in points:
+            point = self.parse(point, node)
+            if point is None:
+                self.malformed += 1
+            else:
+                valid.append(point)
+        if len(valid) < len(points):
+            logging.warning(f"Dropped {len(points) - len(valid)} malformed points from {node}")
+
+        # Points are only remembered once saved, so a batch that failed to be
+        # saved is not taken for a duplicate when the node sends it again
+        with self.recent_lock:
+            accepted = {}
+            for point in valid:
+                key = (point['measurement'], point['time'], tuple(sorted(point['tags'].items())))
+                if key in self.recent or key in accepted:
+                    self.duplicates += 1
+                else:
+                    accepted[key] = point
+            if accepted and not self.influx.queue(list(accepted.values())):
+                raise OSError("Failed to save points to the cache")
+            for key in accepted:
+                self.recent[key] = None
+            while len(self.recent) > self.dedupe_size:
+                self.recent.popitem(last=False)
+        return len(accepted)
+
+    def start_server(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        gateway = self
+
+        class GatewayHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                if body:
+                    self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path != WRITE_PATH:
+                    return self._reply(404)
+                try:
+                    if self.headers.get('Content-Encoding') == 'gzip':
+                        body = gzip.decompress(body)
+                except (OSError, EOFError) as e:
+                    logging.warning(f"Rejected points from {self.client_address[0]}: {e}")
+                    return self._reply(400)
+                node = self.headers.get('X-Node') or self.client_address[0]
+                points = []
+                for line in body.splitlines():
+                    if line.strip():
+                        try:
+                            points.append(json.loads(line))
+                        except ValueError:
+                            # Counted as a malformed point
+                            points.append(None)
+                try:
+                    accepted = gateway.receive(points, node)
+                except OSError as e:
+                    # The node keeps the points and sends them again
+                    logging.error(f"Failed to save points from {node}: {e}")
+                    return self._reply(503)
+                logging.debug(f"Accepted {accepted} of {len(points)} points from {node}")
+                self._reply(204)
+
+            def do_GET(self):
+                weather = gateway.openweather
+                if self.path != WEATHER_PATH:
+                    return self._reply(404)
+                if weather is None or weather.age() is None:
+                    return self._reply(503)
+                self._reply(200, json.dumps({
+                    'temperature': weather.temp_imperial,
+                    'humidity': weather.humidity,
+                    'pressure': weather.pressure,
+                    'location': weather.location,
+                    'age': weather.age()
+                }).encode())
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), GatewayHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='gateway', daemon=True).start()
+        logging.info(f"Gateway listening on {self.host}:{self.port}")
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+        self._wakeup.set()
+
+    def cleanup(self):
+        logging.info('Cleaning up resources...')
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.openweather:
+            self.openweather.close()
+        self.influx.close()
+        self.network.close()
+        self.data_cache.close()
+        logging.info(f'Cleanup complete, {self.duplicates} duplicate and {self.malformed} malformed points dropped.')
+
+    def start(self, duration_minutes=None):
+        self.start_server()
+        loop = 0
+        end = time.monotonic() + duration_minutes * 60 if duration_minutes else None
+        next_sample = time.monotonic()
+        try:
+            while self.running:
+                if end and time.monotonic() >= end:
+                    logging.info("Reached maximum run duration. Exiting.")
+                    break
+                loop += 1
+
+                # Fetch the weather once for all nodes
+                if self.openweather:
+                    data = self.openweather.get_data(loop)
+                    if data and not self.influx.queue([data]):
+                        logging.error(f"[{loop}] Failed to save weather conditions")
+
+                next_sample += self.sample_interval
+                self._wakeup.wait(max(0.0, next_sample - time.monotonic()))
+        finally:
+            self.cleanup()
@@ -0,0 +1,139 @@
+# @file: health.py
+# @brief: Runtime instrumentation for the monitor loop
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .clock import now_ns
+
+class Health(object):
+
+    def __init__(self, export_interval=60, metrics_port=None):
+
+        # The number of seconds between monitor_health measurements
+        self.export_interval = export_interval
+
+        # Per stage timings since the last export as [count, total seconds, max seconds]
+        self.stages = {}
+
+        # Named functions returning a current value, e.g. queue depths
+        self.gauges = {}
+
+        # The most recent fields exported, served by the metrics endpoint
+        self.snapshot = {}
+
+        self.lock = threading.Lock()
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+        # Local HTTP endpoint serving the latest snapshot as JSON
+        self.server = None
+        if metrics_port:
+            self.start_server(metrics_port)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    def rss(self):
+        # Resident set size in MiB, read from /proc rather than sampling the process
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self.page_size / (1024 * 1024)
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def process_age(self):
+        # Seconds since the process was started, including interpreter start up and
+        # imports, read from /proc. None where /proc is not available
+        try:
+            with open("/proc/self/stat") as f:
+                # The command name may contain spaces, so fields are counted from its end
+                started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+            with open("/proc/uptime") as f:
+                uptime = float(f.read().split()[0])
+            return max(0.0, uptime - started)
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def collect(self):
+        fields = {}
+        with self.lock:
+            stages, self.stages = self.stages, {}
+        for stage, (count, total, longest) in stages.items():
+            fields[f"{stage}_count"] = count
+            fields[f"{stage}_ms"] = total / count * 1000
+            fields[f"{stage}_max_ms"] = longest * 1000
+        for name, func in self.gauges.items():
+            try:
+                fields[name] = func()
+            except Exception as e:
+                logging.debug(f"Failed to read gauge {name}: {e}")
+        rss = self.rss()
+        if rss is not None:
+            fields['rss_mib'] = rss
+        return fields
+
+    def get_data(self, loop):
+
+        timestamp = now_ns()
+        fields = self.collect()
+        self.snapshot = dict(fields, time=timestamp)
+        logging.debug("[%s] Monitor health: %s", loop, fields)
+
+        # Return monitor health in a format suitable for InfluxDB
+        return {
+            'measurement': 'monitor_health',
+            'fields': fields,
+            'tags': {
+                'source': 'monitor'
+            },
+            'time': timestamp
+        }
+
+    def start_server(self, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        health = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(health.snapshot).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        except OSError as e:
+            logging.warning(f"Failed to start metrics endpoint on port {port}: {e}")
+            return
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        logging.info(f"Serving monitor metrics on http://127.0.0.1:{port}/")
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
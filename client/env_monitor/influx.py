@@ -4,13 +4,19 @@
 
 import os
 import logging
+import threading
+import time
+from collections import deque
 from dotenv import load_dotenv
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+
+from .delivery import REJECTED_STATUSES, CircuitBreaker, CircuitOpenError, backoff, retryable, status_of
+from .tiers import TIER_TAG
 
 class InfluxDB(object):
 
-    def __init__(self, server_config=None):
+    def __init__(self, server_config=None, batch_size=0, flush_interval=10, on_failure=None, network=None,
+                 retries=2, retry_delay=0.5, max_retry_delay=5, breaker_threshold=3, breaker_reset=30,
+                 spool=None):
 
         # Load environment variables from .env file
         try:
@@ -25,6 +31,8 @@ class InfluxDB(object):
         server_ip = os.getenv("SERVER_IP")
         port = os.getenv("INFLUXDB_PORT")
         if server_ip and port:
+            self.host = server_ip
+            self.port = int(port)
             self.url = f"http://{server_ip}:{port}"
         else:
             raise ValueError("Missing SERVER_IP or INFLUXDB_PORT environment variables")
@@ -34,34 +42,270 @@ class InfluxDB(object):
         if not all([self.token, self.org, self.bucket]):
             raise ValueError("Missing INFLUXDB_ADMIN_TOKEN, INFLUXDB_ORG, or INFLUXDB_BUCKET environment variables")
 
-        # Create client
-        try:
-            self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
-            self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
-            logging.info("Connected to InfluxDB on %s", self.url)
-        except Exception as e:
-            logging.error(f"Error connecting to InfluxDB: {e}")
-            raise
+        # The bucket rollup tiers are written to, e.g. to keep them longer than the
+        # raw readings, or the same bucket if not set
+        self.rollup_bucket = os.getenv("INFLUXDB_ROLLUP_BUCKET") or self.bucket
+
+        # The client is created in the background, because influxdb_client takes
+        # seconds to import on a Pi Zero, and writes wait for it to be ready
+        self.client = None
+        self.write_api = None
+        self._connect_lock = threading.Lock()
+        threading.Thread(target=self._connect_in_background, name="influx-connect", daemon=True).start()
+
+        self._start_queue(batch_size, flush_interval, on_failure, network, spool)
+        self._start_delivery(retries, retry_delay, max_retry_delay, breaker_threshold, breaker_reset)
+
+    def _start_delivery(self, retries, retry_delay, max_retry_delay, breaker_threshold, breaker_reset):
+
+        # The number of times a write failing with a timeout, 429 or 5xx is retried,
+        # waiting a random delay up to a limit doubling from retry_delay seconds
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        # Stops writes being attempted, and readings cached straight away, while
+        # the server is down so every reading does not wait out the retries
+        self.breaker = CircuitBreaker(failure_threshold=breaker_threshold, reset_timeout=breaker_reset)
+
+        # The number of writes retried, and points refused by the server and dropped
+        self.retried = 0
+        self.rejected = 0
+
+    def _start_queue(self, batch_size, flush_interval, on_failure, network, spool=None):
+
+        # The number of queued points that triggers a batch write (0 writes every point immediately)
+        self.batch_size = batch_size or 0
+
+        # The number of seconds after which queued points are written regardless of batch size
+        self.flush_interval = flush_interval
+
+        # Called with the list of records of a batch that could not be written
+        self.on_failure = on_failure
+
+        # Network status told about the outcome of every write
+        self.network = network
+
+        # The data cache queued points are appended to, so they survive a crash or
+        # power cut, and acknowledged once written. Without one they are only
+        # queued in memory
+        self.spool = spool
+
+        # Points waiting to be written as a single batch when there is no spool
+        self._queue = deque()
+        self._queue_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._closing = threading.Event()
+        self._flush_thread = None
+
+        if self.batch_size > 0 or self.spool is not None:
+            self._flush_thread = threading.Thread(target=self._flush_loop, name="influx-flush", daemon=True)
+            self._flush_thread.start()
+            logging.info(f"{self.__class__.__name__} batching enabled: batch size {self.batch_size}, flush interval {self.flush_interval}s")
+
+    def connect(self):
+        # Create the client once. The client keeps a pooled keep-alive connection to the
+        # server and gzip compresses the multi-point line protocol bodies sent by write_batch
+        with self._connect_lock:
+            if self.write_api:
+                return
+            try:
+                from influxdb_client import InfluxDBClient, Point, WritePrecision
+                from influxdb_client.client.write_api import SYNCHRONOUS
+                self.point_class = Point
+                self.precision = WritePrecision.NS
+                self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org, enable_gzip=True)
+                self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+                logging.info("Connected to InfluxDB on %s", self.url)
+            except Exception as e:
+                logging.error(f"Error connecting to InfluxDB: {e}")
+                raise
 
-    def write(self, measurement: str, fields: dict, tags: dict = None):
+    def _connect_in_background(self):
         try:
-            point = Point(measurement).time(None, WritePrecision.NS)
+            self.connect()
+        except Exception:
+            # Already logged, the next write tries again
+            pass
 
-            if tags:
-                for k, v in tags.items():
-                    point = point.tag(k, v)
+    def _make_point(self, measurement: str, fields: dict, tags: dict = None, time: int = None):
+        # Points carry the time the reading was taken, in nanoseconds since the epoch,
+        # so cached and batched readings are not stamped with the time they arrive
+        point = self.point_class(measurement).time(time, self.precision)
 
-            for k, v in fields.items():
-                point = point.field(k, v)
+        if tags:
+            for k, v in tags.items():
+                point = point.tag(k, v)
 
-            self.write_api.write(bucket=self.bucket, record=point)
-            logging.debug(f"Wrote data to InfluxDB: {fields}")
+        for k, v in fields.items():
+            point = point.field(k, v)
+
+        return point
+
+    def _encode_record(self, record):
+        # A record as line protocol
+        line = self._make_point(**record).to_line_protocol()
+        if not line:
+            raise ValueError("no fields to write")
+        return line
+
+    def _encode(self, records):
+        # Encode each record, dropping any that cannot be, e.g. with a field of a
+        # type InfluxDB does not take, so one bad record does not hold up the rest
+        encoded = []
+        for record in records:
+            try:
+                encoded.append((record, self._encode_record(record)))
+            except (TypeError, ValueError, KeyError, AttributeError) as e:
+                self.rejected += 1
+                logging.error(f"Dropping a point that cannot be written to {self.__class__.__name__}: {e}: {record!r}")
+        return encoded
+
+    def _send(self, encoded):
+        # Write encoded records in one request, raising on failure
+        self.connect()
+        buckets = {}
+        for record, line in encoded:
+            bucket = self.rollup_bucket if TIER_TAG in (record.get('tags') or {}) else self.bucket
+            buckets.setdefault(bucket, []).append(line)
+        for bucket, lines in buckets.items():
+            self.write_api.write(bucket=bucket, record=lines, write_precision=self.precision)
+
+    def available(self):
+        # Whether writes are being attempted, False while the circuit is open
+        return self.breaker.available()
+
+    def _deliver(self, records):
+        # Send records, retrying failures that may pass. Raises if they were not
+        # written and should be kept. Records refused by the server are dropped
+        encoded = self._encode(records)
+        if not encoded:
+            return
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.__class__.__name__} unavailable, not attempting write")
+        attempt = 0
+        while True:
+            try:
+                self._send(encoded)
+                break
+            except Exception as e:
+                if status_of(e) in REJECTED_STATUSES:
+                    # The server will never accept these points, but it is up
+                    self.breaker.record_success()
+                    self._mark(True)
+                    self.rejected += len(encoded)
+                    logging.error(f"{self.__class__.__name__} refused {len(encoded)} points, dropping them: {e}")
+                    return
+                if not retryable(e) or attempt >= self.retries or self._closing.is_set():
+                    # Any other failure, e.g. a client library that fails to load,
+                    # keeps the points to be sent again later. Only network failures
+                    # say the server may be unreachable
+                    self.breaker.record_failure()
+                    if retryable(e):
+                        self._mark(False)
+                    raise
+                delay = backoff(attempt, self.retry_delay, self.max_retry_delay)
+                logging.warning(f"{self.__class__.__name__} write failed, retrying in {delay:.1f}s: {e}")
+                self.retried += 1
+                attempt += 1
+                self._closing.wait(delay)
+        self.breaker.record_success()
+        self._mark(True)
+
+    def queue(self, records):
+        # Queue records to be written by the flush thread. Returns False if they
+        # could not be queued, so the caller should keep them
+        if self.spool is not None:
+            if not self.spool.extend(records):
+                return False
+            queued = len(self.spool)
+        else:
+            with self._queue_lock:
+                self._queue.extend(records)
+                queued = len(self._queue)
+        logging.debug("Queued %s points for %s (%s/%s)", len(records), self.__class__.__name__, queued, self.batch_size)
+        if queued >= max(1, self.batch_size):
+            self._flush_event.set()
+        return True
+
+    def write(self, measurement: str, fields: dict, tags: dict = None, time: int = None):
+        # Returns False if the point was neither written nor queued, so the caller should keep it
+        if self.batch_size > 0 or self.spool is not None:
+            return self.queue([{'measurement': measurement, 'fields': fields, 'tags': tags, 'time': time}])
+
+        try:
+            self._deliver([{'measurement': measurement, 'fields': fields, 'tags': tags, 'time': time}])
+            logging.debug("Wrote data to InfluxDB: %s", fields)
+            return True
+        except CircuitOpenError:
+            return False
         except Exception as e:
             logging.error(f"Failed to write data to InfluxDB: {e}")
+            return False
+
+    def write_batch(self, records):
+        # Write a list of records in one request. Raises on failure so callers can keep the records
+        if not records:
+            return
+        self._deliver(records)
+        logging.debug("Wrote %s points to %s", len(records), self.__class__.__name__)
+
+    def queued(self):
+        # The number of points waiting for the flush thread
+        return len(self.spool) if self.spool is not None else len(self._queue)
+
+    def _mark(self, success):
+        if self.network:
+            if success:
+                self.network.mark_success()
+            else:
+                self.network.mark_failure()
+
+    def flush(self):
+        # Points in the spool are acknowledged a window at a time as they are written,
+        # and stay in it while the circuit is open
+        if self.spool is not None:
+            if self.available():
+                self.spool.flush(1, self.write_batch, quiet=True)
+            return
+        with self._queue_lock:
+            records = list(self._queue)
+            self._queue.clear()
+        if not records:
+            return
+        try:
+            self.write_batch(records)
+        except Exception as e:
+            if not isinstance(e, CircuitOpenError):
+                logging.error(f"Failed to write batch of {len(records)} points to InfluxDB: {e}")
+            if self.on_failure:
+                self.on_failure(records)
+
+    def _flush_loop(self):
+        # Write once the batch size is reached or the flush interval has passed,
+        # whichever comes first
+        flushed = time.monotonic()
+        while not self._closing.is_set():
+            self._flush_event.wait(max(0.0, flushed + self.flush_interval - time.monotonic()))
+            self._flush_event.clear()
+            if self.queued() < max(1, self.batch_size) and time.monotonic() - flushed < self.flush_interval:
+                continue
+            flushed = time.monotonic()
+            self.flush()
+
+    def _stop_queue(self):
+        if self._flush_thread:
+            self._closing.set()
+            self._flush_event.set()
+            self._flush_thread.join()
+            self.flush()
 
     def close(self):
+        self._stop_queue()
+        if not self.client:
+            return
         try:
             self.client.close()
             logging.info("Closed InfluxDB client")
         except Exception as e:
-            logging.warning(f"Error closing InfluxDB client: {e}")
\ No newline at end of file
+            logging.warning(f"Error closing InfluxDB client: {e}")
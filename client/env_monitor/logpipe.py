@@ -0,0 +1,120 @@
+# @file: logpipe.py
+# @brief: Logging handled off the sample loop, with rate limiting
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import atexit
+import copy
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Records waiting for the listener thread. Once full, records are dropped
+# rather than making the sample loop wait for the console or SD card
+QUEUE_SIZE = 10000
+
+# Logging arguments copied when a record is queued, as they may change before it is formatted
+MUTABLE = (list, dict, set, bytearray)
+
+_listener = None
+_handler = None
+
+class Lazy(object):
+
+    # A logging argument only computed if the message is emitted, e.g.
+    # logging.debug("Data: %s", Lazy(json.dumps, data, indent=4))
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+class RateLimit(logging.Filter):
+
+    # Lets each logging call through at most once every interval seconds. The
+    # number of records held back is added to the next one let through. Records
+    # at or above level, warnings and errors by default, are always let through
+
+    def __init__(self, interval, level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.lock = threading.Lock()
+
+        # When each call site, by file and line, was last let through and how
+        # many of its records have been held back since
+        self.sites = {}
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            last, held = self.sites.get(key, (None, 0))
+            if last is not None and record.created - last < self.interval:
+                self.sites[key] = (last, held + 1)
+                return False
+            self.sites[key] = (record.created, 0)
+        if held:
+            record.msg = f"{record.msg} ({held} similar messages suppressed)"
+        return True
+
+class _QueueHandler(QueueHandler):
+
+    # The listener runs in this process, so records are queued without being
+    # pickled and are formatted by the listener thread rather than the caller.
+    # Arguments that are lists, dicts or sets are copied, so one changed after
+    # the call is still logged as it was. Records dropped when the queue is
+    # full are counted
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.args, dict):
+            record.args = dict(record.args)
+        elif record.args:
+            record.args = tuple(copy.copy(arg) if isinstance(arg, MUTABLE) else arg for arg in record.args)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def start_logging(handlers, level, rate_limit=0):
+    # Send records from every thread through a queue to the handlers, which
+    # run on a listener thread. Replaces any pipeline started earlier
+    stop_logging()
+    global _listener, _handler
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    _handler = _QueueHandler(queue.Queue(QUEUE_SIZE))
+    if rate_limit:
+        _handler.addFilter(RateLimit(rate_limit))
+    logger.handlers = [_handler]
+    _listener = QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+def stop_logging():
+    # Emit whatever is queued, then hand the handlers back to the root logger so
+    # anything logged afterwards, e.g. while exiting, is still written
+    global _listener, _handler
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    logging.getLogger().handlers = list(listener.handlers)
+    _handler = None
+
+def dropped():
+    # The number of records dropped because the queue was full
+    return _handler.dropped if _handler else 0
+
+atexit.register(stop_logging)
@@ -7,25 +7,48 @@ import sys
 import logging
 import signal
 import os
-
+import queue
+import threading
+import json
+import socket
+from concurrent.futures import ThreadPoolExecutor, wait
+from logging.handlers import RotatingFileHandler
+
+from .clock import clock
 from .openweather import OpenWeather
 from .influx import InfluxDB
 from .netstatus import NetworkStatus
-from .datacache import DataCache
-from .sensors.bme680 import BME680
-from .sensors.pir import PIR
-from .sensors.sds011 import SDS011
-from memory_profiler import memory_usage
-from rich.logging import RichHandler
+from .datacache import DataCache, DROP
+from .derived import DerivedMetrics
+from .gateway import GatewayClient, GatewayWeather
+from .health import Health
+from .logpipe import dropped, start_logging, stop_logging
+from .rolling import parse_windows
+from .scheduler import Scheduler
+from .store import DEFAULT_RETENTION, LocalStore
+from .tiers import DEFAULT_TIERS, RollupTiers
+from .sensors.registry import HARDWARE, build_sources, load_config
 
 class Monitor(object):
 
     def __init__(self, loglevel='INFO', openweather_api_key=None, openweather_location_key=None,
                  pir_sensor_gpio_pin=None, server_config=None, log_file=None,
-                 cache_file=None, cache_flush_limit=None):
+                 cache_file=None, cache_flush_limit=None, influx_batch_size=0, influx_flush_interval=10,
+                 concurrent=True, wifi_sample_interval=60, health_interval=60, metrics_port=None,
+                 sds011_query_mode=False, rolling_windows=None, burst_interval=None, sample_interval=60,
+                 openweather_cache_file=None, openweather_ttl=600, openweather_emit_stale=True,
+                 bme680_backend=HARDWARE, sds011_backend=HARDWARE, pir_backend=HARDWARE,
+                 replay_file=None, simulation_seed=0, simulation_speed=1.0, record_file=None,
+                 gateway_url=None, node_name=None, cache_max_items=0, cache_max_bytes=0, cache_max_age=0,
+                 cache_retention=DROP, log_max_mb=10, log_backups=3, log_rate_limit=0,
+                 influx_retries=2, influx_breaker_threshold=3, influx_breaker_reset=30,
+                 iaq_baseline_file=None, rollup_tiers=DEFAULT_TIERS, rollup_state_file=None,
+                 store_dir=None, store_retention=DEFAULT_RETENTION, store_port=None, store_bind='127.0.0.1',
+                 store_backfill=0, sensors_file=None):
 
         # The log level for the monitor
-        self.setup_logging(loglevel=loglevel, log_file=log_file)
+        self.setup_logging(loglevel=loglevel, log_file=log_file, log_max_mb=log_max_mb,
+                           log_backups=log_backups, log_rate_limit=log_rate_limit)
 
         # The API key for OpenWeather
         self.openweather_api_key = openweather_api_key
@@ -35,6 +58,18 @@ class Monitor(object):
         self.openweather_location_key = openweather_location_key
         logging.debug(f"OpenWeather location key set: {self.openweather_location_key}")
 
+        # The file caching the most recent OpenWeather response across restarts
+        self.openweather_cache_file = openweather_cache_file
+        logging.debug(f"OpenWeather cache file set: {self.openweather_cache_file}")
+
+        # The number of seconds an OpenWeather response is used before fetching again
+        self.openweather_ttl = openweather_ttl
+        logging.debug(f"OpenWeather TTL set: {self.openweather_ttl}")
+
+        # Whether weather conditions older than the TTL are still written
+        self.openweather_emit_stale = openweather_emit_stale
+        logging.debug(f"OpenWeather emit stale set: {self.openweather_emit_stale}")
+
         # The GPIO pin number for the PIR sensor
         self.pir_sensor_gpio_pin = pir_sensor_gpio_pin
         logging.debug(f"PIR sensor GPIO pin set: {pir_sensor_gpio_pin}")
@@ -51,65 +86,358 @@ class Monitor(object):
         self.cache_flush_limit = cache_flush_limit
         logging.debug(f"Cache flush limit set: {self.cache_flush_limit}")
 
-        # The number of seconds to delay at the end of each sample loop
-        self.loop_delay = 5
-
-        # The number of loops after which to ask sensors for data
-        self.sample_time = int(60/self.loop_delay)
-
-        # The number of loops after which to store 24 hours worth of data
-        self.samples_day = int((60*60*24)/self.loop_delay)
+        # Caps on the number, bytes on disk and age in seconds of cached items, 0 for
+        # no cap, and whether the oldest items are dropped or downsampled over a cap
+        self.cache_max_items = cache_max_items
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_age = cache_max_age
+        self.cache_retention = cache_retention
+        logging.debug(f"Cache caps set: {cache_max_items} items, {cache_max_bytes} bytes, {cache_max_age}s, {cache_retention}")
+
+        # The number of points to queue before writing them to InfluxDB as one batch
+        self.influx_batch_size = influx_batch_size
+        logging.debug(f"InfluxDB batch size set: {self.influx_batch_size}")
+
+        # The number of seconds after which queued points are written to InfluxDB
+        self.influx_flush_interval = influx_flush_interval
+        logging.debug(f"InfluxDB flush interval set: {self.influx_flush_interval}")
+
+        # The number of times a failed write is retried, and the number of failed writes
+        # after which readings are cached without trying InfluxDB for a number of seconds
+        self.influx_retries = influx_retries
+        self.influx_breaker_threshold = influx_breaker_threshold
+        self.influx_breaker_reset = influx_breaker_reset
+        logging.debug(f"InfluxDB retries set: {influx_retries}, circuit breaker: {influx_breaker_threshold} failures, {influx_breaker_reset}s")
+
+        # Whether sensors are read concurrently by a worker pool or one after another
+        self.concurrent = concurrent
+        logging.debug(f"Concurrent sensor acquisition set: {self.concurrent}")
+
+        # The number of seconds between WiFi signal and quality samples
+        self.wifi_sample_interval = wifi_sample_interval
+        logging.debug(f"WiFi sample interval set: {self.wifi_sample_interval}")
+
+        # The number of seconds between monitor_health measurements
+        self.health_interval = health_interval
+        logging.debug(f"Health export interval set: {self.health_interval}")
+
+        # The local port serving the latest monitor health metrics
+        self.metrics_port = metrics_port
+        logging.debug(f"Metrics port set: {self.metrics_port}")
+
+        # Whether the SDS011 sensor sleeps between samples
+        self.sds011_query_mode = sds011_query_mode
+        logging.debug(f"SDS011 query mode set: {self.sds011_query_mode}")
+
+        # The windows rolling statistics are calculated over, e.g. '15m,1h,24h'
+        self.rolling_windows = parse_windows(rolling_windows)
+        logging.debug(f"Rolling windows set: {self.rolling_windows}")
+
+        # The file the BME680 gas baseline used for IAQ is kept in across restarts
+        self.iaq_baseline_file = iaq_baseline_file
+        logging.debug(f"IAQ baseline file set: {self.iaq_baseline_file}")
+
+        # The tiers readings are rolled up into, e.g. '1m,1h,1d', and the file partial
+        # rollups are kept in across restarts
+        self.rollup_tiers = rollup_tiers
+        self.rollup_state_file = rollup_state_file
+        logging.debug(f"Rollup tiers set: {self.rollup_tiers}, state file: {self.rollup_state_file}")
+
+        # The directory readings are kept in on the node, the number of seconds they are
+        # kept for and the address queries about them are answered on
+        self.store_dir = store_dir
+        self.store_retention = store_retention
+        self.store_port = store_port
+        self.store_bind = store_bind
+        logging.debug(f"Local store set: {self.store_dir}, retention {self.store_retention}s, "
+                      f"queries on {self.store_bind}:{self.store_port}")
+
+        # The number of seconds of readings in the local store written to InfluxDB again at start up
+        self.store_backfill = store_backfill
+        logging.debug(f"Local store backfill set: {self.store_backfill}s")
+
+        # The number of seconds between BME680 and SDS011 samples when burst sampling
+        self.burst_interval = burst_interval
+        logging.debug(f"Burst sample interval set: {self.burst_interval}")
+
+        # The number of seconds between sensor samples
+        self.sample_interval = sample_interval
+        logging.debug(f"Sample interval set: {self.sample_interval}")
+
+        # Where each sensor is read from: the hardware, a synthetic generator or a replayed recording
+        self.backends = {'bme680': bme680_backend, 'sds011': sds011_backend, 'pir': pir_backend}
+        logging.debug(f"Sensor backends set: {self.backends}")
+
+        # The file listing the sensors of this node, if not one of each sensor type
+        self.sensors_file = sensors_file
+        logging.debug(f"Sensors file set: {self.sensors_file}")
+
+        # The file of recorded points replayed by sensors using the replay backend
+        self.replay_file = replay_file
+        logging.debug(f"Replay file set: {self.replay_file}")
+
+        # The seed for sensors using the synthetic backend
+        self.simulation_seed = simulation_seed
+        logging.debug(f"Simulation seed set: {self.simulation_seed}")
+
+        # How many times faster than real time the monitor runs
+        self.simulation_speed = simulation_speed
+        logging.debug(f"Simulation speed set: {self.simulation_speed}")
+
+        # The file every point written is also appended to, for replaying later
+        self.record_file = record_file
+        logging.debug(f"Record file set: {self.record_file}")
+
+        # The gateway readings are sent to instead of InfluxDB, and the name this node is tagged with
+        self.gateway_url = gateway_url
+        self.node_name = node_name or socket.gethostname()
+        logging.debug(f"Gateway set: {self.gateway_url} as {self.node_name}")
+
+        # The sensor instances read. Without a sensors file, a node has one BME680,
+        # SDS011 and PIR sensor each, configured by the options above
+        if self.sensors_file:
+            config = load_config(self.sensors_file)
+        else:
+            config = [
+                {'type': 'bme680'},
+                {'type': 'sds011', 'query_mode': self.sds011_query_mode},
+                {'type': 'pir', 'pir_sensor_gpio_pin': self.pir_sensor_gpio_pin}
+            ]
+        self.sources = build_sources(config, self.sample_interval, self.backends)
+        logging.debug(f"Sensors set: {', '.join(source.name for source in self.sources)}")
 
         # Default to running state
         self.running = True
 
-        # Set up connection to InfluxDB
-        self.influx = InfluxDB(self.server_config)
+        # Timestamps and deadlines advance faster than real time when simulating,
+        # which only makes sense when no sensor is read from hardware
+        if self.simulation_speed != 1:
+            if any(source.backend == HARDWARE for source in self.sources):
+                logging.warning(f"Running at {self.simulation_speed}x with hardware sensors")
+            clock.set_speed(self.simulation_speed)
 
-        # Network status checker
-        self.network = NetworkStatus()
-        # Hardcoded thresholds for signal strength and quality
-        # because these are common values for WiFi networks
-        self.signal_warn_threshold = -75  # dBm
-        self.quality_warn_threshold = 40  # percentage
+        # Points written are appended to the record file as JSON lines
+        self.record = open(self.record_file, 'a') if self.record_file else None
 
-        # Set up data cache for offline storage
-        self.data_cache = DataCache(self.cache_file)
-        self.flush_limit = self.cache_flush_limit 
+        # Runtime instrumentation of the sample loop
+        self.health = Health(export_interval=self.health_interval, metrics_port=self.metrics_port)
 
-        # Set up connection to OpenWeather
-        self.openweather = OpenWeather(self.sample_time, self.openweather_api_key, self.openweather_location_key)
+        # Network status checker. Thresholds for signal strength and quality are
+        # hardcoded because these are common values for WiFi networks
+        self.network = NetworkStatus(sample_interval=self.wifi_sample_interval,
+                                     signal_warn_threshold=-75,  # dBm
+                                     quality_warn_threshold=40)  # percentage
 
-        # Set up connection to the SDS011 sensor
-        self.sds011 = SDS011(self.sample_time, self.samples_day)
+        # How long setting up each part of the monitor took, reported once sampling starts
+        self.startup_times = {}
 
-        # Set up the connection to the BME680 sensor
-        self.bme680 = BME680(self.sample_time)
+        # Set up data cache for offline storage
+        self.data_cache = self.startup('data_cache', DataCache, self.cache_file,
+                                       max_items=self.cache_max_items,
+                                       max_bytes=self.cache_max_bytes,
+                                       max_age=self.cache_max_age,
+                                       retention=self.cache_retention)
+        self.flush_limit = self.cache_flush_limit 
 
-        # Set up the connection to the PIR sensor
-        self.pir = PIR(1, self.pir_sensor_gpio_pin)
+        # Set up the local store of readings, answering queries on the node without the
+        # network, and replay the readings asked for through the cache
+        self.store = None
+        if self.store_dir:
+            self.store = self.startup('store', LocalStore, self.store_dir,
+                                      retention=self.store_retention,
+                                      port=self.store_port,
+                                      bind=self.store_bind)
+            if self.store_backfill:
+                self.backfill(self.store_backfill)
+
+        # Set up connection to InfluxDB, or the gateway, keeping the network status up to
+        # date with the outcome of each write. Points queued for a batch write are
+        # appended to the cache, so they are not lost if the monitor stops first
+        spool = self.data_cache if self.influx_batch_size else None
+        if self.gateway_url:
+            self.influx = self.startup('influx', GatewayClient, self.gateway_url, self.node_name,
+                                       batch_size=self.influx_batch_size,
+                                       flush_interval=self.influx_flush_interval,
+                                       on_failure=self.data_cache.extend,
+                                       network=self.network,
+                                       retries=self.influx_retries,
+                                       breaker_threshold=self.influx_breaker_threshold,
+                                       breaker_reset=self.influx_breaker_reset,
+                                       spool=spool)
+        else:
+            self.influx = self.startup('influx', InfluxDB, self.server_config,
+                                       batch_size=self.influx_batch_size,
+                                       flush_interval=self.influx_flush_interval,
+                                       on_failure=self.data_cache.extend,
+                                       network=self.network,
+                                       retries=self.influx_retries,
+                                       breaker_threshold=self.influx_breaker_threshold,
+                                       breaker_reset=self.influx_breaker_reset,
+                                       spool=spool)
+
+        # Mean, min, max and count of climate, particles and weather readings per tier,
+        # written as they finish so long range dashboards do not scan every reading
+        self.rollups = RollupTiers(self.rollup_tiers, self.rollup_state_file)
+
+        # Probe the InfluxDB server or gateway in the background rather than on every write
+        self.network.watch(self.influx.host, self.influx.port)
+
+        # Simulated and replayed devices stand in for the hardware of the other backends,
+        # sharing one generator or recording per backend
+        simulations = {}
+
+        # Burst samples are taken in real time, so are taken more often when simulating faster
+        burst_interval = self.burst_interval / self.simulation_speed if self.burst_interval else None
+
+        # Arguments every driver is given if it takes them. Options set for an
+        # instance in the sensors file take precedence
+        for source in self.sources:
+            device = None
+            if source.backend != HARDWARE:
+                # Only imported when simulating, as it imports the drivers it stands in for
+                from .sensors.simulated import open_device
+                device = open_device(source.kind, source.backend, simulations,
+                                     self.replay_file, self.simulation_seed, source.name)
+            source.defaults = {
+                'sample_period': source.interval,
+                'windows': self.rolling_windows,
+                'burst_interval': burst_interval,
+                # The SDS011 is woken this many seconds before each sample in query mode
+                'warmup': min(30, source.interval / 2),
+                # Motion is captured continuously and reported once per sample interval
+                'poll_interval': max(0.001, 0.05 / self.simulation_speed),
+                'debounce': 0.1 / self.simulation_speed,
+                'device': device
+            }
+
+        # AQI, IAQ, dew point and absolute humidity calculated from each sensor's readings.
+        # Each BME680 learns its own gas baseline
+        self.derived = {source: DerivedMetrics(self.iaq_file(source)) for source in self.sources
+                        if source.kind in ('bme680', 'sds011')}
+
+        # The sensors and OpenWeather are set up in parallel, as their start up is
+        # mostly spent importing device libraries and waiting on devices
+        with ThreadPoolExecutor(thread_name_prefix='startup') as pool:
+
+            # Set up connection to OpenWeather, reusing a recent response cached on disk.
+            # Behind a gateway, the gateway fetches the weather for every node
+            if self.gateway_url:
+                openweather = pool.submit(self.startup, 'openweather', GatewayWeather, self.gateway_url)
+            else:
+                openweather = pool.submit(self.startup, 'openweather', OpenWeather,
+                                          self.openweather_api_key, self.openweather_location_key,
+                                          cache_file=self.openweather_cache_file,
+                                          ttl=self.openweather_ttl,
+                                          emit_stale=self.openweather_emit_stale)
+
+            # Set up each sensor, importing only the drivers of the sensors configured
+            for source in self.sources:
+                pool.submit(self.open_source, source)
+
+        self.openweather = openweather.result()
+
+        # The sources read by the scheduler
+        self.sensors = [self.openweather, *self.sources, self.network, self.health]
+
+        # Each source runs at its own interval against fixed monotonic deadlines.
+        # Offsets spread the sources across the interval so they do not all do I/O
+        # at once. OpenWeather comes first because its pressure reading is used to
+        # callibrate the BME680. With the default interval and sensors the sources
+        # are 5 seconds apart
+        stagger = self.sample_interval / 12
+        self.scheduler = Scheduler(clock=clock.monotonic, speed=self.simulation_speed)
+        self.scheduler.add('openweather', self.openweather, self.sample_interval, offset=0)
+        for number, source in enumerate(self.sources, 1):
+            offset = number * stagger % source.interval
+            self.scheduler.add(source.name, source, source.interval, offset=offset)
+            if source.options.get('query_mode') and not self.burst_interval:
+                self.scheduler.add(f'{source.name}_wake', source.wake, source.interval,
+                                   offset=(offset - source.defaults['warmup']) % source.interval)
+        number = len(self.sources) + 1
+        self.scheduler.add('wifi', self.network, self.wifi_sample_interval,
+                           offset=number * stagger % self.wifi_sample_interval)
+        self.scheduler.add('health', self.health, self.health_interval,
+                           offset=(number + 1) * stagger % self.health_interval)
+
+        # Worker pool used to read each sensor independently, the in-flight read
+        # for each sensor and the queue of readings waiting to be written
+        self.executor = None
+        self.pending = {}
+        self.results = queue.Queue()
+        self.writer = None
+        if self.concurrent:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.sensors), thread_name_prefix='sensor')
+            self.writer = threading.Thread(target=self.write_loop, name='writer', daemon=True)
+            self.writer.start()
+
+        # Queue depths reported with the monitor health
+        self.health.gauge('results_queue', self.results.qsize)
+        self.health.gauge('influx_queue', self.influx.queued)
+        self.health.gauge('cache_items', lambda: len(self.data_cache))
+        self.health.gauge('cache_bytes', self.data_cache.size)
+        self.health.gauge('cache_retired', lambda: self.data_cache.retired)
+        self.health.gauge('log_dropped', dropped)
+        self.health.gauge('influx_circuit_open', lambda: int(self.influx.breaker.is_open()))
+        self.health.gauge('influx_retried', lambda: self.influx.retried)
+        self.health.gauge('influx_rejected', lambda: self.influx.rejected)
 
         # Register signal handlers
         signal.signal(signal.SIGINT, self.handle_exit)
         signal.signal(signal.SIGTERM, self.handle_exit)
 
+    def startup(self, name, factory, *args, **kwargs):
+        # Create a part of the monitor, recording how long it took
+        start = time.perf_counter()
+        component = factory(*args, **kwargs)
+        self.startup_times[name] = time.perf_counter() - start
+        logging.debug(f"Set up {name} in {self.startup_times[name]:.3f}s")
+        return component
+
+    def open_source(self, source):
+        # Set up a sensor, leaving it to be set up when it is next due if it fails
+        try:
+            self.startup(source.name, source.open)
+        except Exception as e:
+            logging.error(f"Failed to set up {source.name} sensor, trying again when it is next due: {e}")
+
+    def iaq_file(self, source):
+        # The file a BME680 keeps its gas baseline in. The first keeps it in the
+        # configured file and any others in files named after them
+        if source.kind != 'bme680' or not self.iaq_baseline_file:
+            return None
+        if source.name == source.kind:
+            return self.iaq_baseline_file
+        root, extension = os.path.splitext(self.iaq_baseline_file)
+        return f"{root}.{source.name}{extension}"
+
+    def report_startup(self):
+        # Log and export how long it took from launch until the first sample
+        for name, seconds in self.startup_times.items():
+            self.health.observe(f'startup_{name}', seconds)
+        parts = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.startup_times.items())
+        age = self.health.process_age()
+        if age is not None:
+            self.health.observe('startup', age)
+            logging.info(f"Sampling started {age:.2f}s after launch ({parts})")
+        else:
+            logging.info(f"Sampling started ({parts})")
+
     def is_interactive(self):
         return sys.stdout.isatty() and os.environ.get("TERM") != "headless"
 
-    def setup_logging(self, loglevel='INFO', log_file=None):
+    def setup_logging(self, loglevel='INFO', log_file=None, log_max_mb=10, log_backups=3, log_rate_limit=0):
         numeric_level = getattr(logging, loglevel.upper(), None)
         if not isinstance(numeric_level, int):
             raise ValueError(f"Invalid log level: {loglevel}")
 
-        logger = logging.getLogger()
-        logger.setLevel(numeric_level)
-        logger.handlers = []
+        handlers = []
 
         # Decide whether we're in interactive (CLI) mode
         interactive = self.is_interactive()
 
         # Console handler: Rich for interactive, plain otherwise
         if interactive:
+            from rich.logging import RichHandler
             console_handler = RichHandler(rich_tracebacks=True)
             console_formatter = logging.Formatter("%(message)s",
                 datefmt="%m/%d/%Y %I:%M:%S %p")
@@ -121,54 +449,148 @@ class Monitor(object):
 
         console_handler.setLevel(numeric_level)
         console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
 
-        # Only add file handler if interactive
+        # Only add file handler if interactive, rotating it once it reaches the size limit
         if interactive and log_file:
-            file_handler = logging.FileHandler(log_file, encoding='utf-8')
+            file_handler = RotatingFileHandler(log_file, maxBytes=int(log_max_mb * 1024 * 1024),
+                                               backupCount=log_backups, encoding='utf-8')
             file_handler.setLevel(numeric_level)
             file_handler.setFormatter(logging.Formatter(
                 "%(asctime)s::%(levelname)s::%(message)s",
                 datefmt="%m/%d/%Y %I:%M:%S %p"))
-            logger.addHandler(file_handler)
+            handlers.append(file_handler)
+
+        # Handlers run on a listener thread so the sample loop never waits on the console or SD card
+        start_logging(handlers, numeric_level, rate_limit=log_rate_limit)
 
         logging.info(f"Logging initialized at level: {loglevel}, interactive={interactive}")
 
     def handle_exit(self, signum, frame):
         logging.info(f"Signal {signum} received. Exiting gracefully.")
         self.running = False
+        self.scheduler.wake()
 
     def cleanup(self):
         logging.info('Cleaning up resources...')
+        if self.concurrent:
+            self.executor.shutdown(wait=True)
+            self.results.put(None)
+            self.writer.join()
+        for source in self.sources:
+            source.close()
+        for derived in self.derived.values():
+            derived.close()
+        self.rollups.close()
+        if self.store:
+            self.store.close()
+        self.openweather.close()
         self.influx.close()
+        self.network.close()
+        self.data_cache.close()
+        self.health.close()
+        if self.record:
+            self.record.close()
         logging.info('Cleanup complete.')
-
-    def run_loop(self, loop):
-        # If using wifi, check signal strength and quality
-        signal, quality = self.network.get_wifi_status()
-        if signal is not None and signal < self.signal_warn_threshold:
-            logging.warning(f"Weak WiFi Signal: {signal} dBm")
-        if quality is not None and quality < self.quality_warn_threshold:
-            logging.warning(f"Poor WiFi Link Quality: {quality}%")
-
-        # Fetch data from sensors and write to InfluxDB or cache
-        for sensor in [self.openweather, self.bme680, self.sds011, self.pir]:
-            logging.debug(f"Fetching data from {sensor.__class__.__name__}")
-            data = sensor.get_data(loop)
-            # Not all sensors return data on every loop, so check if there's data
-            if data:
-                if sensor == self.openweather:
-                    self.bme680.callibrate(self.openweather.pressure)
-                if self.network.is_connected():
-                    try:
-                        self.data_cache.flush(self.flush_limit, self.influx.write)
-                        self.influx.write(**data)
-                    except Exception as e:
-                        logging.warning("Influx write failed, caching: %s", e)
-                        self.data_cache.append(data)
-                else:
-                    logging.warning("Offline: data cached.")
-                    self.data_cache.append(data)
+        stop_logging()
+
+    def run_loop(self, loop, now=None):
+        # Run every source whose deadline has passed
+        now = self.scheduler.clock() if now is None else now
+        for job, deadline in self.scheduler.due(now):
+            self.health.observe(f'{job.name}_lateness', max(0.0, now - deadline))
+            if not hasattr(job.target, 'get_data'):
+                job.target(loop)
+            elif self.concurrent:
+                # Hand each sensor read to the worker pool so a slow source only delays its own data
+                sensor = job.target
+                future = self.pending.get(sensor)
+                if future and not future.done():
+                    logging.debug("Still fetching data from %s, skipping loop %s", sensor.__class__.__name__, loop)
+                    continue
+                depends_on = self.pending.get(self.openweather) if getattr(sensor, 'callibrated', False) else None
+                self.pending[sensor] = self.executor.submit(self.acquire, sensor, loop, depends_on)
+            else:
+                # Fetch data from sensors and write to InfluxDB or cache
+                data = self.acquire(job.target, loop)
+                if data:
+                    self.write_data(data)
+
+    def acquire(self, sensor, loop, depends_on=None):
+        # Wait for an OpenWeather fetch still in flight so the BME680 is callibrated first
+        if depends_on:
+            wait([depends_on])
+        name = getattr(sensor, 'name', sensor.__class__.__name__.lower())
+        logging.debug("Fetching data from %s", name)
+        try:
+            with self.health.timer(f"{name}_get_data"):
+                data = sensor.get_data(loop)
+        except Exception as e:
+            logging.error(f"Failed to fetch data from {name}: {e}")
+            return None
+        if sensor == self.openweather and self.openweather.pressure:
+            for source in self.sources:
+                source.callibrate(self.openweather.pressure)
+        if data and sensor in self.derived:
+            with self.health.timer('derived'):
+                data = self.derived[sensor].add(data)
+        # Not all sensors return data on every loop, so check if there's data
+        if data:
+            if self.concurrent:
+                self.results.put(data)
+        return data
+
+    def write_loop(self):
+        # Write readings from the sensor workers until cleanup queues the end marker
+        while True:
+            data = self.results.get()
+            if data is None:
+                break
+            self.write_data(data)
+
+    def write_data(self, data):
+        if self.record:
+            self.record.write(json.dumps(data, separators=(',', ':')) + '\n')
+        if self.store:
+            with self.health.timer('store_append'):
+                self.store.append(data)
+        # A reading that finishes a rollup is written along with the rollup
+        with self.health.timer('rollups'):
+            rollups = self.rollups.add(data)
+        self.write_point(data)
+        for point in rollups:
+            self.write_point(point)
+
+    def write_point(self, data):
+        with self.health.timer('network_check'):
+            connected = self.network.is_connected()
+        # While the circuit breaker is open readings go straight to the cache
+        if connected and self.influx.available():
+            try:
+                # When batching, the cache is written back by the batch flush thread
+                if self.influx.spool is None:
+                    with self.health.timer('cache_flush'):
+                        self.data_cache.flush(self.flush_limit, self.influx.write_batch)
+                with self.health.timer('influx_write'):
+                    written = self.influx.write(**data)
+            except Exception as e:
+                logging.warning("Influx write failed, caching: %s", e)
+                written = False
+            if not written:
+                self.data_cache.append(data)
+        else:
+            logging.warning("Offline: data cached.")
+            self.data_cache.append(data)
+
+    def backfill(self, seconds):
+        # Queue the readings in the local store from the last number of seconds to
+        # be written to InfluxDB again, as if they had been cached while offline
+        end = clock.now_ns()
+        count = 0
+        for records in self.store.replay(end - int(seconds * 1e9), end):
+            self.data_cache.extend(records)
+            count += len(records)
+        logging.info(f"Queued {count} readings from the local store to write to InfluxDB again")
 
     def start(self, duration_minutes=None):
         loop = 0
@@ -177,6 +599,8 @@ class Monitor(object):
 
         logging.info(f'Started monitor loop')
 
+        self.scheduler.start()
+
         try:
             while self.running:
                 if max_duration and (time.time() - start_time) >= max_duration:
@@ -185,12 +609,18 @@ class Monitor(object):
 
                 loop += 1
 
-                mem_before = memory_usage()[0]
-                self.run_loop(loop)
-                mem_after = memory_usage()[0]
-                logging.debug(f"Memory used: {mem_after - mem_before:.2f} MiB")
+                # How late the loop woke up for the earliest deadline due
+                now = self.scheduler.clock()
+                self.health.observe('loop_lateness', max(0.0, now - self.scheduler.next_deadline()))
+
+                with self.health.timer('loop'):
+                    self.run_loop(loop, now)
+
+                if loop == 1:
+                    self.report_startup()
 
-                time.sleep(self.loop_delay)
+                # Sleep until the next source is due
+                self.scheduler.sleep()
         
         finally:
             self.cleanup()
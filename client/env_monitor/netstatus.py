@@ -6,17 +6,64 @@
 import platform
 import subprocess
 import re
-import shutil
 import os
 import socket
 import logging
+import threading
+import time
+from collections import deque
+
+from .clock import now_ns
+
+# Wireless extensions report link quality out of 70 for most drivers, which
+# is the maximum iwconfig shows
+LINK_QUALITY_MAX = 70
 
 class NetworkStatus:
 
-    def __init__(self, interface="wlan0"):
+    def __init__(self, interface="wlan0", probe_interval=60, min_backoff=5, max_backoff=300, timeout=2,
+                 sample_interval=60, history_size=60, signal_warn_threshold=-75, quality_warn_threshold=40):
         self.interface = interface
         self.system = platform.system()
 
+        # The number of seconds between WiFi signal and quality samples
+        self.sample_interval = sample_interval
+
+        # Recent WiFi samples as (timestamp, signal, quality) tuples
+        self.history = deque(maxlen=history_size)
+
+        # Thresholds for signal strength (dBm) and quality (percentage) below
+        # which a warning is logged
+        self.signal_warn_threshold = signal_warn_threshold
+        self.quality_warn_threshold = quality_warn_threshold
+
+        # The host and port of the endpoint data is written to, set by watch()
+        self.host = None
+        self.port = None
+
+        # The number of seconds between probes while connected. Probes are skipped
+        # while real writes keep succeeding
+        self.probe_interval = probe_interval
+
+        # The range of seconds between probes while disconnected, doubling after each failure
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+
+        # The number of seconds to wait for a probe connection
+        self.timeout = timeout
+
+        # Cached connectivity state, assumed connected until a probe or write says otherwise
+        self.connected = True
+        self.last_success = 0
+
+        self._wakeup = threading.Event()
+        self._closing = threading.Event()
+        self._probe_thread = None
+
+        # Whether the missing /proc/net/wireless of a host without WiFi has been logged
+        self.no_wireless_logged = False
+
     def get_wifi_status(self):
         if self.system == "Linux":
             return self._get_linux_status()
@@ -27,26 +74,40 @@ class NetworkStatus:
             return None, None
 
     def _get_linux_status(self):
-        if shutil.which("iwconfig") is None:
-            logging.warning("iwconfig not found. Install wireless-tools.")
-            return None, None
-
+        # Read the kernel's wireless statistics directly rather than forking iwconfig
         try:
-            result = subprocess.run(["iwconfig", self.interface], capture_output=True, text=True)
-            output = result.stdout
-
-            signal_match = re.search(r"Signal level=(-?\d+) dBm", output)
-            quality_match = re.search(r"Link Quality=(\d+)/(\d+)", output)
-
-            signal = int(signal_match.group(1)) if signal_match else None
-
-            quality = None
-            if quality_match:
-                q_current = int(quality_match.group(1))
-                q_max = int(quality_match.group(2))
-                quality = round(q_current / q_max * 100, 1)
+            # Skip the interface when sysfs says its link is down
+            operstate = f"/sys/class/net/{self.interface}/operstate"
+            if os.path.exists(operstate):
+                with open(operstate) as f:
+                    if f.read().strip() == "down":
+                        logging.debug(f"{self.interface} is down")
+                        return None, None
+
+            with open("/proc/net/wireless") as f:
+                # The first two lines are headers, e.g.
+                # wlan0: 0000   54.  -56.  -256        0      0      0      0      0        0
+                for line in f.readlines()[2:]:
+                    name, _, stats = line.partition(":")
+                    if name.strip() != self.interface:
+                        continue
+                    values = stats.split()
+                    link = float(values[1].rstrip("."))
+                    level = float(values[2].rstrip("."))
+                    quality = round(link / LINK_QUALITY_MAX * 100, 1)
+                    # Drivers that do not report dBm give an unsigned level
+                    signal = int(level - 256) if level > 0 else int(level)
+                    return signal, quality
+
+            logging.debug(f"{self.interface} not found in /proc/net/wireless")
+            return None, None
 
-            return signal, quality
+        except FileNotFoundError:
+            # The kernel has no wireless interfaces, e.g. a wired node or a container
+            if not self.no_wireless_logged:
+                logging.debug("No /proc/net/wireless, so no WiFi status is measured")
+                self.no_wireless_logged = True
+            return None, None
 
         except Exception as e:
             logging.error(f"[Linux] Failed to get WiFi status: {e}")
@@ -73,12 +134,84 @@ class NetworkStatus:
             logging.error(f"[Darwin] Failed to get WiFi status: {e}")
             return None, None
 
-    def is_connected(self):
-        host = "8.8.8.8"
-        port = 53
-        timeout = 2
+    def get_data(self, loop):
+
+        timestamp = now_ns()
+        signal, quality = self.get_wifi_status()
+        if signal is None and quality is None:
+            return None
+        self.history.append((timestamp, signal, quality))
+
+        logging.info("[%s] WiFi signal: %s dBm  quality: %s%%", loop, signal, quality)
+        if signal is not None and signal < self.signal_warn_threshold:
+            logging.warning(f"Weak WiFi Signal: {signal} dBm")
+        if quality is not None and quality < self.quality_warn_threshold:
+            logging.warning(f"Poor WiFi Link Quality: {quality}%")
+
+        fields = {}
+        if signal is not None:
+            fields['signal'] = signal
+        if quality is not None:
+            fields['quality'] = float(quality)
+
+        # Return WiFi data in a format suitable for InfluxDB
+        return {
+            'measurement': 'wifi',
+            'fields': fields,
+            'tags': {
+                'interface': self.interface
+            },
+            'time': timestamp
+        }
+
+    def watch(self, host, port):
+        # Start probing the write endpoint in the background
+        self.host = host
+        self.port = int(port)
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="netstatus", daemon=True)
+        self._probe_thread.start()
+        logging.info(f"Watching connectivity to {self.host}:{self.port}")
+
+    def _probe(self):
         try:
-            socket.create_connection((host, port), timeout)
-            return True
+            with socket.create_connection((self.host, self.port), self.timeout):
+                return True
         except OSError:
-            return False
\ No newline at end of file
+            return False
+
+    def _probe_loop(self):
+        while not self._closing.is_set():
+            if not self.connected or time.monotonic() - self.last_success >= self.probe_interval:
+                if self._probe():
+                    self.mark_success()
+                else:
+                    self.mark_failure()
+            delay = self.probe_interval if self.connected else self.backoff
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def mark_success(self):
+        # Called after a probe or a real write reaches the endpoint
+        if not self.connected:
+            logging.info(f"Connection to {self.host}:{self.port} restored")
+        self.connected = True
+        self.backoff = self.min_backoff
+        self.last_success = time.monotonic()
+
+    def mark_failure(self):
+        # Called after a probe or a real write fails to reach the endpoint
+        if self.connected:
+            logging.warning(f"Connection to {self.host}:{self.port} lost")
+            self.connected = False
+            self._wakeup.set()
+        else:
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def is_connected(self):
+        return self.connected
+
+    def close(self):
+        if self._probe_thread:
+            self._closing.set()
+            self._wakeup.set()
+            self._probe_thread.join()
\ No newline at end of file
@@ -4,14 +4,17 @@
 
 import logging
 import os
-import requests
 import json
+import tempfile
+import time
 
-from urllib.error import HTTPError
+from .clock import now_ns
+from .logpipe import Lazy
 
 class OpenWeather(object):
 
-    def __init__(self, sample_time, openweather_api_key=None, location=None):
+    def __init__(self, openweather_api_key=None, location=None, cache_file=None, ttl=600,
+                 emit_stale=True, min_backoff=60, max_backoff=3600, timeout=10):
 
         # OpenWeather API base URL
         self.url_base = 'http://api.openweathermap.org/data/2.5/weather'
@@ -24,25 +27,49 @@ class OpenWeather(object):
         # OpenWeather location used to fetch current conditions (city name or lat/lon tuple)
         if isinstance(location, tuple):
             lat, lon = location
-            query = (f"?lat={lat}&lon={lon}&appid={self.key}&units=metric")
+            self.params = {'lat': lat, 'lon': lon}
         else:
-            query = (f"?q={location}&appid={self.key}&units=metric")
+            self.params = {'q': location}
+        self.params['units'] = 'metric'
 
-        # OpenWeather API method to fetch current weather conditions
-        self.conditions_method = self.url_base + query
+        # The cached response is only reused for the same query, without the API key
+        self.query = json.dumps(self.params, sort_keys=True)
+        self.params['appid'] = self.key
 
-        # The number of loops after which to fetch sensor data
-        self.sample_time = sample_time
+        # One HTTP session so the connection to OpenWeather is reused between fetches,
+        # created by the first fetch so a cached response is used without importing requests
+        self.session = None
+
+        # The number of seconds to wait for a response
+        self.timeout = timeout
+
+        # File holding the most recent response, shared across restarts and processes
+        self.cache_file = cache_file
+
+        # The number of seconds a response is used before fetching again
+        self.ttl = ttl
+
+        # Whether conditions older than the TTL are still emitted, with their age
+        self.emit_stale = emit_stale
+
+        # Seconds to wait after a rate limited or failed fetch, doubling up to the maximum
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = 0
+        self.retry_at = 0
+
+        # Wall clock time in seconds of the response the current conditions came from
+        self.fetched = None
 
         # Current metric temperature
         self.temp_metric = 0
 
         # Current imperial temperature
         self.temp_imperial = 0
-        
+
         # Current relative humidity
         self.humidity = 0
-        
+
         # Current sea level pressure
         self.pressure = 0
 
@@ -52,42 +79,164 @@ class OpenWeather(object):
         # Conditions description
         self.description = ""
 
+        self._load_cache()
+
+    def _load_cache(self):
+        if not self.cache_file:
+            return None
+        try:
+            with open(self.cache_file, 'r') as file:
+                cached = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable OpenWeather cache {self.cache_file}: {e}")
+            return None
+        if (not isinstance(cached, dict) or not isinstance(cached.get('fetched'), (int, float))
+                or not isinstance(cached.get('data'), dict)):
+            logging.warning(f"Ignoring unreadable OpenWeather cache {self.cache_file}: not a cached response")
+            return None
+        if cached.get('query') != self.query:
+            return None
+        # Another process may have written a newer response than the one in memory
+        if self.fetched is None or cached['fetched'] > self.fetched:
+            try:
+                self._update(cached['data'], cached['fetched'])
+            except (KeyError, TypeError) as e:
+                logging.warning(f"Ignoring unreadable OpenWeather cache {self.cache_file}: missing {e}")
+                return None
+        return cached
+
+    def _save_cache(self, data, fetched):
+        if not self.cache_file:
+            return
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        try:
+            fd, path = tempfile.mkstemp(dir=directory, prefix='.openweather.')
+            with os.fdopen(fd, 'w') as file:
+                json.dump({'query': self.query, 'fetched': fetched, 'data': data}, file)
+            os.replace(path, self.cache_file)
+        except OSError as e:
+            logging.warning(f"Failed to write OpenWeather cache {self.cache_file}: {e}")
+
+    def _update(self, data, fetched):
+        # Description of json data: https://openweathermap.org/current
+        # Read every value before setting any, so a response missing one changes nothing
+        main = data['main']
+        temp, humidity, pressure, location = main['temp'], main['humidity'], main['pressure'], data['name']
+        self.temp_metric = temp
+        self.temp_imperial = (self.temp_metric * 9/5) + 32
+        self.humidity = humidity
+        self.pressure = pressure
+        self.location = location
+        self.fetched = fetched
+
+    def _retry_after(self, response):
+        # Seconds requested by a Retry-After header, given as seconds or an HTTP date
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        from email.utils import parsedate_to_datetime
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _back_off(self, seconds=None):
+        self.backoff = min(self.max_backoff, self.backoff * 2 if self.backoff else self.min_backoff)
+        delay = self.backoff if seconds is None else max(seconds, self.min_backoff)
+        self.retry_at = time.monotonic() + delay
+        logging.warning(f"\t Not fetching weather conditions again for {delay:.0f}s")
+
+    def _fetch(self, loop):
+        import requests
+        if self.session is None:
+            self.session = requests.Session()
+
+        logging.info("[%s] Fetching current weather conditions", loop)
+        try:
+            r = self.session.get(self.url_base, params=self.params, timeout=self.timeout)
+        except requests.RequestException as err:
+            logging.error('Request error: %s', err)
+            self._back_off()
+            return
+        if r.status_code == 429 or r.status_code >= 500:
+            logging.error('HTTP error: %s %s', r.status_code, r.reason)
+            self._back_off(self._retry_after(r))
+            return
+        try:
+            r.raise_for_status()
+            data = r.json()
+            logging.debug("OpenWeather data: %s", Lazy(json.dumps, data, indent=4))
+            fetched = time.time()
+            self._update(data, fetched)
+        except requests.HTTPError as http_err:
+            # Other client errors, e.g. a bad key or location, will not fix themselves
+            logging.error('HTTP error: %s', http_err)
+            self._back_off()
+            return
+        except (ValueError, KeyError, TypeError) as err:
+            logging.error('Unexpected response: %s', err)
+            self._back_off()
+            return
+        self.backoff = 0
+        self._save_cache(data, fetched)
+
+    def age(self):
+        # Seconds since the current conditions were fetched, None if there are none
+        return None if self.fetched is None else max(0.0, time.time() - self.fetched)
+
     def get_data(self, loop):
 
-        if (loop-1) % self.sample_time == 0:
-            try:
-                logging.info(f"[{loop}] Fetching current weather conditions")
-                r = requests.get(self.conditions_method, timeout=10)
-                r.raise_for_status()
-            except HTTPError as http_err:
-                logging.error('HTTP error: %s', http_err)
-            except Exception as err:
-                logging.error('Other error: %s', err)
-            else:
-                data = r.json()
-                # Description of json data: https://openweathermap.org/current
-                logging.debug("OpenWeather data: %s", json.dumps(data, indent=4))
-                self.temp_metric = data['main']['temp']
-                self.temp_imperial = (self.temp_metric * 9/5) + 32
-                self.humidity = data['main']['humidity']
-                self.pressure = data['main']['pressure']
-                self.location = data['name']
-
-            logging.info("\t Current temperature: %0.1f C (%0.1f F)" % (self.temp_metric, self.temp_imperial))
-            logging.info("\t Current relative humidity: %0.1f %%" % self.humidity)
-            logging.info("\t Current pressure: %0.3f hPa (mb)" % self.pressure)
-            logging.info("\t Location: %s" % self.location)
-
-            # Return OpenWeather data in a format suitable for InfluxDB
-            return {
-                'measurement': 'weather',
-                'fields': {
-                    'temperature': float(self.temp_imperial),
-                    'humidity': float(self.humidity),
-                    'pressure': float(self.pressure)
-                },
-                'tags': {
-                    'source': 'openweather',
-                    'location': str(self.location)
-                }
-            }
\ No newline at end of file
+        timestamp = now_ns()
+
+        # Use a response cached by this or another process while it is within the TTL
+        age = self.age()
+        if age is None or age >= self.ttl:
+            self._load_cache()
+            age = self.age()
+        if age is None or age >= self.ttl:
+            if time.monotonic() >= self.retry_at:
+                self._fetch(loop)
+            age = self.age()
+        else:
+            logging.info("[%s] Using weather conditions fetched %.0fs ago", loop, age)
+
+        if age is None:
+            logging.warning("\t No weather conditions available")
+            return None
+        stale = age >= self.ttl
+        if stale:
+            logging.warning(f"\t Weather conditions are stale ({age:.0f}s old)")
+            if not self.emit_stale:
+                return None
+
+        logging.info("\t Current temperature: %0.1f C (%0.1f F)", self.temp_metric, self.temp_imperial)
+        logging.info("\t Current relative humidity: %0.1f %%", self.humidity)
+        logging.info("\t Current pressure: %0.3f hPa (mb)", self.pressure)
+        logging.info("\t Location: %s", self.location)
+
+        # Return OpenWeather data in a format suitable for InfluxDB
+        return {
+            'measurement': 'weather',
+            'fields': {
+                'temperature': float(self.temp_imperial),
+                'humidity': float(self.humidity),
+                'pressure': float(self.pressure),
+                'age': float(age),
+                'stale': int(stale)
+            },
+            'tags': {
+                'source': 'openweather',
+                'location': str(self.location)
+            },
+            'time': timestamp
+        }
+
+    def close(self):
+        if self.session:
+            self.session.close()
@@ -0,0 +1,174 @@
+# @file: rolling.py
+# @brief: Sliding window statistics used for sensor rolling averages
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import math
+import re
+from array import array
+from collections import deque
+
+# The windows rolling statistics are calculated over by default
+DEFAULT_WINDOWS = '15m,1h,24h'
+
+# The percentiles reported for each window
+PERCENTILES = (50, 95)
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_windows(spec):
+    # Turn a list like '15m,1h,24h' into {'15m': 900, '1h': 3600, '24h': 86400}
+    windows = {}
+    for label in (spec or DEFAULT_WINDOWS).split(','):
+        label = label.strip()
+        match = re.fullmatch(r'(\d+)([smhd])', label)
+        if not match:
+            raise ValueError(f"Invalid rolling window: {label}")
+        windows[label] = int(match.group(1)) * UNITS[match.group(2)]
+    return windows
+
+def percentile(ordered, p):
+    # Linear interpolation between the closest ranks of an ordered list
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * p / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def summarize(values, percentiles=PERCENTILES):
+    # Batch statistics for a list of values, matching RollingWindow.summary()
+    if not values:
+        return {}
+    ordered = sorted(values)
+    summary = {
+        'ave': math.fsum(values) / len(values),
+        'min': ordered[0],
+        'max': ordered[-1]
+    }
+    for p in percentiles:
+        summary[f'p{p}'] = percentile(ordered, p)
+    return summary
+
+class RollingWindow(object):
+
+    def __init__(self, seconds, capacity, percentiles=PERCENTILES):
+
+        # The length of the window in seconds
+        self.seconds = seconds
+        self.span_ns = int(seconds * 1e9)
+
+        # The percentiles reported by summary()
+        self.percentiles = percentiles
+
+        # Ring buffers of sample times and values, oldest at self.start
+        self.capacity = capacity
+        self.times = array('q', [0] * capacity)
+        self.values = array('d', [0.0] * capacity)
+        self.start = 0
+        self.count = 0
+
+        # Running total of the values in the window, recalculated exactly once
+        # per capacity evictions so rounding errors cannot build up
+        self.total = 0.0
+        self.evictions = 0
+
+        # Monotonic queues of (sequence, value) giving the window min and max
+        self.seq = 0
+        self.min_queue = deque()
+        self.max_queue = deque()
+
+    def _evict(self):
+        value = self.values[self.start]
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+        self.total -= value
+        oldest = self.seq - self.count
+        if self.min_queue and self.min_queue[0][0] < oldest:
+            self.min_queue.popleft()
+        if self.max_queue and self.max_queue[0][0] < oldest:
+            self.max_queue.popleft()
+        self.evictions += 1
+        if self.evictions >= self.capacity:
+            self.total = math.fsum(self._window())
+            self.evictions = 0
+
+    def expire(self, timestamp):
+        # Drop samples that have fallen out of the window
+        while self.count and timestamp - self.times[self.start] >= self.span_ns:
+            self._evict()
+
+    def add(self, timestamp, value):
+        self.expire(timestamp)
+        if self.count == self.capacity:
+            self._evict()
+
+        index = (self.start + self.count) % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = value
+        self.count += 1
+        self.total += value
+
+        while self.min_queue and self.min_queue[-1][1] >= value:
+            self.min_queue.pop()
+        self.min_queue.append((self.seq, value))
+        while self.max_queue and self.max_queue[-1][1] <= value:
+            self.max_queue.pop()
+        self.max_queue.append((self.seq, value))
+        self.seq += 1
+
+    def _window(self):
+        return [self.values[(self.start + i) % self.capacity] for i in range(self.count)]
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def min(self):
+        return self.min_queue[0][1] if self.count else None
+
+    def max(self):
+        return self.max_queue[0][1] if self.count else None
+
+    def summary(self):
+        if not self.count:
+            return {}
+        summary = {'ave': self.mean(), 'min': self.min(), 'max': self.max()}
+        if self.percentiles:
+            ordered = sorted(self._window())
+            for p in self.percentiles:
+                summary[f'p{p}'] = percentile(ordered, p)
+        return summary
+
+class RollingStats(object):
+
+    def __init__(self, names, windows=None, sample_period=60, percentiles=PERCENTILES):
+
+        # The windows to calculate statistics over, as {label: seconds}
+        self.windows = windows or parse_windows(DEFAULT_WINDOWS)
+
+        # One ring buffer per measured value per window, sized for the number
+        # of samples taken in the window
+        self.series = {
+            name: {
+                label: RollingWindow(seconds, max(1, math.ceil(seconds / sample_period)) + 1, percentiles)
+                for label, seconds in self.windows.items()
+            }
+            for name in names
+        }
+
+        # The longest window, reported as the plain <name>_ave field
+        self.longest = max(self.windows, key=self.windows.get)
+
+    def add(self, timestamp, values):
+        for name, value in values.items():
+            for window in self.series[name].values():
+                window.add(timestamp, value)
+
+    def fields(self):
+        # Fields named <name>_<stat>_<window>, e.g. temperature_p95_1h
+        fields = {}
+        for name, windows in self.series.items():
+            for label, window in windows.items():
+                for stat, value in window.summary().items():
+                    fields[f'{name}_{stat}_{label}'] = value
+            fields[f'{name}_ave'] = windows[self.longest].mean()
+        return fields
@@ -0,0 +1,97 @@
+# @file: scheduler.py
+# @brief: Deadline based scheduler running each source at its own interval
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import logging
+import threading
+import time
+
+# What to do with ticks whose deadline passed while the scheduler was busy:
+# run each missed tick, or run once and move on to the next future deadline
+CATCH_UP = 'catch_up'
+SKIP = 'skip'
+
+class Job(object):
+
+    def __init__(self, name, target, interval, offset=0, policy=SKIP, max_catch_up=10):
+
+        # A name used in logs and health metrics
+        self.name = name
+
+        # The object or function the job runs
+        self.target = target
+
+        # The number of seconds between runs and the offset of the first run
+        self.interval = interval
+        self.offset = offset
+
+        # How late ticks are handled, and the most missed ticks run when catching up
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+
+        # The absolute monotonic deadline of the next run and the number of runs so far
+        self.deadline = None
+        self.tick = 0
+        self.skipped = 0
+
+class Scheduler(object):
+
+    def __init__(self, clock=time.monotonic, speed=1.0):
+
+        # The clock deadlines are measured against, and how many times faster than
+        # real time it runs
+        self.clock = clock
+        self.speed = speed
+
+        self.jobs = []
+        self.start_time = None
+        self._wakeup = threading.Event()
+
+    def add(self, name, target, interval, offset=0, policy=SKIP):
+        job = Job(name, target, interval, offset, policy)
+        if self.start_time is not None:
+            job.deadline = self.start_time + offset
+        self.jobs.append(job)
+        return job
+
+    def start(self, now=None):
+        # Deadlines are fixed from here on, so sample spacing does not drift with work time
+        self.start_time = self.clock() if now is None else now
+        for job in self.jobs:
+            job.deadline = self.start_time + job.offset
+
+    def due(self, now=None):
+        # Return (job, deadline) for every tick due by now, oldest first
+        now = self.clock() if now is None else now
+        ticks = []
+        for job in self.jobs:
+            if job.deadline > now:
+                continue
+            missed = int((now - job.deadline) // job.interval)
+            if job.policy == CATCH_UP:
+                runs = min(missed, job.max_catch_up) + 1
+                start = missed + 1 - runs
+                for n in range(start, missed + 1):
+                    ticks.append((job, job.deadline + n * job.interval))
+                job.skipped += start
+            else:
+                ticks.append((job, job.deadline + missed * job.interval))
+                job.skipped += missed
+            if missed:
+                logging.debug(f"{job.name} is {missed} ticks late ({job.policy})")
+            job.deadline += (missed + 1) * job.interval
+            job.tick += 1
+        return sorted(ticks, key=lambda tick: tick[1])
+
+    def next_deadline(self):
+        return min(job.deadline for job in self.jobs)
+
+    def sleep(self):
+        # Sleep until the next deadline, or until wake() is called
+        delay = (self.next_deadline() - self.clock()) / self.speed
+        if delay > 0:
+            self._wakeup.wait(delay)
+        self._wakeup.clear()
+
+    def wake(self):
+        self._wakeup.set()
@@ -3,84 +3,112 @@
 # @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
 
 import logging
-import board
-import adafruit_bme680
+
+from ..clock import now_ns
+from ..rolling import RollingStats
+from ..burst import BurstSampler, summary_fields
+
+# The temperature offset used for the BME680 sensor
+# @ref https://learn.adafruit.com/adafruit-bme680-humidity-temperature-barometic-pressure-voc-gas/python-circuitpython
+TEMP_OFFSET = -5
 
 class BME680(object):
 
-    def __init__(self, sample_time):
+    def __init__(self, sample_period=60, windows=None, burst_interval=None, device=None, address=0x77):
 
         # The temperature offset used for the BME680 sensor
-        # @ref https://learn.adafruit.com/adafruit-bme680-humidity-temperature-barometic-pressure-voc-gas/python-circuitpython
-        self.bme680_temp_offset = -5
+        self.bme680_temp_offset = TEMP_OFFSET
 
         # The current sea level pressure
         self.current_pressure = 1015
 
-        # The number of loops after which to fetch sensor data
-        self.sample_time = sample_time
-
-        # Sample counter used for rolling averages
+        # Sample counter
         self.sample_count = 0
 
-        # Total of all humidity samples used for rolling averages
-        self.total_humidity = 0
+        # Rolling statistics for humidity, pressure and temperature over each window
+        self.rolling = RollingStats(['temperature', 'pressure', 'humidity'], windows, sample_period)
 
-        # Total of all pressure samples used for rolling averages
-        self.total_pressure = 0
+        # Connect to the BME680 sensor on its I2C address, 0x77 or 0x76 when its SDO
+        # pin is pulled low, unless a simulated or replayed device is given
+        if device is None:
+            import board
+            import adafruit_bme680
+            address = int(address, 0) if isinstance(address, str) else address
+            device = adafruit_bme680.Adafruit_BME680_I2C(board.I2C(), address=address, debug=False)
+        self.sensor = device
 
-        # Total of all pressure samples used for rolling averages
-        self.total_temperature = 0
-
-        # Connect to the BME680 sensor
-        self.sensor = adafruit_bme680.Adafruit_BME680_I2C(board.I2C(), debug=False)
+        # Sample every burst_interval seconds and ship a summary of each sample interval
+        self.burst = None
+        if burst_interval:
+            self.burst = BurstSampler(self.read, burst_interval, name='bme680-burst')
 
     def callibrate(self, pressure):
         self.current_pressure = pressure
         self.sensor.sea_level_pressure = pressure
         logging.debug(f"BME680 sea level pressure set to {pressure} hPa")
 
+    def read(self):
+        tempC = self.sensor.temperature + self.bme680_temp_offset
+        return {
+            'temperature': (tempC * 1.8) + 32,
+            'gas': self.sensor.gas,
+            'humidity': self.sensor.relative_humidity,
+            'pressure': self.sensor.pressure
+        }
+
     def get_data(self, loop):
 
-        if loop % self.sample_time == 0:
-
-            self.sample_count += 1
-            logging.info(f"[{loop}] Fetching BME680 sensor data")
-
-            tempC = self.sensor.temperature + self.bme680_temp_offset
-            tempF = (tempC * 1.8) + 32
-            gas = self.sensor.gas
-            humidity = self.sensor.relative_humidity
-            pressure = self.sensor.pressure
-            altitude = self.sensor.altitude
-            logging.info("\t Temperature: %0.1f C (%0.1f F)" % (tempC, tempF))
-            logging.info("\t Gas: %d ohm" % gas)
-            logging.info("\t Humidity: %0.1f %%" % humidity)
-            logging.info("\t Pressure: %0.3f hPa" % pressure)
-            logging.info("\t Altitude = %0.2f meters" % altitude)
-
-            # Calc rolling average for BME680 date
-            self.total_humidity += humidity
-            self.total_pressure += pressure
-            self.total_temperature += tempF
-            ave_humidity = self.total_humidity/self.sample_count
-            ave_pressure = self.total_pressure/self.sample_count
-            ave_temperature = self.total_temperature/self.sample_count
-            logging.info(f"\t Humidity ave = {ave_humidity}  Pressure ave = {ave_pressure}  Temperature ave = {ave_temperature}")
-
-            # Return BME680 data in a format suitable for InfluxDB
-            return {
-                'measurement': 'climate',
-                'fields': {
-                    'temperature': tempF,
-                    'temperature_ave': ave_temperature,
-                    'pressure': pressure,
-                    'pressure_ave': ave_pressure,
-                    'humidity': humidity,
-                    'humidity_ave': ave_humidity,
-                    'gas': gas
-                },
-                'tags': {
-                    'sensor': 'bme680'
-                }
-            }
\ No newline at end of file
+        logging.info("[%s] Fetching BME680 sensor data", loop)
+
+        timestamp = now_ns()
+        burst = {}
+        if self.burst:
+            summary, samples = self.burst.reduce()
+            if not summary:
+                logging.warning("\t No BME680 samples taken this interval")
+                return None
+            reading = {name: stats['mean'] for name, stats in summary.items()}
+            burst = summary_fields(summary, samples)
+            logging.info("\t Reduced %s samples", samples)
+        else:
+            reading = self.read()
+
+        self.sample_count += 1
+        tempF = reading['temperature']
+        tempC = (tempF - 32) / 1.8
+        gas = reading['gas']
+        humidity = reading['humidity']
+        pressure = reading['pressure']
+        logging.info("\t Temperature: %0.1f C (%0.1f F)", tempC, tempF)
+        logging.info("\t Gas: %d ohm", gas)
+        logging.info("\t Humidity: %0.1f %%", humidity)
+        logging.info("\t Pressure: %0.3f hPa", pressure)
+        if not self.burst:
+            logging.info("\t Altitude = %0.2f meters", self.sensor.altitude)
+
+        # Calc rolling statistics for BME680 data
+        self.rolling.add(timestamp, {'temperature': tempF, 'pressure': pressure, 'humidity': humidity})
+        rolling = self.rolling.fields()
+        logging.info("\t Humidity ave = %s  Pressure ave = %s  Temperature ave = %s",
+                     rolling['humidity_ave'], rolling['pressure_ave'], rolling['temperature_ave'])
+
+        # Return BME680 data in a format suitable for InfluxDB
+        return {
+            'measurement': 'climate',
+            'fields': {
+                'temperature': tempF,
+                'pressure': pressure,
+                'humidity': humidity,
+                'gas': gas,
+                **rolling,
+                **burst
+            },
+            'tags': {
+                'sensor': 'bme680'
+            },
+            'time': timestamp
+        }
+
+    def close(self):
+        if self.burst:
+            self.burst.close()
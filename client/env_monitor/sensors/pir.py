@@ -3,56 +3,122 @@
 # @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
 
 import logging
-import board
-import digitalio
+import threading
+
+from ..clock import now_ns
 
 class PIR(object):
 
-    def __init__(self, sample_time, pir_sensor_gpio_pin=None):
+    def __init__(self, pir_sensor_gpio_pin=None, poll_interval=0.05, debounce=0.1, device=None):
 
         # THE GPIO pin to use as the PIR sensor digital input
-        self.input_pin = getattr(board, pir_sensor_gpio_pin)
-
-        # The number of loops after which to fetch sensor data
-        self.sample_time = sample_time
+        self.input_pin = pir_sensor_gpio_pin
 
-        # Sample counter used for rolling averages
+        # Sample counter
         self.sample_count = 0
 
-        # Connect to the PIR sensor
-        self.sensor = digitalio.DigitalInOut(self.input_pin)
-        self.sensor.direction = digitalio.Direction.INPUT
+        # The number of seconds between reads of the sensor by the capture thread
+        self.poll_interval = poll_interval
+
+        # The number of seconds the input has to hold a new value before it counts
+        self.debounce_ns = int(debounce * 1e9)
+
+        # Connect to the PIR sensor, unless a simulated or replayed input is given
+        if device is None:
+            import board
+            import digitalio
+            device = digitalio.DigitalInOut(getattr(board, self.input_pin))
+            device.direction = digitalio.Direction.INPUT
+        self.sensor = device
 
         # Read initial data from PIR sensor
+        self.lock = threading.Lock()
         self.current_value = self.sensor.value
-        self.old_value = self.current_value
+        self._reset(now_ns())
+
+        # Blinka's digitalio has no edge interrupts, so motion is captured by
+        # polling the input from a thread rather than once per sample loop
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._capture_loop, name='pir-capture', daemon=True)
+        self._thread.start()
+
+    def _reset(self, timestamp):
+        # Start a new reporting interval, carrying over motion still in progress
+        self.events = 0
+        self.occupied_ns = 0
+        self.occupied_since = timestamp if self.current_value else None
+        self.first_motion = timestamp if self.current_value else None
+        self.last_motion = timestamp if self.current_value else None
+
+    def _update(self, value, timestamp):
+        with self.lock:
+            if value == self.current_value:
+                return
+            self.current_value = value
+            if value:
+                self.events += 1
+                self.occupied_since = timestamp
+                if self.first_motion is None:
+                    self.first_motion = timestamp
+                logging.info("\t Motion detected")
+            else:
+                if self.occupied_since is not None:
+                    self.occupied_ns += timestamp - self.occupied_since
+                self.occupied_since = None
+                logging.info("\t Motion ended")
+            self.last_motion = timestamp
+
+    def _capture_loop(self):
+        candidate = self.current_value
+        since = now_ns()
+        while not self._closing.is_set():
+            try:
+                value = self.sensor.value
+            except Exception as e:
+                logging.debug("PIR read failed: %s", e)
+                value = candidate
+            timestamp = now_ns()
+            if value != candidate:
+                candidate = value
+                since = timestamp
+            elif value != self.current_value and timestamp - since >= self.debounce_ns:
+                # The change is stamped with when it started, not when it was confirmed
+                self._update(value, since)
+            self._closing.wait(self.poll_interval)
 
     def get_data(self, loop):
 
-        if loop % self.sample_time == 0:
+        self.sample_count += 1
+        logging.info("[%s] Fetching PIR sensor data", loop)
 
-            self.sample_count += 1
-            logging.info(f"[{loop}] Fetching PIR sensor data")
-            motion = 0
+        with self.lock:
+            timestamp = now_ns()
+            occupied_ns = self.occupied_ns
+            if self.occupied_since is not None:
+                occupied_ns += timestamp - self.occupied_since
+                self.last_motion = timestamp
+            fields = {
+                'motion': 1 if self.events or occupied_ns else 0,
+                'events': self.events,
+                'occupied_seconds': occupied_ns / 1e9
+            }
+            if self.first_motion is not None:
+                fields['first_motion'] = self.first_motion
+                fields['last_motion'] = self.last_motion
+            self._reset(timestamp)
 
-            self.current_value = self.sensor.value
-            if self.current_value:
-                if not self.old_value:
-                    motion = 1
-                    logging.info("\t Motion detected")
-            else:
-                if self.old_value:
-                    motion = 0
-                    logging.info("\t Motion ended")
-            self.old_value = self.current_value
-
-            # Return the data in a format suitable for InfluxDB
-            return {
-                'measurement': 'motion',
-                'fields': {
-                    'motion': motion
-                },
-                'tags': {
-                    'sensor': 'pir'
-                }
-            }
\ No newline at end of file
+        logging.info("\t Motion events: %s  Occupied: %.1fs", fields['events'], fields['occupied_seconds'])
+
+        # Return the data in a format suitable for InfluxDB
+        return {
+            'measurement': 'motion',
+            'fields': fields,
+            'tags': {
+                'sensor': 'pir'
+            },
+            'time': timestamp
+        }
+
+    def close(self):
+        self._closing.set()
+        self._thread.join()
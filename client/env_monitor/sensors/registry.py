@@ -0,0 +1,159 @@
+# @file: registry.py
+# @brief: Registry of sensor drivers and the sensor instances a node is configured with
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import importlib
+import inspect
+import json
+import logging
+import threading
+from importlib.metadata import entry_points
+
+# The entry point group other packages register sensor drivers in, e.g. in their
+# pyproject.toml
+#   [project.entry-points."env_monitor.sensors"]
+#   scd41 = "env_scd41:SCD41"
+# A driver is a class taking its options as keyword arguments, with a
+# get_data(loop) method returning a point or None and a close() method
+ENTRY_POINT_GROUP = 'env_monitor.sensors'
+
+# The drivers that come with the monitor, only imported when an instance is configured
+DRIVERS = {
+    'bme680': '.bme680:BME680',
+    'sds011': '.sds011:SDS011',
+    'pir': '.pir:PIR'
+}
+
+# Settings of an instance read by the monitor. Any others are passed to the driver
+SETTINGS = ('type', 'name', 'enabled', 'interval', 'tags', 'backend')
+
+# The ways each sensor can be read. Kept here rather than with the simulated
+# devices so a node reading only hardware does not import them
+HARDWARE = 'hardware'
+SYNTHETIC = 'synthetic'
+REPLAY = 'replay'
+BACKENDS = (HARDWARE, SYNTHETIC, REPLAY)
+
+def load_driver(kind):
+    if kind in DRIVERS:
+        module, _, name = DRIVERS[kind].partition(':')
+        return getattr(importlib.import_module(module, __package__), name)
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name == kind:
+            return entry_point.load()
+    raise ValueError(f"Unknown sensor type: {kind}")
+
+def accepted(driver, defaults):
+    # The defaults a driver's constructor takes, or all of them if it takes **kwargs
+    parameters = inspect.signature(driver).parameters.values()
+    if any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters):
+        return dict(defaults)
+    names = {parameter.name for parameter in parameters}
+    return {name: value for name, value in defaults.items() if name in names}
+
+def load_config(path):
+    # The sensor instances listed in a JSON file
+    with open(path, 'r') as file:
+        config = json.load(file)
+    if not isinstance(config, list) or not all(isinstance(entry, dict) and 'type' in entry for entry in config):
+        raise ValueError(f"{path} should hold a list of sensors, each with a type")
+    return config
+
+class Source(object):
+
+    # One configured instance of a sensor driver, set up when first needed
+
+    def __init__(self, name, kind, options=None, tags=None, interval=60, backend=HARDWARE):
+
+        # The name the instance is scheduled, timed and logged as, e.g. sds011_door
+        self.name = name
+
+        # The driver type, e.g. sds011
+        self.kind = kind
+
+        # Keyword arguments for the driver, e.g. serial_device
+        self.options = options or {}
+
+        # Tags added to every point, e.g. {'location': 'door'}
+        self.tags = tags or {}
+
+        # The number of seconds between samples
+        self.interval = interval
+
+        # Where the sensor is read from: the hardware, a synthetic generator or a replayed recording
+        self.backend = backend
+
+        # Arguments the monitor gives every driver that takes them, set by the monitor
+        self.defaults = {}
+
+        # The driver instance, once set up
+        self.sensor = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        # Set up the driver, importing it and connecting to the hardware the first
+        # time. Raises if the sensor could not be set up, so it is tried again
+        # the next time it is due
+        with self.lock:
+            if self.sensor is None:
+                driver = load_driver(self.kind)
+                self.sensor = driver(**{**accepted(driver, self.defaults), **self.options})
+                logging.info(f"Set up {self.name} sensor")
+        return self.sensor
+
+    def get_data(self, loop):
+        data = self.open().get_data(loop)
+        if data and self.tags:
+            data['tags'] = {**(data.get('tags') or {}), **self.tags}
+        return data
+
+    def wake(self, loop=None):
+        self.open().wake(loop)
+
+    @property
+    def callibrated(self):
+        # Whether readings are callibrated with the OpenWeather pressure, known
+        # from the driver before it is set up
+        if self.sensor is not None:
+            return hasattr(self.sensor, 'callibrate')
+        try:
+            return hasattr(load_driver(self.kind), 'callibrate')
+        except Exception:
+            return False
+
+    def callibrate(self, pressure):
+        if hasattr(self.sensor, 'callibrate'):
+            self.sensor.callibrate(pressure)
+
+    def close(self):
+        if self.sensor is not None and hasattr(self.sensor, 'close'):
+            self.sensor.close()
+
+def build_sources(config, interval=60, backends=None):
+    # Sources for the enabled instances in config. Instances of a type are named
+    # after it, numbered from the second one, and any instance not named after
+    # its type is tagged with its name so the series of each instance are apart
+    sources = []
+    names = set()
+    for entry in config:
+        if not entry.get('enabled', True):
+            logging.info(f"Sensor {entry.get('name', entry['type'])} is disabled")
+            continue
+        kind = entry['type']
+        name = entry.get('name')
+        if name is None:
+            name = kind
+            number = 1
+            while name in names:
+                number += 1
+                name = f"{kind}_{number}"
+        if name in names:
+            raise ValueError(f"More than one sensor is named {name}")
+        names.add(name)
+        tags = dict(entry.get('tags') or {})
+        if name != kind:
+            tags.setdefault('instance', name)
+        options = {key: value for key, value in entry.items() if key not in SETTINGS}
+        backend = entry.get('backend') or (backends or {}).get(kind, HARDWARE)
+        sources.append(Source(name, kind, options, tags, entry.get('interval', interval), backend))
+    return sources
@@ -3,65 +3,172 @@
 # @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
 
 import logging
-import serial
+import time
+
+from ..clock import now_ns
+from ..rolling import RollingStats
+from ..burst import BurstSampler, summary_fields
+from ..logpipe import Lazy
+
+# Data frames are 10 bytes: 0xAA 0xC0, PM2.5 and PM10 as little endian tenths
+# of ug/m3, two bytes of sensor ID, a checksum of bytes 2-7 and 0xAB
+# @ref https://cdn-reichelt.de/documents/datenblatt/X200/SDS011-DATASHEET.pdf
+FRAME_HEADER = b'\xaa\xc0'
+FRAME_TAIL = 0xab
+FRAME_LENGTH = 10
+
+# Command IDs used in 19 byte command frames: 0xAA 0xB4, command, 12 data
+# bytes, 0xFF 0xFF (all sensors), a checksum of bytes 2-16 and 0xAB
+CMD_REPORTING_MODE = 2
+CMD_QUERY_DATA = 4
+CMD_SLEEP_WORK = 6
 
 class SDS011(object):
 
-    def __init__(self, sample_time, samples_day):
+    def __init__(self, sample_period=60, windows=None, serial_device='/dev/ttyUSB0',
+                 query_mode=False, warmup=0, read_timeout=3, burst_interval=None, device=None):
 
         # The path to the serial devices
-        self.serial_device = '/dev/ttyUSB0'
-        
-        # The number of loops after which to fetch sensor data
-        self.sample_time = sample_time
+        self.serial_device = serial_device
+
+        # Whether the sensor only measures when queried and sleeps between samples
+        self.query_mode = query_mode
+
+        # The number of seconds before a sample the sensor is woken so the fan can
+        # clear the chamber, only used in query mode
+        self.warmup = warmup
 
-        # The number of loops after which to write 24h data
-        self.samples_day = samples_day
+        # The number of seconds to wait for a valid data frame
+        self.read_timeout = read_timeout
 
-        # Sample counter used for rolling averages
+        # Sample counter
         self.sample_count = 0
 
-        # Total of all PM2.5 samples used for rolling averages
-        self.total_pm_small = 0
+        # Rolling statistics for PM2.5 and PM10 over each window
+        self.rolling = RollingStats(['pm2.5', 'pm10'], windows, sample_period)
+
+        # Connect with the SDS011 sensor, unless a simulated or replayed device is
+        # given. Reads never block for longer than a frame takes to arrive
+        if device is None:
+            import serial
+            device = serial.Serial(self.serial_device, baudrate=9600, timeout=1.5)
+        self.sensor = device
+
+        # Sample every burst_interval seconds and ship a summary of each sample
+        # interval. The sensor has to stay awake for this so query mode is not used
+        self.burst = None
+        if burst_interval:
+            if self.query_mode:
+                logging.warning("SDS011 query mode is not used with burst sampling")
+                self.query_mode = False
+            self.burst = BurstSampler(self.read, burst_interval, name='sds011-burst')
+
+        if self.query_mode:
+            self._command(CMD_REPORTING_MODE, [1, 1])
+            self._command(CMD_SLEEP_WORK, [1, 0])
+            logging.info("SDS011 set to query mode and put to sleep")
+
+    def _command(self, command, data):
+        payload = bytes([command] + data + [0] * (12 - len(data))) + b'\xff\xff'
+        frame = b'\xaa\xb4' + payload + bytes([sum(payload) & 0xff, FRAME_TAIL])
+        self.sensor.write(frame)
+        self.sensor.flush()
 
-        # Total of all PM10 samples used for rolling averages
-        self.total_pm_large = 0
+    def _parse(self, buffer):
+        # Return the newest valid reading in the buffer and any trailing partial frame
+        reading = None
+        while True:
+            start = buffer.find(FRAME_HEADER)
+            if start < 0:
+                return reading, buffer[-1:]
+            if len(buffer) - start < FRAME_LENGTH:
+                return reading, buffer[start:]
+            frame = buffer[start:start + FRAME_LENGTH]
+            if frame[9] == FRAME_TAIL and sum(frame[2:8]) & 0xff == frame[8]:
+                pm_small = int.from_bytes(frame[2:4], byteorder='little') / 10
+                pm_large = int.from_bytes(frame[4:6], byteorder='little') / 10
+                reading = (pm_small, pm_large)
+                buffer = buffer[start + FRAME_LENGTH:]
+            else:
+                logging.debug("Discarding invalid SDS011 frame: %s", Lazy(frame.hex))
+                buffer = buffer[start + 1:]
 
-        # Connect with the SDS011 sensor
-        self.sensor = serial.Serial(self.serial_device)
+    def _read_frame(self):
+        # Drop frames queued since the last sample so the reading is fresh
+        self.sensor.reset_input_buffer()
+        if self.query_mode:
+            self._command(CMD_QUERY_DATA, [])
+
+        buffer = b''
+        deadline = time.monotonic() + self.read_timeout
+        while time.monotonic() < deadline:
+            # Read whatever is waiting in one call, or block for at most one frame
+            buffer += self.sensor.read(self.sensor.in_waiting or FRAME_LENGTH)
+            reading, buffer = self._parse(buffer)
+            if reading:
+                return reading
+        return None
+
+    def read(self):
+        reading = self._read_frame()
+        if reading is None:
+            return None
+        return {'pm2.5': reading[0], 'pm10': reading[1]}
+
+    def wake(self, loop=None):
+        # Scheduled warmup seconds before each sample when in query mode
+        if self.query_mode:
+            logging.debug("[%s] Waking SDS011 sensor", loop)
+            self._command(CMD_SLEEP_WORK, [1, 1])
 
     def get_data(self, loop):
 
-        if loop % self.sample_time == 0:
-
-            self.sample_count += 1
-            logging.info(f"[{loop}] Fetching SDS011 sensor data")
-
-            data = []
-            for index in range(0,10):
-                datum = self.sensor.read()
-                data.append(datum)
-            pm_small = int.from_bytes(b''.join(data[2:4]), byteorder='little') / 10
-            pm_large = int.from_bytes(b''.join(data[4:6]), byteorder='little') / 10
-            logging.info(f"\t PM2.5 = {pm_small}  PM10 = {pm_large}")
-
-            # Calc rolling averages for SDS011 data
-            self.total_pm_small += pm_small
-            self.total_pm_large += pm_large
-            ave_pm_small = self.total_pm_small/self.sample_count
-            ave_pm_large = self.total_pm_large/self.sample_count
-            logging.info(f"\t PM2.5 ave = {ave_pm_small}  PM10 ave = {ave_pm_large}")
-
-            # Return SDS011 data in a format suitable for InfluxDB
-            return {
-                'measurement': 'particles',
-                'fields': {
-                    'pm2.5': pm_small,
-                    'pm10': pm_large,
-                    'pm2.5_ave': ave_pm_small,
-                    'pm10_ave': ave_pm_large
-                },
-                'tags': {
-                    'sensor': 'sds011'
-                }
-            }
\ No newline at end of file
+        logging.info("[%s] Fetching SDS011 sensor data", loop)
+
+        timestamp = now_ns()
+        burst = {}
+        if self.burst:
+            summary, samples = self.burst.reduce()
+            if not summary:
+                logging.warning("\t No SDS011 samples taken this interval")
+                return None
+            reading = (summary['pm2.5']['mean'], summary['pm10']['mean'])
+            burst = summary_fields(summary, samples)
+            logging.info("\t Reduced %s samples", samples)
+        else:
+            if self.query_mode and not self.warmup:
+                self._command(CMD_SLEEP_WORK, [1, 1])
+            reading = self._read_frame()
+            if self.query_mode:
+                self._command(CMD_SLEEP_WORK, [1, 0])
+            if reading is None:
+                logging.warning("\t No valid SDS011 data frame received")
+                return None
+
+        self.sample_count += 1
+        pm_small, pm_large = reading
+        logging.info("\t PM2.5 = %s  PM10 = %s", pm_small, pm_large)
+
+        # Calc rolling statistics for SDS011 data
+        self.rolling.add(timestamp, {'pm2.5': pm_small, 'pm10': pm_large})
+        rolling = self.rolling.fields()
+        logging.info("\t PM2.5 ave = %s  PM10 ave = %s", rolling['pm2.5_ave'], rolling['pm10_ave'])
+
+        # Return SDS011 data in a format suitable for InfluxDB
+        return {
+            'measurement': 'particles',
+            'fields': {
+                'pm2.5': pm_small,
+                'pm10': pm_large,
+                **rolling,
+                **burst
+            },
+            'tags': {
+                'sensor': 'sds011'
+            },
+            'time': timestamp
+        }
+
+    def close(self):
+        if self.burst:
+            self.burst.close()
@@ -0,0 +1,234 @@
+# @file: simulated.py
+# @brief: Simulated and replayed sensor devices for running without hardware
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import bisect
+import json
+import logging
+import math
+import random
+
+from .. import codec
+from ..clock import now_ns
+from .bme680 import TEMP_OFFSET
+from .registry import BACKENDS, HARDWARE, REPLAY, SYNTHETIC
+from .sds011 import FRAME_HEADER, FRAME_TAIL
+
+DAY = 86400
+
+class Synthetic(object):
+
+    def __init__(self, seed=0):
+
+        # Readings depend only on the seed and the time since the generator
+        # started, so runs with the same seed produce the same readings
+        self.seed = seed
+        self.start_ns = now_ns()
+
+    def _elapsed(self):
+        return (now_ns() - self.start_ns) / 1e9
+
+    def _random(self, kind, slot):
+        return random.Random(f"{self.seed}:{kind}:{slot}")
+
+    def climate(self):
+        # A daily cycle starting at dawn, with noise that changes every second
+        elapsed = self._elapsed()
+        day = math.sin(2 * math.pi * elapsed / DAY)
+        noise = self._random('climate', int(elapsed))
+        return {
+            'temperature': 18 + 4 * day + noise.gauss(0, 0.1) - TEMP_OFFSET,
+            'gas': int(50000 - 8000 * day + noise.gauss(0, 500)),
+            'humidity': 45 - 10 * day + noise.gauss(0, 0.5),
+            'pressure': 1013 + 3 * math.sin(2 * math.pi * elapsed / (3 * DAY)) + noise.gauss(0, 0.05)
+        }
+
+    def particles(self):
+        # A clean baseline with a one in ten chance of a dust burst in each 10 minutes
+        elapsed = self._elapsed()
+        burst = self._random('dust', int(elapsed // 600))
+        level = burst.uniform(20, 80) if burst.random() < 0.1 else 0
+        noise = self._random('particles', int(elapsed))
+        pm_small = max(0.0, 5 + level + noise.gauss(0, 1))
+        return {'pm2.5': pm_small, 'pm10': max(0.0, pm_small * 1.6 + noise.gauss(0, 1))}
+
+    def motion(self):
+        # Someone is in the workshop for the first 100 seconds of three in ten
+        # 5 minute slots, during the day only
+        elapsed = self._elapsed()
+        if elapsed % DAY > DAY / 2:
+            return False
+        slot = self._random('motion', int(elapsed // 300))
+        return slot.random() < 0.3 and elapsed % 300 < 100
+
+class Replay(object):
+
+    def __init__(self, replay_file):
+
+        # Points recorded by the monitor, either one JSON point per line as
+        # written to the record file or a binary cache log segment
+        self.replay_file = replay_file
+        self.series = {}
+        with open(replay_file, 'rb') as f:
+            data = f.read()
+        if data.startswith(codec.MAGIC):
+            points, _ = codec.Decoder().decode(data, len(codec.MAGIC))
+        else:
+            points = []
+            for line in data.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    points.append(json.loads(line))
+                except ValueError as e:
+                    logging.warning(f"Ignoring invalid replay record: {e}")
+        for point in points:
+            self.series.setdefault(point.get('measurement'), []).append((point['time'], point['fields']))
+        for points in self.series.values():
+            points.sort(key=lambda point: point[0])
+        self.times = {measurement: [point[0] for point in points] for measurement, points in self.series.items()}
+        logging.info(f"Loaded {sum(map(len, self.series.values()))} points to replay from {replay_file}")
+
+        # Playback starts with the first recorded reading and follows the clock,
+        # so it runs faster than real time when the clock does
+        self.start_ns = now_ns()
+
+    def _fields(self, measurement):
+        # The recorded reading in effect now, starting again after the last one
+        times = self.times.get(measurement)
+        if not times:
+            return None
+        span = times[-1] - times[0]
+        offset = now_ns() - self.start_ns
+        if span:
+            offset %= span
+        index = bisect.bisect_right(times, times[0] + offset) - 1
+        return self.series[measurement][index][1]
+
+    def climate(self):
+        fields = self._fields('climate')
+        if fields is None:
+            return None
+        tempC = (fields['temperature'] - 32) / 1.8
+        return {
+            'temperature': tempC - TEMP_OFFSET,
+            'gas': fields['gas'],
+            'humidity': fields['humidity'],
+            'pressure': fields['pressure']
+        }
+
+    def particles(self):
+        fields = self._fields('particles')
+        if fields is None:
+            return None
+        return {'pm2.5': fields['pm2.5'], 'pm10': fields['pm10']}
+
+    def motion(self):
+        fields = self._fields('motion')
+        return bool(fields and fields.get('motion'))
+
+class SimulatedBME680(object):
+
+    # Stands in for adafruit_bme680.Adafruit_BME680_I2C
+
+    def __init__(self, source):
+        self.source = source
+        self.sea_level_pressure = 1013.25
+
+    def _read(self, name):
+        reading = self.source.climate()
+        if reading is None:
+            raise OSError("No recorded climate readings to replay")
+        return reading[name]
+
+    @property
+    def temperature(self):
+        return self._read('temperature')
+
+    @property
+    def gas(self):
+        return self._read('gas')
+
+    @property
+    def relative_humidity(self):
+        return self._read('humidity')
+
+    @property
+    def pressure(self):
+        return self._read('pressure')
+
+    @property
+    def altitude(self):
+        return 44330 * (1.0 - math.pow(self.pressure / self.sea_level_pressure, 0.1903))
+
+class SimulatedSerial(object):
+
+    # Stands in for the SDS011 serial port, answering every read with a data frame
+
+    def __init__(self, source):
+        self.source = source
+        self.pending = b''
+
+    @property
+    def in_waiting(self):
+        return len(self.pending)
+
+    def _frame(self):
+        reading = self.source.particles()
+        if reading is None:
+            return b''
+        payload = (round(reading['pm2.5'] * 10).to_bytes(2, byteorder='little')
+                   + round(reading['pm10'] * 10).to_bytes(2, byteorder='little')
+                   + b'\x00\x00')
+        return FRAME_HEADER + payload + bytes([sum(payload) & 0xff, FRAME_TAIL])
+
+    def read(self, size=1):
+        if not self.pending:
+            self.pending = self._frame()
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def write(self, data):
+        # Commands are accepted and ignored, the simulated sensor is always awake
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.pending = b''
+
+class SimulatedInput(object):
+
+    # Stands in for the digitalio input the PIR sensor is connected to
+
+    def __init__(self, source):
+        self.source = source
+
+    @property
+    def value(self):
+        return self.source.motion()
+
+# The device standing in for the hardware of each sensor type that can be simulated
+DEVICES = {'bme680': SimulatedBME680, 'sds011': SimulatedSerial, 'pir': SimulatedInput}
+
+def open_device(sensor, backend, sources, replay_file=None, seed=0, name=None):
+    # Return a device for a sensor that is not read from hardware, or None if it
+    # is. Simulated sensors share one generator and replayed ones one recording,
+    # kept in sources by backend
+    if backend == HARDWARE:
+        return None
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown {sensor} backend: {backend}")
+    if sensor not in DEVICES:
+        raise ValueError(f"The {sensor} sensor can only be read from hardware")
+    if backend not in sources:
+        if backend == REPLAY:
+            if not replay_file:
+                raise ValueError(f"A replay file is needed to replay the {sensor} sensor")
+            sources[backend] = Replay(replay_file)
+        else:
+            sources[backend] = Synthetic(seed)
+    logging.info(f"Reading the {name or sensor} sensor from a {backend} backend")
+    return DEVICES[sensor](sources[backend])
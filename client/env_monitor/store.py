@@ -0,0 +1,313 @@
+# @file: store.py
+# @brief: Local time series store of readings on the node with a JSON query API
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+from . import codec
+from .clock import now_ns
+from .rolling import UNITS
+from .tiers import Bucket
+
+# Readings of each measurement are kept in one file per hour, named by the start
+# of the hour in nanoseconds. Files are compressed once the hour has passed
+PARTITION = 3600 * 10**9
+SUFFIX = '.seg'
+
+# The number of hours of readings kept by default
+DEFAULT_RETENTION = 48 * 3600
+
+# The most points a range query returns, oldest first
+MAX_POINTS = 10000
+
+def parse_number(value):
+    # A finite number, raising ValueError for anything else, e.g. inf
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"Invalid number: {value}")
+    return number
+
+def parse_time(value, now):
+    # A time in nanoseconds from a duration before now, e.g. -24h, or seconds since the epoch
+    if value is None or value == 'now':
+        return now
+    if value[:1] == '-' and value[-1:] in UNITS:
+        return now - int(parse_number(value[1:-1]) * UNITS[value[-1]] * 10**9)
+    return int(parse_number(value) * 10**9)
+
+def parse_duration(value):
+    # Nanoseconds from a positive duration like 15m
+    if value[-1:] not in UNITS:
+        raise ValueError(f"Invalid duration: {value}")
+    duration = int(parse_number(value[:-1]) * UNITS[value[-1]] * 10**9)
+    if duration <= 0:
+        raise ValueError(f"Duration must be positive: {value}")
+    return duration
+
+class LocalStore(object):
+
+    def __init__(self, directory, retention=DEFAULT_RETENTION, port=None, bind='127.0.0.1'):
+
+        # The directory with a subdirectory of hourly files for each measurement
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+        # The number of seconds readings are kept for
+        self.retention_ns = int(retention * 10**9)
+
+        # The hours stored for each measurement, oldest first
+        self.partitions = {}
+
+        # The open file and encoder of the current hour of each measurement, as
+        # (start, file, encoder)
+        self.current = {}
+
+        # The newest reading of each series, keyed by measurement and tags as JSON
+        self.latest = {}
+
+        self.lock = threading.Lock()
+        self._load()
+
+        # Local HTTP endpoint answering queries as JSON
+        self.server = None
+        if port:
+            self.start_server(port, bind)
+
+    def _path(self, measurement, start=None):
+        path = os.path.join(self.directory, quote(measurement, safe=''))
+        return path if start is None else os.path.join(path, f'{start}{SUFFIX}')
+
+    def _load(self):
+        for name in os.listdir(self.directory):
+            if not os.path.isdir(os.path.join(self.directory, name)):
+                continue
+            starts = []
+            for filename in os.listdir(os.path.join(self.directory, name)):
+                if filename.endswith(SUFFIX) and filename[:-len(SUFFIX)].isdigit():
+                    starts.append(int(filename[:-len(SUFFIX)]))
+            if starts:
+                measurement = unquote(name)
+                self.partitions[measurement] = sorted(starts)
+                # The newest hour may hold nothing readable, e.g. if the monitor
+                # stopped as it was started, so earlier hours are read until one does
+                for start in reversed(self.partitions[measurement]):
+                    records = self._read(measurement, start)
+                    for record in records:
+                        self._remember(record)
+                    if records:
+                        break
+        if self.partitions:
+            newest = max(starts[-1] for starts in self.partitions.values())
+            self._prune(newest + PARTITION)
+            logging.info(f"Loaded local store of {len(self.partitions)} measurements from {self.directory}")
+
+    def _read(self, measurement, start):
+        # The records of one hour, from frames written as they arrived or a compressed block
+        try:
+            with open(self._path(measurement, start), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+        if not data.startswith(codec.MAGIC):
+            return []
+        return [record for record in codec.Decoder().iterate(data, len(codec.MAGIC))
+                if isinstance(record, dict) and isinstance(record.get('time'), int)]
+
+    def _remember(self, record):
+        key = (record['measurement'], json.dumps(record.get('tags') or {}, sort_keys=True))
+        latest = self.latest.get(key)
+        if latest is None or record['time'] >= latest['time']:
+            self.latest[key] = record
+
+    def _open(self, measurement, start):
+        # Append to the file of an hour, dropping a frame torn by a crash
+        os.makedirs(self._path(measurement), exist_ok=True)
+        path = self._path(measurement, start)
+        file = open(path, 'a+b')
+        file.seek(0)
+        data = file.read()
+        if not data:
+            file.write(codec.MAGIC)
+        elif data.startswith(codec.MAGIC):
+            decoder = codec.Decoder()
+            for _ in decoder.iterate(data, len(codec.MAGIC)):
+                pass
+            if decoder.offset < len(data):
+                file.truncate(decoder.offset)
+        else:
+            logging.warning(f"Replacing unreadable local store file {path}")
+            file.truncate(0)
+            file.write(codec.MAGIC)
+        starts = self.partitions.setdefault(measurement, [])
+        if start not in starts:
+            starts.append(start)
+            starts.sort()
+        self.current[measurement] = (start, file, codec.Encoder())
+
+    def _seal(self, measurement, start):
+        # Compress the file of an hour that has passed. The records are encoded
+        # again, as a late reading may have been appended after an earlier block
+        encoder = codec.Encoder()
+        data = codec.MAGIC + b''.join(encoder.encode(record) for record in self._read(measurement, start))
+        path = self._path(measurement, start)
+        try:
+            with open(path + '.tmp', 'wb') as sealed:
+                sealed.write(codec.compress(data))
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logging.warning(f"Failed to compress local store file {path}: {e}")
+
+    def _prune(self, now):
+        # Remove the hours that have passed out of the retention period
+        for measurement, starts in self.partitions.items():
+            while starts and starts[0] + PARTITION <= now - self.retention_ns:
+                start = starts.pop(0)
+                if measurement in self.current and self.current[measurement][0] == start:
+                    self.current.pop(measurement)[1].close()
+                try:
+                    os.remove(self._path(measurement, start))
+                except FileNotFoundError:
+                    pass
+        for key in [key for key, record in self.latest.items() if record['time'] <= now - self.retention_ns]:
+            del self.latest[key]
+
+    def append(self, record):
+        if (not isinstance(record, dict) or not isinstance(record.get('measurement'), str)
+                or not isinstance(record.get('time'), int)):
+            return
+        measurement = record['measurement']
+        start = record['time'] - record['time'] % PARTITION
+        with self.lock:
+            current = self.current.get(measurement)
+            if current is None or current[0] != start:
+                if current is not None:
+                    self.current.pop(measurement)[1].close()
+                # The newest hour is sealed once a reading for a later hour arrives,
+                # including an hour left open when the monitor last stopped
+                starts = self.partitions.get(measurement)
+                if starts and starts[-1] < start:
+                    self._seal(measurement, starts[-1])
+                    self._prune(record['time'])
+                self._open(measurement, start)
+            _, file, encoder = self.current[measurement]
+            file.write(encoder.encode(record))
+            file.flush()
+            self._remember(record)
+
+    def measurements(self):
+        with self.lock:
+            return {measurement: {'oldest': starts[0], 'hours': len(starts)}
+                    for measurement, starts in self.partitions.items() if starts}
+
+    def latest_values(self, measurement=None):
+        with self.lock:
+            return [record for (name, _), record in sorted(self.latest.items())
+                    if measurement is None or name == measurement]
+
+    def range(self, measurement, start, end, fields=None, every=None, limit=MAX_POINTS):
+        # The readings between start and end in nanoseconds, oldest first, or the
+        # mean, min, max and count of each field per every nanoseconds. The files
+        # are read without holding the lock, so a long query does not hold up
+        # append. A file sealed or pruned meanwhile is replaced or removed whole
+        with self.lock:
+            starts = [hour for hour in self.partitions.get(measurement, [])
+                      if hour + PARTITION > start and hour <= end]
+            if measurement in self.current:
+                self.current[measurement][1].flush()
+        records = []
+        for hour in starts:
+            records.extend(record for record in self._read(measurement, hour) if start <= record['time'] <= end)
+        records.sort(key=lambda record: record['time'])
+
+        if fields:
+            for record in records:
+                record['fields'] = {name: value for name, value in record['fields'].items() if name in fields}
+
+        if every:
+            buckets = {}
+            for record in records:
+                numeric = {name: value for name, value in record['fields'].items()
+                           if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)}
+                key = (json.dumps(record.get('tags') or {}, sort_keys=True), record['time'] - record['time'] % every)
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = Bucket(key[1])
+                bucket.add(numeric)
+            records = sorted(({'measurement': measurement, 'fields': bucket.fields(), 'tags': json.loads(tags),
+                               'time': bucket.start} for (tags, _), bucket in buckets.items()),
+                             key=lambda record: record['time'])
+
+        return records[:limit]
+
+    def replay(self, start, end):
+        # The readings of each measurement between start and end, e.g. to write
+        # to InfluxDB again after the server lost data
+        for measurement in self.measurements():
+            yield self.range(measurement, start, end, limit=None)
+
+    def query(self, path, params):
+        # Answer a request to the query API, as an HTTP status and a JSON document
+        now = now_ns()
+        param = lambda name: params[name][-1] if name in params else None
+        if path == '/measurements':
+            return 200, self.measurements()
+        if path == '/latest':
+            return 200, self.latest_values(param('measurement'))
+        if path == '/range':
+            if not param('measurement'):
+                return 400, {'error': "measurement is required"}
+            try:
+                start = parse_time(param('start') or '-1h', now)
+                end = parse_time(param('end'), now)
+                every = parse_duration(param('every')) if param('every') else None
+                limit = min(int(param('limit') or MAX_POINTS), MAX_POINTS)
+                if limit < 1:
+                    raise ValueError(f"limit must be at least 1: {limit}")
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            fields = set(param('fields').split(',')) if param('fields') else None
+            return 200, self.range(param('measurement'), start, end, fields, every, limit)
+        return 404, {'error': f"Unknown query {path}, expected /measurements, /latest or /range"}
+
+    def start_server(self, port, bind):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        store = self
+
+        class QueryHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                started = time.perf_counter()
+                url = urlparse(self.path)
+                status, result = store.query(url.path.rstrip('/') or '/', parse_qs(url.query))
+                body = json.dumps(result, separators=(',', ':')).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Server-Timing", f"query;dur={(time.perf_counter() - started) * 1000:.1f}")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((bind, port), QueryHandler)
+        except OSError as e:
+            logging.warning(f"Failed to start local store queries on port {port}: {e}")
+            return
+        threading.Thread(target=self.server.serve_forever, name="store", daemon=True).start()
+        logging.info(f"Serving local store queries on http://{bind}:{port}/")
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        with self.lock:
+            for _, file, _ in self.current.values():
+                file.close()
+            self.current = {}
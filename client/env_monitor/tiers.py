@@ -0,0 +1,165 @@
+# @file: tiers.py
+# @brief: Rollups of readings into 1 minute, 1 hour and 1 day tiers for long range dashboards
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import json
+import logging
+import math
+import os
+import tempfile
+
+from .rolling import parse_windows
+
+# The tiers readings are rolled up into by default
+DEFAULT_TIERS = '1m,1h,1d'
+
+# The tag rollup points are written with, naming their tier
+TIER_TAG = 'tier'
+
+# The fields rolled up for each measurement. Rolling and burst statistics are
+# left out as they already summarise a window of readings
+TIER_FIELDS = {
+    'climate': ('temperature', 'humidity', 'pressure', 'gas', 'dew_point', 'absolute_humidity', 'iaq'),
+    'particles': ('pm2.5', 'pm10', 'aqi'),
+    'weather': ('temperature', 'humidity', 'pressure')
+}
+
+# The number of seconds of readings between saves of the partial rollups. Rollups
+# of an hour or more are also saved as soon as one is finished, so a restart
+# cannot write them again with only the readings taken since the last save
+SAVE_INTERVAL = 300
+
+def parse_tiers(spec):
+    # Like parse_windows, but an empty list or 'none' disables the tiers
+    if not spec or spec.strip().lower() == 'none':
+        return {}
+    return parse_windows(spec)
+
+class Bucket(object):
+
+    def __init__(self, start, stats=None):
+
+        # The start of the period the bucket covers, in nanoseconds since the epoch
+        self.start = start
+
+        # Each field's [count, total, min, max] so far
+        self.stats = stats or {}
+
+    def add(self, fields):
+        for name, value in fields.items():
+            stat = self.stats.get(name)
+            if stat is None:
+                self.stats[name] = [1, value, value, value]
+            else:
+                stat[0] += 1
+                stat[1] += value
+                stat[2] = min(stat[2], value)
+                stat[3] = max(stat[3], value)
+
+    def fields(self):
+        # Fields named <name>_<stat>, e.g. temperature_mean or pm2.5_count
+        fields = {}
+        for name, (count, total, low, high) in self.stats.items():
+            fields[f'{name}_mean'] = total / count
+            fields[f'{name}_min'] = float(low)
+            fields[f'{name}_max'] = float(high)
+            fields[f'{name}_count'] = count
+        return fields
+
+class RollupTiers(object):
+
+    def __init__(self, tiers=DEFAULT_TIERS, state_file=None):
+
+        # The tiers to roll readings up into, as {label: seconds}
+        self.tiers = parse_tiers(tiers)
+
+        # The file partial rollups are kept in across restarts
+        self.state_file = state_file
+
+        # The bucket being filled for each series and tier, keyed by
+        # (measurement, tags as JSON) and then by the tier label
+        self.buckets = {}
+
+        # The time of the last save of the partial rollups
+        self.saved_time = None
+
+        self._load()
+
+    def _load(self):
+        if not self.state_file or not self.tiers:
+            return
+        try:
+            with open(self.state_file, 'r') as file:
+                saved = json.load(file)
+            for series in saved:
+                key = (series['measurement'], series['tags'])
+                self.buckets[key] = {label: Bucket(bucket['start'], bucket['stats'])
+                                     for label, bucket in series['buckets'].items() if label in self.tiers}
+            logging.info(f"Loaded partial rollups of {len(self.buckets)} series")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable rollup state {self.state_file}: {e}")
+
+    def save(self):
+        if not self.state_file or not self.tiers:
+            return
+        saved = [{'measurement': measurement, 'tags': tags,
+                  'buckets': {label: {'start': bucket.start, 'stats': bucket.stats}
+                              for label, bucket in buckets.items()}}
+                 for (measurement, tags), buckets in self.buckets.items()]
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        try:
+            fd, path = tempfile.mkstemp(dir=directory, prefix='.tiers.')
+            with os.fdopen(fd, 'w') as file:
+                json.dump(saved, file)
+            os.replace(path, self.state_file)
+        except OSError as e:
+            logging.warning(f"Failed to write rollup state {self.state_file}: {e}")
+
+    def add(self, data):
+        # Add a reading to the rollups of its series, returning the points of any
+        # rollups its time finishes
+        names = TIER_FIELDS.get(data.get('measurement'))
+        if not self.tiers or not names or data.get('time') is None:
+            return []
+        fields = {}
+        for name in names:
+            value = data['fields'].get(name)
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+                fields[name] = value
+        if not fields:
+            return []
+
+        tags = data.get('tags') or {}
+        key = (data['measurement'], json.dumps(tags, sort_keys=True))
+        buckets = self.buckets.setdefault(key, {})
+        points = []
+        save = False
+        for label, seconds in self.tiers.items():
+            period = seconds * 10**9
+            start = data['time'] - data['time'] % period
+            bucket = buckets.get(label)
+            if bucket and bucket.start < start:
+                points.append({
+                    'measurement': f"{data['measurement']}_{label}",
+                    'fields': bucket.fields(),
+                    'tags': {**tags, TIER_TAG: label},
+                    'time': bucket.start
+                })
+                save = save or seconds >= SAVE_INTERVAL
+                bucket = None
+            if bucket is None:
+                # A reading older than the bucket being filled is added to it
+                bucket = buckets[label] = Bucket(start)
+            bucket.add(fields)
+
+        if self.saved_time is None:
+            self.saved_time = data['time']
+        if save or (data['time'] - self.saved_time) / 1e9 >= SAVE_INTERVAL:
+            self.save()
+            self.saved_time = data['time']
+        return points
+
+    def close(self):
+        self.save()
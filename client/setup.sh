@@ -29,9 +29,6 @@ sudo pip3 install adafruit-circuitpython-bme680 --break-system-packages
 # Install pyserial for SDS011 sensor
 sudo pip3 install pyserial --break-system-packages
 
-# Install memory-profiler for monitoring memory usage
-sudo pip3 install memory-profiler --break-system-packages
-
 # Install RichHandler for better logging output
 sudo pip3 install rich --break-system-packages
 
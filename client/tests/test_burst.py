@@ -0,0 +1,42 @@
+# @file: test_burst.py
+# @brief: Unit tests for the reduction of burst samples
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import unittest
+
+from env_monitor.burst import median_filter, reduce_samples, summary_fields
+
+class ReduceTest(unittest.TestCase):
+
+    def test_median_filter_drops_glitch(self):
+        self.assertEqual(median_filter([5, 5, 90, 5, 5], 5), [5, 5, 5, 5, 5])
+
+    def test_short_spike_kept(self):
+        # A 2 second dust burst in a minute of 1 second samples
+        values = [5.0] * 30 + [80.0, 85.0] + [5.0] * 28
+        summary = reduce_samples(values)
+        self.assertEqual(summary['max'], 85.0)
+        self.assertEqual(summary['spikes'], 1)
+        self.assertEqual(summary['mean'], 5.0)
+        self.assertEqual(summary['median'], 5.0)
+
+    def test_separate_spikes_counted(self):
+        values = [10.0] * 10 + [50.0] + [10.0] * 10 + [60.0, 60.0, 60.0] + [10.0] * 10
+        self.assertEqual(reduce_samples(values)['spikes'], 2)
+
+    def test_steady_baseline(self):
+        summary = reduce_samples([20.0, 20.5, 19.5, 20.0, 21.0, 20.0])
+        self.assertEqual(summary['spikes'], 0)
+        self.assertEqual((summary['min'], summary['max']), (19.5, 21.0))
+
+    def test_integers_stay_integers(self):
+        summary = reduce_samples([50000, 50010, 49990, 50003])
+        self.assertTrue(all(isinstance(value, int) for value in summary.values()))
+
+    def test_summary_fields(self):
+        fields = summary_fields({'pm10': reduce_samples([1.0, 2.0, 3.0])}, 3)
+        self.assertEqual(fields['samples'], 3)
+        self.assertEqual(set(fields), {'samples', 'pm10_min', 'pm10_max', 'pm10_median', 'pm10_spikes'})
+
+if __name__ == '__main__':
+    unittest.main()
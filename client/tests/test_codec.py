@@ -0,0 +1,75 @@
+# @file: test_codec.py
+# @brief: Unit tests for the binary encoding of cached readings
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import unittest
+
+from env_monitor import codec
+
+RECORDS = [
+    {'measurement': 'climate', 'fields': {'temperature': 21.5, 'humidity': 40.0, 'gas': 51234},
+     'tags': {'location': 'workshop'}, 'time': 1700000000000000000},
+    {'measurement': 'climate', 'fields': {'temperature': 21.6, 'humidity': 40.5, 'gas': 51200},
+     'tags': {'location': 'workshop'}, 'time': 1700000060000000000},
+    {'measurement': 'motion', 'fields': {'detected': True, 'label': 'door', 'extra': None},
+     'tags': {}, 'time': None},
+    {'measurement': 'particles', 'fields': {'pm2.5': 3.2, 'big': 2 ** 70}, 'tags': {}, 'time': 1},
+    ['not', 'a', 'point']
+]
+
+def encode(records):
+    encoder = codec.Encoder()
+    return codec.MAGIC + b''.join(encoder.encode(record) for record in records)
+
+class CodecTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        data = encode(RECORDS)
+        records, offset = codec.Decoder().decode(data, len(codec.MAGIC))
+        self.assertEqual(records, RECORDS)
+        self.assertEqual(offset, len(data))
+
+    def test_schema_written_once_per_shape(self):
+        one = len(encode(RECORDS[:1]))
+        two = len(encode(RECORDS[:2]))
+        self.assertLess(two - one, one - len(codec.MAGIC))
+
+    def test_skip_and_times(self):
+        data = encode(RECORDS)
+        self.assertEqual(list(codec.Decoder().iterate(data, len(codec.MAGIC), skip=3)), RECORDS[3:])
+        times = list(codec.Decoder().iterate(data, len(codec.MAGIC), times=True))
+        self.assertEqual(times[:4], [record['time'] for record in RECORDS[:4]])
+
+    def test_torn_tail(self):
+        data = encode(RECORDS[:2])
+        whole = len(encode(RECORDS[:1]))
+        for cut in range(whole + 1, len(data)):
+            records, offset = codec.Decoder().decode(data[:cut], len(codec.MAGIC))
+            self.assertEqual(records, RECORDS[:1])
+            self.assertEqual(offset, whole)
+
+    def test_corrupt_frame(self):
+        data = bytearray(encode(RECORDS[:2]))
+        data[-5] ^= 0xff
+        records, offset = codec.Decoder().decode(bytes(data), len(codec.MAGIC))
+        self.assertEqual(records, RECORDS[:1])
+        self.assertEqual(offset, len(encode(RECORDS[:1])))
+
+    def test_compressed_block(self):
+        data = encode(RECORDS * 20)
+        compressed = codec.compress(data)
+        self.assertLess(len(compressed), len(data))
+        records, offset = codec.Decoder().decode(compressed, len(codec.MAGIC))
+        self.assertEqual(records, RECORDS * 20)
+        self.assertEqual(offset, len(compressed))
+        self.assertEqual(list(codec.Decoder().iterate(compressed, len(codec.MAGIC), skip=95)), RECORDS)
+
+    def test_inflate(self):
+        data = encode(RECORDS)
+        self.assertEqual(codec.inflate(codec.compress(data)), data)
+        self.assertEqual(codec.inflate(data), data)
+        torn = codec.compress(data)[:-1]
+        self.assertEqual(codec.inflate(torn), torn)
+
+if __name__ == '__main__':
+    unittest.main()
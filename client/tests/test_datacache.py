@@ -0,0 +1,107 @@
+# @file: test_datacache.py
+# @brief: Unit tests for the cache caps and retention policies
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import collections
+import shutil
+import tempfile
+import unittest
+
+from env_monitor.clock import now_ns
+from env_monitor.datacache import DataCache, DOWNSAMPLE, DROP, ROLLUP_PERIOD, ROLLUP_TAG
+
+MINUTE = 60 * 10**9
+START = 1000 * ROLLUP_PERIOD
+
+def reading(minute, measurement='climate', value=None):
+    return {'measurement': measurement, 'fields': {'temperature': float(minute if value is None else value)},
+            'tags': {'location': 'workshop'}, 'time': START + minute * MINUTE}
+
+class DataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.dir)
+
+    def cache(self, **options):
+        cache = DataCache(f"{self.dir}/cache.json", **options)
+        self.caches.append(cache)
+        return cache
+
+    def cached(self, cache):
+        records, _ = cache._window(len(cache))
+        return records
+
+    def test_round_trip_across_restart(self):
+        cache = self.cache()
+        cache.extend([reading(minute) for minute in range(10)])
+        cache.close()
+        self.assertEqual(self.cached(self.cache()), [reading(minute) for minute in range(10)])
+
+    def test_flush_acknowledges(self):
+        cache = self.cache()
+        cache.extend([reading(minute) for minute in range(25)])
+        written = []
+        cache.flush(10, written.extend)
+        self.assertEqual(written, [reading(minute) for minute in range(25)])
+        self.assertEqual(len(cache), 0)
+        cache.close()
+        self.assertEqual(len(self.cache()), 0)
+
+    def test_failed_flush_keeps_readings(self):
+        cache = self.cache()
+        cache.extend([reading(minute) for minute in range(5)])
+
+        def fail(records):
+            raise OSError("unreachable")
+
+        cache.flush(10, fail)
+        self.assertEqual(len(cache), 5)
+
+    def test_drop_oldest_over_item_cap(self):
+        cache = self.cache(max_items=50, retention=DROP)
+        for minute in range(200):
+            cache.extend([reading(minute)])
+        records = self.cached(cache)
+        self.assertLessEqual(len(records), 50)
+        self.assertEqual(records, [reading(minute) for minute in range(200 - len(records), 200)])
+        self.assertEqual(cache.retired, 200 - len(records))
+
+    def test_downsample_one_summary_per_hour(self):
+        cache = self.cache(max_items=50, retention=DOWNSAMPLE)
+        for minute in range(200):
+            cache.extend([reading(minute), reading(minute, 'particles', 1)])
+        records = self.cached(cache)
+        summaries = [record for record in records if ROLLUP_TAG in record['tags']]
+        readings = [record for record in records if ROLLUP_TAG not in record['tags']]
+        self.assertLessEqual(len(records), 50)
+
+        # Every reading is either still cached or counted by one summary of its hour
+        keys = collections.Counter((record['measurement'], record['time']) for record in summaries)
+        self.assertEqual(set(keys.values()), {1})
+        self.assertEqual(sum(summary['fields']['samples'] for summary in summaries) + len(readings), 400)
+        for summary in summaries:
+            self.assertEqual(summary['time'] % ROLLUP_PERIOD, 0)
+            self.assertEqual(summary['fields']['samples'], 60)
+            if summary['measurement'] == 'climate':
+                first = (summary['time'] - START) // MINUTE
+                self.assertEqual(summary['fields']['temperature'], first + 29.5)
+        self.assertEqual(min(record['time'] for record in readings), START + 3 * 60 * MINUTE)
+
+    def test_age_cap(self):
+        # Readings from long ago are retired a segment at a time, leaving the current one
+        cache = self.cache(max_age=3600, segment_size=200)
+        cache.extend([reading(minute) for minute in range(20)])
+        current = {**reading(0), 'time': now_ns()}
+        cache.extend([current])
+        self.assertEqual(self.cached(cache)[-1], current)
+        self.assertLess(len(cache), 21)
+        self.assertEqual(cache.retired, 21 - len(cache))
+
+if __name__ == '__main__':
+    unittest.main()
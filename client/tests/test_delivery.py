@@ -0,0 +1,158 @@
+# @file: test_delivery.py
+# @brief: Unit tests for the retry and circuit breaker policy
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import unittest
+
+from env_monitor.delivery import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, DeliveryError, retryable
+from env_monitor.gateway import GatewayClient
+
+class Clock(object):
+
+    # A monotonic clock moved forward by the test
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, max_reset_timeout=35, clock=self.clock)
+
+    def trip(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertTrue(self.breaker.is_open())
+        self.assertEqual(self.breaker.trips, 1)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_one_trial_after_timeout(self):
+        self.trip()
+        self.clock.now = 9.9
+        self.assertFalse(self.breaker.available())
+        self.clock.now = 10
+        self.assertTrue(self.breaker.available())
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertFalse(self.breaker.available())
+
+    def test_trial_success_closes(self):
+        self.trip()
+        self.clock.now = 10
+        self.breaker.allow()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_trial_failure_doubles_timeout(self):
+        self.trip()
+        for timeout in (20, 35, 35):
+            self.clock.now += self.breaker.timeout
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.state, OPEN)
+            self.assertEqual(self.breaker.timeout, timeout)
+        self.assertEqual(self.breaker.trips, 1)
+        self.clock.now += 35
+        self.breaker.allow()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.timeout, 10)
+
+class RetryableTest(unittest.TestCase):
+
+    def test_statuses(self):
+        self.assertTrue(retryable(DeliveryError('busy', 503)))
+        self.assertTrue(retryable(DeliveryError('slow down', 429)))
+        self.assertFalse(retryable(DeliveryError('bad point', 400)))
+        self.assertFalse(retryable(DeliveryError('bad point', 422)))
+
+    def test_errors(self):
+        self.assertTrue(retryable(TimeoutError()))
+        self.assertTrue(retryable(ConnectionRefusedError()))
+        self.assertFalse(retryable(ValueError('no fields')))
+        self.assertFalse(retryable(TypeError()))
+
+class Client(GatewayClient):
+
+    # Fails each send with the next of the given errors, then records what is sent
+
+    def __init__(self, *errors):
+        super().__init__('http://127.0.0.1:9', 'node', retries=1, retry_delay=0)
+        self.errors = list(errors)
+        self.sent = []
+
+    def _send(self, encoded):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.extend(record for record, _ in encoded)
+
+POINTS = [{'measurement': 'climate', 'fields': {'temperature': 21.5}, 'tags': {}, 'time': 1},
+          {'measurement': 'climate', 'fields': {'temperature': 21.6}, 'tags': {}, 'time': 2}]
+
+class DeliverTest(unittest.TestCase):
+
+    def test_retried_until_written(self):
+        client = Client(TimeoutError())
+        client._deliver(POINTS)
+        self.assertEqual(client.sent, POINTS)
+        self.assertEqual(client.retried, 1)
+        self.assertEqual(client.breaker.failures, 0)
+
+    def test_refused_points_dropped(self):
+        client = Client(DeliveryError('bad point', 400))
+        client._deliver(POINTS)
+        self.assertEqual(client.sent, [])
+        self.assertEqual(client.rejected, 2)
+        self.assertEqual(client.retried, 0)
+        self.assertEqual(client.breaker.state, CLOSED)
+
+    def test_unencodable_point_counted_once(self):
+        client = Client(DeliveryError('bad point', 400))
+        client._deliver(POINTS + [{'measurement': 'climate', 'fields': {'temperature': object()}, 'tags': {}, 'time': 3}])
+        self.assertEqual(client.rejected, 3)
+
+    def test_unencodable_point_skipped(self):
+        client = Client()
+        client._deliver(POINTS + [{'measurement': 'climate', 'fields': {'temperature': object()}, 'tags': {}, 'time': 3}])
+        self.assertEqual(client.sent, POINTS)
+        self.assertEqual(client.rejected, 1)
+
+    def test_other_errors_keep_points(self):
+        for error in (ImportError('no client library'), KeyError('bucket')):
+            client = Client(error)
+            with self.assertRaises(type(error)):
+                client._deliver(POINTS)
+            self.assertEqual(client.retried, 0)
+            self.assertEqual(client.rejected, 0)
+            self.assertEqual(client.breaker.failures, 1)
+
+    def test_retries_exhausted(self):
+        client = Client(DeliveryError('busy', 503), DeliveryError('busy', 503))
+        with self.assertRaises(DeliveryError):
+            client._deliver(POINTS)
+        self.assertEqual(client.retried, 1)
+        self.assertEqual(client.breaker.failures, 1)
+
+if __name__ == '__main__':
+    unittest.main()
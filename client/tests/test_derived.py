@@ -0,0 +1,63 @@
+# @file: test_derived.py
+# @brief: Unit tests for the metrics derived on the node
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import unittest
+
+from env_monitor.derived import (IAQ, PM10_BREAKPOINTS, PM25_BREAKPOINTS, DerivedMetrics, absolute_humidity,
+                                 aqi, aqi_index, dew_point)
+
+MINUTE = 60 * 10**9
+START = 1700000000 * 10**9
+
+class AQITest(unittest.TestCase):
+
+    def test_pm25_breakpoints(self):
+        for concentration, index in ((0, 0), (9.0, 50), (9.09, 50), (9.1, 51), (12.0, 56), (35.4, 100),
+                                     (35.5, 101), (55.4, 150), (125.5, 201), (325.4, 500), (400, 500)):
+            self.assertEqual(aqi_index(concentration, PM25_BREAKPOINTS, 1), index, concentration)
+
+    def test_pm10_breakpoints(self):
+        for concentration, index in ((54, 50), (54.9, 50), (55, 51), (154, 100), (155, 101), (604, 500), (700, 500)):
+            self.assertEqual(aqi_index(concentration, PM10_BREAKPOINTS, 0), index, concentration)
+
+    def test_worst_pollutant(self):
+        self.assertEqual(aqi(12.0, 160), (103, 56, 103))
+        self.assertEqual(aqi(-1, 0), (0, 0, 0))
+
+class HumidityTest(unittest.TestCase):
+
+    def test_dew_point(self):
+        self.assertAlmostEqual(dew_point(20, 50), 9.26, places=1)
+        self.assertAlmostEqual(dew_point(25, 100), 25, places=6)
+
+    def test_absolute_humidity(self):
+        self.assertAlmostEqual(absolute_humidity(20, 50), 8.63, places=1)
+
+class IAQTest(unittest.TestCase):
+
+    def test_reported_after_burn_in(self):
+        iaq = IAQ(burn_in=1800)
+        indexes = [iaq.index(50000, 40.0, START + minute * MINUTE) for minute in range(31)]
+        self.assertEqual(indexes[:30], [None] * 30)
+        self.assertEqual(indexes[30], 0.0)
+
+    def test_lower_gas_resistance_is_worse(self):
+        iaq = IAQ(burn_in=0)
+        iaq.index(50000, 40.0, START)
+        clean = iaq.index(50000, 40.0, START + MINUTE)
+        polluted = iaq.index(25000, 40.0, START + 2 * MINUTE)
+        self.assertLess(clean, polluted)
+        self.assertGreater(iaq.baseline, 45000)
+
+    def test_derived_fields(self):
+        metrics = DerivedMetrics()
+        climate = metrics.add({'measurement': 'climate', 'time': 0,
+                               'fields': {'temperature': 68.0, 'humidity': 50.0, 'gas': 50000}})
+        self.assertAlmostEqual(climate['fields']['dew_point'], 48.7, places=0)
+        self.assertNotIn('iaq', climate['fields'])
+        particles = metrics.add({'measurement': 'particles', 'time': 0, 'fields': {'pm2.5': 12.0, 'pm10': 20}})
+        self.assertEqual(particles['fields']['aqi'], 56)
+
+if __name__ == '__main__':
+    unittest.main()
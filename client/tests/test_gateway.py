@@ -0,0 +1,76 @@
+# @file: test_gateway.py
+# @brief: Unit tests for the points the gateway accepts from nodes
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from env_monitor.gateway import Gateway
+
+SERVER_CONFIG = '''SERVER_IP=127.0.0.1
+INFLUXDB_PORT=9
+INFLUXDB_ADMIN_TOKEN=token
+INFLUXDB_ORG=org
+INFLUXDB_BUCKET=bucket
+'''
+
+def point(time, value=20.0, **tags):
+    return {'measurement': 'climate', 'fields': {'temperature': value}, 'tags': tags, 'time': time}
+
+class GatewayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        config = os.path.join(self.dir, 'server.env')
+        with open(config, 'w') as file:
+            file.write(SERVER_CONFIG)
+        self.gateway = Gateway(config, cache_file=os.path.join(self.dir, 'cache.json'),
+                               influx_flush_interval=3600, influx_retries=0, dedupe_size=3)
+
+    def tearDown(self):
+        self.gateway.influx.close()
+        self.gateway.data_cache.close()
+        shutil.rmtree(self.dir)
+
+    def cached(self):
+        records, _ = self.gateway.data_cache._window(len(self.gateway.data_cache))
+        return records
+
+    def test_points_tagged_with_node(self):
+        self.assertEqual(self.gateway.receive([point(1), point(2, node='bench')], 'workshop'), 2)
+        self.assertEqual([record['tags'] for record in self.cached()], [{'node': 'workshop'}, {'node': 'bench'}])
+
+    def test_resent_points_dropped(self):
+        self.gateway.receive([point(1), point(2)], 'workshop')
+        self.assertEqual(self.gateway.receive([point(2), point(3), point(3)], 'workshop'), 1)
+        self.assertEqual(self.gateway.duplicates, 2)
+        self.assertEqual([record['time'] for record in self.cached()], [1, 2, 3])
+
+        # The same time from another node is not a duplicate
+        self.assertEqual(self.gateway.receive([point(3)], 'door'), 1)
+
+    def test_oldest_points_forgotten(self):
+        self.gateway.receive([point(time) for time in range(1, 5)], 'workshop')
+        self.assertEqual(self.gateway.receive([point(1), point(4)], 'workshop'), 1)
+
+    def test_points_without_time_are_not_duplicates(self):
+        self.assertEqual(self.gateway.receive([point(None), point(None)], 'workshop'), 2)
+        self.assertTrue(all(isinstance(record['time'], int) for record in self.cached()))
+
+    def test_malformed_points_dropped(self):
+        points = [None, [], {'measurement': 'climate'}, {'measurement': 'climate', 'fields': {}},
+                  {**point(1), 'time': 'now'}, {**point(1), 'tags': ['node']}, point(1)]
+        self.assertEqual(self.gateway.receive(points, 'workshop'), 1)
+        self.assertEqual(self.gateway.malformed, 6)
+
+    def test_points_not_saved_are_not_remembered(self):
+        self.gateway.influx.queue = lambda records: False
+        with self.assertRaises(OSError):
+            self.gateway.receive([point(1)], 'workshop')
+        del self.gateway.influx.queue
+        self.assertEqual(self.gateway.receive([point(1)], 'workshop'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
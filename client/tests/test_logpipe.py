@@ -0,0 +1,58 @@
+# @file: test_logpipe.py
+# @brief: Unit tests for the queued, rate limited logging pipeline
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import logging
+import threading
+import unittest
+
+from env_monitor.logpipe import Lazy, start_logging, stop_logging
+
+class Collect(logging.Handler):
+
+    # Keeps the messages it is given, formatted on the thread that handles them
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+class LogPipeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handlers = logging.getLogger().handlers
+        self.level = logging.getLogger().level
+        self.collect = Collect()
+
+    def tearDown(self):
+        stop_logging()
+        logging.getLogger().handlers = self.handlers
+        logging.getLogger().setLevel(self.level)
+
+    def test_formatted_off_the_calling_thread(self):
+        start_logging([self.collect], logging.INFO)
+        logging.info("thread %s", Lazy(lambda: threading.current_thread().name))
+        stop_logging()
+        self.assertEqual(len(self.collect.messages), 1)
+        self.assertNotEqual(self.collect.messages[0], f"thread {threading.current_thread().name}")
+
+    def test_arguments_logged_as_they_were(self):
+        start_logging([self.collect], logging.INFO)
+        fields = {'pm10': 1}
+        logging.info("fields %s", fields)
+        fields['pm10'] = 2
+        stop_logging()
+        self.assertEqual(self.collect.messages, ["fields {'pm10': 1}"])
+
+    def test_rate_limit(self):
+        start_logging([self.collect], logging.INFO, rate_limit=300)
+        for sample in range(3):
+            logging.info("sample %s", sample)
+            logging.warning("warning %s", sample)
+        stop_logging()
+        self.assertEqual(self.collect.messages, ["sample 0", "warning 0", "warning 1", "warning 2"])
+
+if __name__ == '__main__':
+    unittest.main()
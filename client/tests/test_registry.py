@@ -0,0 +1,62 @@
+# @file: test_registry.py
+# @brief: Unit tests for the sensor registry
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import os
+import subprocess
+import sys
+import unittest
+
+from env_monitor.sensors.registry import HARDWARE, SYNTHETIC, Source, accepted, build_sources, load_driver
+
+class Driver(object):
+
+    def __init__(self, sample_period=60, device=None):
+        self.sample_period = sample_period
+        self.device = device
+
+class RegistryTest(unittest.TestCase):
+
+    def test_instances_named_and_tagged(self):
+        sources = build_sources([
+            {'type': 'sds011', 'serial_device': '/dev/ttyUSB0'},
+            {'type': 'sds011', 'serial_device': '/dev/ttyUSB1', 'tags': {'bench': 'saw'}},
+            {'type': 'sds011', 'name': 'sds011_door', 'interval': 10},
+            {'type': 'pir', 'enabled': False}
+        ], interval=60, backends={'sds011': SYNTHETIC})
+        self.assertEqual([source.name for source in sources], ['sds011', 'sds011_2', 'sds011_door'])
+        self.assertEqual(sources[0].tags, {})
+        self.assertEqual(sources[1].tags, {'bench': 'saw', 'instance': 'sds011_2'})
+        self.assertEqual(sources[1].options, {'serial_device': '/dev/ttyUSB1'})
+        self.assertEqual([source.interval for source in sources], [60, 60, 10])
+        self.assertEqual({source.backend for source in sources}, {SYNTHETIC})
+
+    def test_duplicate_names(self):
+        with self.assertRaises(ValueError):
+            build_sources([{'type': 'pir', 'name': 'door'}, {'type': 'sds011', 'name': 'door'}])
+
+    def test_unknown_driver(self):
+        with self.assertRaises(ValueError):
+            load_driver('scd41')
+        self.assertFalse(Source('scd41', 'scd41').callibrated)
+
+    def test_accepted_defaults(self):
+        defaults = {'sample_period': 30, 'windows': None, 'device': 'device'}
+        self.assertEqual(accepted(Driver, defaults), {'sample_period': 30, 'device': 'device'})
+
+    def test_callibrated_before_set_up(self):
+        source = Source('bme680', 'bme680', backend=HARDWARE)
+        self.assertTrue(source.callibrated)
+        self.assertIsNone(source.sensor)
+        self.assertFalse(Source('pir', 'pir').callibrated)
+
+    def test_registry_does_not_import_drivers(self):
+        # Checked in a new interpreter, as other tests import the drivers
+        modules = subprocess.run([sys.executable, '-c', 'import sys, env_monitor.sensors.registry; print(*sys.modules)'],
+                                 cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 capture_output=True, text=True, check=True).stdout.split()
+        for module in ('simulated', 'bme680', 'sds011', 'pir'):
+            self.assertNotIn(f'env_monitor.sensors.{module}', modules)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# @file: test_rolling.py
+# @brief: Unit tests checking sliding window statistics against a batch calculation
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import random
+import unittest
+
+from env_monitor.rolling import RollingStats, RollingWindow, parse_windows, summarize
+
+SECOND = 10**9
+
+class RollingWindowTest(unittest.TestCase):
+
+    def check(self, window, samples, now):
+        # The window's statistics match a batch calculation over the samples still in it
+        expected = summarize([value for time, value in samples if now - time < window.span_ns][-window.capacity:])
+        summary = window.summary()
+        self.assertEqual(set(summary), set(expected))
+        for stat, value in expected.items():
+            self.assertAlmostEqual(summary[stat], value, places=9, msg=stat)
+
+    def run_samples(self, window, samples):
+        for index, (time, value) in enumerate(samples):
+            window.add(time, value)
+            self.check(window, samples[:index + 1], time)
+
+    def test_matches_batch_with_time_evictions(self):
+        rng = random.Random(1)
+        time = 0
+        samples = []
+        for _ in range(500):
+            time += rng.randint(1, 20) * SECOND
+            samples.append((time, rng.gauss(20, 5)))
+        self.run_samples(RollingWindow(60, 100), samples)
+
+    def test_matches_batch_with_capacity_evictions(self):
+        rng = random.Random(2)
+        samples = [(index * SECOND, rng.uniform(0, 100)) for index in range(300)]
+        self.run_samples(RollingWindow(3600, 7), samples)
+
+    def test_ties_for_min_and_max(self):
+        rng = random.Random(3)
+        samples = [(index * SECOND, float(rng.choice([1, 2, 2, 3, 3]))) for index in range(200)]
+        self.run_samples(RollingWindow(5, 10), samples)
+        self.run_samples(RollingWindow(3600, 4), samples)
+
+    def test_expired_window_is_empty(self):
+        window = RollingWindow(10, 5)
+        window.add(0, 1.0)
+        window.expire(10 * SECOND)
+        self.assertEqual(window.summary(), {})
+        self.assertIsNone(window.mean())
+
+class RollingStatsTest(unittest.TestCase):
+
+    def test_field_names(self):
+        stats = RollingStats(['pm10'], parse_windows('1m,1h'), sample_period=10)
+        stats.add(0, {'pm10': 4.0})
+        stats.add(10 * SECOND, {'pm10': 6.0})
+        fields = stats.fields()
+        self.assertEqual(fields['pm10_ave_1m'], 5.0)
+        self.assertEqual(fields['pm10_max_1h'], 6.0)
+        self.assertEqual(fields['pm10_p50_1m'], 5.0)
+        self.assertEqual(fields['pm10_ave'], 5.0)
+
+    def test_parse_windows(self):
+        self.assertEqual(parse_windows('15m, 1h,2d'), {'15m': 900, '1h': 3600, '2d': 172800})
+        with self.assertRaises(ValueError):
+            parse_windows('15 minutes')
+
+if __name__ == '__main__':
+    unittest.main()
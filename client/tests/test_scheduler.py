@@ -0,0 +1,87 @@
+# @file: test_scheduler.py
+# @brief: Unit tests for the deadline based scheduler
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import unittest
+
+from env_monitor.scheduler import CATCH_UP, SKIP, Scheduler
+
+class Clock(object):
+
+    # A monotonic clock moved forward by the test
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.scheduler = Scheduler(clock=self.clock)
+
+    def due(self):
+        return [(job.name, deadline) for job, deadline in self.scheduler.due()]
+
+    def test_each_job_at_its_interval(self):
+        self.scheduler.add('sensors', 'sensors', 60)
+        self.scheduler.add('wifi', 'wifi', 30, offset=5)
+        self.scheduler.start()
+        self.assertEqual(self.due(), [('sensors', 100.0)])
+        self.assertEqual(self.scheduler.next_deadline(), 105.0)
+        seen = []
+        for second in range(1, 121):
+            self.clock.now = 100.0 + second
+            seen.extend(self.due())
+        self.assertEqual(seen, [('wifi', 105.0), ('wifi', 135.0), ('sensors', 160.0),
+                                ('wifi', 165.0), ('wifi', 195.0), ('sensors', 220.0)])
+
+    def test_deadlines_do_not_drift(self):
+        job = self.scheduler.add('sensors', 'sensors', 60)
+        self.scheduler.start()
+        self.scheduler.due()
+        # Run late every time, the next deadline stays on the original grid
+        for late in (160.7, 221.3, 280.1):
+            self.clock.now = late
+            self.assertEqual(len(self.due()), 1)
+        self.assertEqual(job.deadline, 340.0)
+        self.assertEqual(job.skipped, 0)
+
+    def test_skip_runs_once(self):
+        job = self.scheduler.add('sensors', 'sensors', 10, policy=SKIP)
+        self.scheduler.start()
+        self.scheduler.due()
+        self.clock.now = 145.0
+        self.assertEqual(self.due(), [('sensors', 140.0)])
+        self.assertEqual(job.skipped, 3)
+        self.assertEqual(job.deadline, 150.0)
+
+    def test_catch_up_runs_missed_ticks(self):
+        job = self.scheduler.add('sensors', 'sensors', 10, policy=CATCH_UP)
+        self.scheduler.start()
+        self.scheduler.due()
+        self.clock.now = 145.0
+        self.assertEqual(self.due(), [('sensors', 110.0), ('sensors', 120.0), ('sensors', 130.0), ('sensors', 140.0)])
+        self.assertEqual(job.skipped, 0)
+        self.assertEqual(job.deadline, 150.0)
+
+    def test_catch_up_is_capped(self):
+        job = self.scheduler.add('sensors', 'sensors', 1, policy=CATCH_UP)
+        self.scheduler.start()
+        self.scheduler.due()
+        self.clock.now = 200.5
+        ticks = self.due()
+        self.assertEqual(len(ticks), job.max_catch_up + 1)
+        self.assertEqual(ticks[-1], ('sensors', 200.0))
+        self.assertEqual(job.skipped, 100 - len(ticks))
+
+    def test_job_added_after_start(self):
+        self.scheduler.start()
+        self.clock.now = 150.0
+        self.scheduler.add('health', 'health', 60, offset=10)
+        self.assertEqual(self.due(), [('health', 110.0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# @file: test_sds011.py
+# @brief: Unit tests for the SDS011 data frame parser
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import unittest
+
+from env_monitor.sensors.sds011 import FRAME_HEADER, FRAME_TAIL, SDS011
+
+def frame(pm_small, pm_large, sensor_id=b'\x12\x34'):
+    data = round(pm_small * 10).to_bytes(2, 'little') + round(pm_large * 10).to_bytes(2, 'little') + sensor_id
+    return FRAME_HEADER + data + bytes([sum(data) & 0xff, FRAME_TAIL])
+
+class Serial(object):
+
+    # Stands in for the serial port, giving back chunks of bytes one read at a time
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+        self.written = []
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def reset_input_buffer(self):
+        pass
+
+    def write(self, data):
+        self.written.append(data)
+
+    def flush(self):
+        pass
+
+class ParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sensor = SDS011(device=Serial())
+
+    def test_valid_frame(self):
+        self.assertEqual(self.sensor._parse(frame(12.3, 45.6)), ((12.3, 45.6), b''))
+
+    def test_newest_reading(self):
+        self.assertEqual(self.sensor._parse(frame(1, 2) + frame(3, 4))[0], (3, 4))
+
+    def test_partial_frame_kept(self):
+        data = frame(1, 2) + frame(3, 4)[:6]
+        self.assertEqual(self.sensor._parse(data), ((1, 2), frame(3, 4)[:6]))
+
+    def test_leading_noise(self):
+        self.assertEqual(self.sensor._parse(b'\x00\xc0\xaa' + frame(5, 6))[0], (5, 6))
+
+    def test_bad_checksum(self):
+        data = bytearray(frame(7, 8))
+        data[8] ^= 0xff
+        self.assertEqual(self.sensor._parse(bytes(data)), (None, b'\xab'))
+
+    def test_bad_tail(self):
+        data = bytearray(frame(7, 8))
+        data[9] = 0
+        self.assertIsNone(self.sensor._parse(bytes(data) + frame(9, 10)[:4])[0])
+
+    def test_no_header(self):
+        self.assertEqual(self.sensor._parse(b'\x01\x02\xaa'), (None, b'\xaa'))
+
+class ReadTest(unittest.TestCase):
+
+    def test_frame_split_across_reads(self):
+        data = frame(20.1, 30.2)
+        sensor = SDS011(device=Serial(b'\x00' + data[:4], data[4:]))
+        self.assertEqual(sensor.read(), {'pm2.5': 20.1, 'pm10': 30.2})
+
+    def test_no_frame(self):
+        sensor = SDS011(device=Serial(b'\x00\x01'), read_timeout=0.05)
+        self.assertIsNone(sensor.read())
+
+if __name__ == '__main__':
+    unittest.main()
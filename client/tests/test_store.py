@@ -0,0 +1,95 @@
+# @file: test_store.py
+# @brief: Unit tests for the local time series store on the node
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from env_monitor.clock import now_ns
+from env_monitor.store import PARTITION, SUFFIX, LocalStore, parse_duration
+
+MINUTE = 60 * 10**9
+
+def reading(time, value, measurement='climate', location='workshop'):
+    return {'measurement': measurement, 'fields': {'temperature': value},
+            'tags': {'location': location}, 'time': time}
+
+class LocalStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.start = now_ns() // PARTITION * PARTITION - 3 * PARTITION
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.dir)
+
+    def store(self):
+        store = LocalStore(self.dir)
+        self.stores.append(store)
+        return store
+
+    def test_range_across_hours(self):
+        store = self.store()
+        for minute in range(0, 180, 10):
+            store.append(reading(self.start + minute * MINUTE, float(minute)))
+        records = store.range('climate', self.start + 50 * MINUTE, self.start + 130 * MINUTE)
+        self.assertEqual([record['fields']['temperature'] for record in records], [50.0 + 10 * i for i in range(9)])
+
+        buckets = store.range('climate', self.start, self.start + 180 * MINUTE, every=PARTITION)
+        self.assertEqual([bucket['fields']['temperature_count'] for bucket in buckets], [6, 6, 6])
+        self.assertEqual(buckets[1]['fields']['temperature_mean'], 85.0)
+
+    def test_range_does_not_hold_up_append(self):
+        store = self.store()
+        for minute in range(0, 120, 10):
+            store.append(reading(self.start + minute * MINUTE, float(minute)))
+        read = store._read
+        reading_hour = threading.Event()
+        appended = threading.Event()
+
+        def slow_read(measurement, start):
+            reading_hour.set()
+            appended.wait(5)
+            return read(measurement, start)
+
+        store._read = slow_read
+        query = threading.Thread(target=store.range, args=('climate', self.start, self.start + PARTITION))
+        query.start()
+        reading_hour.wait(5)
+        writer = threading.Thread(target=store.append, args=(reading(self.start + 115 * MINUTE, 1.0),))
+        writer.start()
+        writer.join(2)
+        appended.set()
+        query.join()
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(store.latest_values()[0]['time'], self.start + 115 * MINUTE)
+
+    def test_latest_after_restart(self):
+        store = self.store()
+        store.append(reading(self.start, 1.0, location='door'))
+        store.append(reading(self.start + PARTITION, 2.0))
+        store.append(reading(self.start + 2 * PARTITION, 3.0, 'particles'))
+        store.close()
+
+        # An hour file left empty when the monitor stopped straight after starting
+        open(os.path.join(self.dir, 'climate', f'{self.start + 2 * PARTITION}{SUFFIX}'), 'wb').close()
+        latest = self.store().latest_values()
+        self.assertEqual([(record['measurement'], record['fields']['temperature']) for record in latest],
+                         [('climate', 2.0), ('particles', 3.0)])
+
+    def test_query_errors(self):
+        store = self.store()
+        self.assertEqual(store.query('/range', {})[0], 400)
+        self.assertEqual(store.query('/range', {'measurement': ['climate'], 'every': ['0m']})[0], 400)
+        self.assertEqual(store.query('/range', {'measurement': ['climate'], 'limit': ['0']})[0], 400)
+        self.assertEqual(store.query('/unknown', {})[0], 404)
+        self.assertEqual(parse_duration('15m'), 900 * 10**9)
+
+if __name__ == '__main__':
+    unittest.main()
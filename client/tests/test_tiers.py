@@ -0,0 +1,86 @@
+# @file: test_tiers.py
+# @brief: Unit tests for the rollup tiers
+# @author: Alister Lewis-Bowen <alister@lewis-bowen.org>
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from env_monitor.tiers import TIER_TAG, RollupTiers, parse_tiers
+
+SECOND = 10**9
+DAY = 86400 * SECOND
+START = 20000 * DAY
+
+def reading(seconds, temperature, measurement='climate'):
+    return {'measurement': measurement, 'fields': {'temperature': temperature, 'temperature_ave_15m': 0.0},
+            'tags': {'location': 'workshop'}, 'time': START + seconds * SECOND}
+
+class RollupTiersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.dir, 'rollups.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_minute_rollups(self):
+        tiers = RollupTiers('1m,1h')
+        points = []
+        for seconds in range(0, 180, 10):
+            points.extend(tiers.add(reading(seconds, float(seconds))))
+        self.assertEqual([point['time'] for point in points], [START, START + 60 * SECOND])
+        first = points[0]
+        self.assertEqual(first['measurement'], 'climate_1m')
+        self.assertEqual(first['tags'], {'location': 'workshop', TIER_TAG: '1m'})
+        self.assertEqual(first['fields'], {'temperature_mean': 25.0, 'temperature_min': 0.0,
+                                           'temperature_max': 50.0, 'temperature_count': 6})
+
+    def test_hour_rollup_finished_by_next_hour(self):
+        tiers = RollupTiers('1h')
+        for minute in range(60):
+            self.assertEqual(tiers.add(reading(minute * 60, 20.0)), [])
+        points = tiers.add(reading(3600, 30.0))
+        self.assertEqual(len(points), 1)
+        self.assertEqual(points[0]['fields']['temperature_count'], 60)
+
+    def test_series_kept_apart(self):
+        tiers = RollupTiers('1m')
+        tiers.add(reading(0, 1.0))
+        tiers.add({**reading(0, 5.0), 'tags': {'location': 'door'}})
+        points = tiers.add(reading(60, 1.0)) + tiers.add({**reading(60, 5.0), 'tags': {'location': 'door'}})
+        self.assertEqual([point['fields']['temperature_mean'] for point in points], [1.0, 5.0])
+
+    def test_other_readings_ignored(self):
+        tiers = RollupTiers('1m')
+        self.assertEqual(tiers.add({'measurement': 'motion', 'fields': {'count': 1}, 'tags': {}, 'time': START}), [])
+        self.assertEqual(tiers.add({**reading(0, 1.0), 'time': None}), [])
+        self.assertEqual(tiers.add({**reading(0, float('nan'))}), [])
+        self.assertEqual(tiers.buckets, {})
+
+    def test_partial_rollups_survive_restart(self):
+        tiers = RollupTiers('1h', self.state_file)
+        for minute in range(30):
+            tiers.add(reading(minute * 60, 10.0))
+        tiers.close()
+        tiers = RollupTiers('1h', self.state_file)
+        for minute in range(30, 60):
+            tiers.add(reading(minute * 60, 20.0))
+        points = tiers.add(reading(3600, 0.0))
+        self.assertEqual(points[0]['fields']['temperature_count'], 60)
+        self.assertEqual(points[0]['fields']['temperature_mean'], 15.0)
+
+    def test_unreadable_state_ignored(self):
+        with open(self.state_file, 'w') as file:
+            file.write('{"not": "a list"')
+        self.assertEqual(RollupTiers('1h', self.state_file).buckets, {})
+
+    def test_parse_tiers(self):
+        self.assertEqual(parse_tiers('none'), {})
+        self.assertEqual(parse_tiers(''), {})
+        self.assertEqual(parse_tiers('1m,1d'), {'1m': 60, '1d': 86400})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -50,16 +50,33 @@ if [ ! -f "$ENV_FILE" ]; then
 fi
 
 echo "📦 Generating Grafana datasource config from template..."
+export ROLLUP_BUCKET="${INFLUXDB_ROLLUP_BUCKET:-${INFLUXDB_BUCKET}}"
 envsubst < ./grafana/provisioning/datasources/influxdb.yaml.template > ./grafana/provisioning/datasources/influxdb.yaml
 
 echo "🚀 Starting InfluxDB and Grafana using Docker Compose..."
 docker compose up -d
 
+if [ -n "${INFLUXDB_ROLLUP_BUCKET}" ]; then
+  echo "⏳ Waiting for InfluxDB to create the rollup bucket..."
+  until docker exec influxdb influx ping &> /dev/null; do
+    sleep 1
+  done
+  if docker exec influxdb influx bucket list -n "${INFLUXDB_ROLLUP_BUCKET}" -o "${INFLUXDB_ORG}" -t "${INFLUXDB_ADMIN_TOKEN}" &> /dev/null; then
+    echo "✅ Rollup bucket ${INFLUXDB_ROLLUP_BUCKET} already exists."
+  else
+    docker exec influxdb influx bucket create -n "${INFLUXDB_ROLLUP_BUCKET}" -o "${INFLUXDB_ORG}" -t "${INFLUXDB_ADMIN_TOKEN}" > /dev/null
+    echo "✅ Created rollup bucket ${INFLUXDB_ROLLUP_BUCKET}."
+  fi
+fi
+
 echo
 echo "✅ Setup complete!"
 echo "🌐 InfluxDB: http://${SERVER_IP}:${INFLUXDB_PORT}"
 echo "    - Org: ${INFLUXDB_ORG}"
 echo "    - Bucket: ${INFLUXDB_BUCKET}"
+if [ -n "${INFLUXDB_ROLLUP_BUCKET}" ]; then
+  echo "    - Rollup bucket: ${INFLUXDB_ROLLUP_BUCKET}"
+fi
 echo "    - Token: ${INFLUXDB_ADMIN_TOKEN}"
 echo
 echo "🌐 Grafana: http://${SERVER_IP}:${GRAFANA_PORT}"